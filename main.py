@@ -9,13 +9,13 @@ from traceback import format_exc, print_tb
 from typing import Union
 
 import discord
-import pymongo
 from discord.ext import commands
 from discord.ext.commands.core import _convert_to_bool
 
 from src.checks.message_check import check_reply, question_check
 from src.helpers.help import UtilsHelp
 from src.helpers.mongo_helper import MongoDB
+from src.helpers.pool_helper import WorkerPool
 from src.helpers.storage_helper import DataHelper
 from src.storage import config
 from src.storage.token import token  # token.py is just one variable - token = "token"
@@ -36,52 +36,86 @@ class UtilsBot(commands.Bot):
         self.data = DataHelper()
         self.database_handler = None
         self.latest_joins = {}
+        self.latest_joins_updated = None
+        self.latest_joins_lock = asyncio.Lock()
+        self.started_at = time.monotonic()
+        self.time_to_ready = None
+        self.latest_joins_duration = None
         self.restart_event: Union[asyncio.Event, None] = None
         self.mongo: Union[MongoDB, None] = None
         self.restart_waiter_lock = asyncio.Lock()
         self.restart_waiters = 0
+        self.music_triggers_cog = None
+        self.music_triggers = frozenset()
+        # Shared process pool for CPU-heavy work (graphs, scores). Workers start on first use.
+        self.worker_pool = WorkerPool(self.loop, warm_modules=("src.helpers.graph_helper",))
+
+    async def close(self):
+        await self.worker_pool.shutdown()
+        if self.mongo is not None:
+            await self.mongo.close()
+        await super().close()
 
     async def get_guild_prefix(self, guild: discord.Guild):
         if self.mongo is None:
             return ""
-        guild_document = await self.mongo.find_by_id(self.mongo.discord_db.guilds, guild.id)
+        guild_document = await self.mongo.get_guild_document(guild.id)
         return guild_document.get("prefix", "")
 
+    def get_music_triggers(self):
+        """Every "!command" that should go to the music bot rather than us. Rebuilt when the Music cog reloads."""
+        music_cog: commands.Cog = self.get_cog("Music")
+        if music_cog is not self.music_triggers_cog:
+            self.music_triggers_cog = music_cog
+            if music_cog is None:
+                self.music_triggers = frozenset()
+            else:
+                self.music_triggers = frozenset(config.bot_prefix + name for command in music_cog.get_commands()
+                                                for name in [command.name] + list(command.aliases))
+        return self.music_triggers
+
     async def determine_prefix(self, bot, message):
         if not hasattr(message, "guild") or message.guild is None:
             return commands.when_mentioned_or(config.bot_prefix, "u" + config.bot_prefix)(bot, message)
         if self.mongo is None:
             return f"u{config.bot_prefix}"
-        guild_document = await self.mongo.find_by_id(self.mongo.discord_db.guilds, message.guild.id)
+        guild_document = await self.mongo.get_guild_document(message.guild.id)
         if guild_document is None or guild_document.get("prefix") is None:
-            music_cog: commands.Cog = self.get_cog("Music")
-            if music_cog is not None:
-                for command in music_cog.get_commands():
-                    possible_command = [command.name] + command.aliases
-                    possible_command = [config.bot_prefix + x for x in possible_command]
-                    if message.content.split(" ")[0] in possible_command:
-                        return commands.when_mentioned_or("u" + config.bot_prefix)(bot, message)
+            if message.content.split(" ")[0] in self.get_music_triggers():
+                return commands.when_mentioned_or("u" + config.bot_prefix)(bot, message)
             return commands.when_mentioned_or(config.bot_prefix, "u" + config.bot_prefix)(bot, message)
         else:
             guild_prefix = guild_document.get("prefix")
             return commands.when_mentioned_or(guild_prefix, "u" + config.bot_prefix)(bot, message)
 
-    async def get_latest_joins(self):
-        for guild in self.guilds:
-            members = await self.get_sorted_members(guild)
-            self.latest_joins[guild.id] = members
+    async def get_latest_joins(self, force=False):
+        # Joins and leaves keep latest_joins current between runs, so a reconnect doesn't need to redo it.
+        async with self.latest_joins_lock:
+            if not force and self.latest_joins_updated is not None and \
+                    time.monotonic() - self.latest_joins_updated < config.latest_joins_max_age and \
+                    all(guild.id in self.latest_joins for guild in self.guilds):
+                return
+            started_at = time.monotonic()
+            semaphore = asyncio.Semaphore(config.latest_joins_concurrency)
+
+            async def update_guild(guild):
+                async with semaphore:
+                    self.latest_joins[guild.id] = await self.get_sorted_members(guild)
+
+            await asyncio.gather(*[update_guild(guild) for guild in self.guilds])
+            self.latest_joins_updated = time.monotonic()
+            self.latest_joins_duration = self.latest_joins_updated - started_at
 
     async def get_sorted_members(self, guild):
-        members = await guild.fetch_members(limit=None).flatten()
+        members, first_message_times = await asyncio.gather(guild.fetch_members(limit=None).flatten(),
+                                                            self.mongo.get_first_message_times(guild.id))
         members = [member for member in members if not member.bot]
         sorting_members = {member: (member,
                                     member.joined_at.replace(tzinfo=datetime.timezone.utc)) for member in members}
         for member in members:
-            earliest_message = await self.mongo.discord_db.messages.find_one({"user_id": member.id,
-                                                                              "guild_id": guild.id},
-                                                                             sort=[("created_at", pymongo.ASCENDING)])
-            if earliest_message is not None:
-                message_time = earliest_message.get("created_at").replace(tzinfo=datetime.timezone.utc)
+            message_time = first_message_times.get(member.id)
+            if message_time is not None:
+                message_time = message_time.replace(tzinfo=datetime.timezone.utc)
                 if message_time < member.joined_at.replace(tzinfo=datetime.timezone.utc):
                     sorting_members[member] = (member, message_time)
                     member.joined_at = message_time
@@ -166,6 +200,8 @@ def get_bot():
         print("Ready!")
         for extension_name, extension in bot.extensions.items():
             bot.unload_extension(extension_name)
+        if bot.mongo is not None:
+            await bot.mongo.close()
         bot.mongo = MongoDB()
         bot.guild = bot.get_guild(config.monkey_guild_id)
         bot.error_channel = bot.get_channel(config.error_channel_id)
@@ -185,6 +221,9 @@ def get_bot():
             await original_msg.edit(embed=embed)
             os.remove("restart_info.json")
         await bot.get_latest_joins()
+        if bot.time_to_ready is None:
+            bot.time_to_ready = time.monotonic() - bot.started_at
+            print(f"Ready to serve after {bot.time_to_ready:.2f} seconds.")
 
     # noinspection PyUnusedLocal
     @bot.event
@@ -47,13 +47,64 @@ class CommandManager(commands.Cog):
         await enabling_msg.edit(embed=self.bot.create_completed_embed("Enabled.",
                                                                       "Command {} enabled!".format(command_name)))
 
+    @commands.command()
+    @is_owner()
+    async def pool_status(self, ctx):
+        pool = self.bot.worker_pool
+        embed = discord.Embed(title="Worker Pool Status", colour=discord.Colour.blue())
+        embed.add_field(name="Started", value=str(pool.executor is not None))
+        embed.add_field(name="Workers", value=str(pool.max_workers))
+        embed.add_field(name="Running", value=str(pool.running))
+        embed.add_field(name="Queued", value=str(pool.queue_depth))
+        embed.add_field(name="Completed", value=str(pool.completed))
+        embed.add_field(name="Average Wait", value=f"{pool.average_wait:.3f} seconds")
+        embed.add_field(name="Average Run", value=f"{pool.average_run:.3f} seconds")
+        await ctx.reply(embed=embed)
+
+    @commands.command()
+    @is_owner()
+    async def cache_status(self, ctx):
+        caches = {"Guild Documents": self.bot.mongo.guild_cache, "Known Entities": self.bot.mongo.known_entities}
+        embed = discord.Embed(title="Cache Status", colour=discord.Colour.blue())
+        for name, cache in caches.items():
+            embed.add_field(name=name, value=f"Entries: {len(cache)}/{cache.max_size}\n"
+                                             f"Hits: {cache.hits}\n"
+                                             f"Misses: {cache.misses}\n"
+                                             f"Hit Rate: {cache.hit_rate * 100:.2f}%\n"
+                                             f"Evictions: {cache.evictions}")
+        await ctx.reply(embed=embed)
+
+    @commands.command()
+    @is_owner()
+    async def startup_status(self, ctx):
+        embed = discord.Embed(title="Startup Status", colour=discord.Colour.blue())
+        time_to_ready = self.bot.time_to_ready
+        embed.add_field(name="Time To Ready", value="Not ready yet" if time_to_ready is None
+                        else f"{time_to_ready:.2f} seconds")
+        latest_joins_duration = self.bot.latest_joins_duration
+        embed.add_field(name="Member Join Order Build", value="Not built yet" if latest_joins_duration is None
+                        else f"{latest_joins_duration:.2f} seconds")
+        embed.add_field(name="Guilds Cached", value=f"{len(self.bot.latest_joins)}/{len(self.bot.guilds)}")
+        await ctx.reply(embed=embed)
+
+    @commands.command()
+    @is_owner()
+    async def write_status(self, ctx):
+        write_buffer = self.bot.mongo.write_buffer
+        embed = discord.Embed(title="Write Buffer Status", colour=discord.Colour.blue())
+        embed.add_field(name="Pending", value=f"{write_buffer.pending_count}/{write_buffer.max_pending}")
+        embed.add_field(name="Flushes", value=str(write_buffer.flushes))
+        embed.add_field(name="Written", value=str(write_buffer.written))
+        embed.add_field(name="Failed Flushes", value=str(write_buffer.failures))
+        await ctx.reply(embed=embed)
+
     @commands.command()
     @is_high_staff()
     async def prefix(self, ctx, *, new_prefix):
-        guild_document = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.guilds, ctx.guild.id)
-        if guild_document is None:
+        guild_document = await self.bot.mongo.get_guild_document(ctx.guild.id)
+        if not guild_document:
             await self.bot.mongo.insert_guild(ctx.guild)
-        await self.bot.mongo.discord_db.guilds.update_one({"_id": ctx.guild.id}, {"$set": {"prefix": new_prefix}})
+        await self.bot.mongo.update_guild(ctx.guild.id, {"$set": {"prefix": new_prefix}})
         await ctx.reply(embed=self.bot.create_completed_embed("Prefix Updated!", f"Set prefix in this guild to: "
                                                                                  f"{new_prefix} (note that "
                                                                                  f"\"u!command\" "
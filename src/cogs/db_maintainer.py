@@ -1,15 +1,26 @@
+import traceback
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from main import UtilsBot
+from src.storage import config
 
 
 class DBMaintainer(commands.Cog):
     def __init__(self, bot: UtilsBot):
         self.bot = bot
         self.bot.loop.create_task(self.post_init())
+        self.recount_message_stats.start()
+
+    def cog_unload(self):
+        self.recount_message_stats.cancel()
 
     async def post_init(self):
+        await self.bot.mongo.ensure_indexes()
+        await self.bot.mongo.load_known_channels()
+        await self.bot.mongo.load_stats_guilds()
+        self.bot.loop.create_task(self.rebuild_missing_stats())
         for guild in self.bot.guilds:
             await self.bot.mongo.insert_guild(guild)
             for channel in guild.text_channels:
@@ -17,6 +28,27 @@ class DBMaintainer(commands.Cog):
             for member in guild.members:
                 await self.bot.mongo.insert_member(member)
 
+    async def rebuild_missing_stats(self):
+        # One guild at a time, as each is a full pass over its messages. Reads fall back to counting messages until
+        # their guild is done.
+        for guild in self.bot.guilds:
+            if not self.bot.mongo.has_message_stats(guild.id):
+                try:
+                    await self.bot.mongo.rebuild_message_stats(guild.id)
+                except Exception:
+                    print(traceback.format_exc())
+
+    @tasks.loop(hours=config.message_stats_recount_hours, count=None)
+    async def recount_message_stats(self):
+        # The first run would only repeat rebuild_missing_stats.
+        if self.recount_message_stats.current_loop == 0:
+            return
+        for guild in self.bot.guilds:
+            try:
+                await self.bot.mongo.rebuild_message_stats(guild.id)
+            except Exception:
+                print(traceback.format_exc())
+
     @commands.Cog.listener()
     async def on_message(self, message):
         if isinstance(message.channel, discord.DMChannel) or message.channel.guild is None or \
@@ -28,14 +60,11 @@ class DBMaintainer(commands.Cog):
 
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
-        await self.bot.mongo.discord_db.messages.update_one({"_id": payload.message_id},
-                                                            {'$set': {"deleted": True}})
+        await self.bot.mongo.mark_messages_deleted([payload.message_id])
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
-        message_ids = list(payload.message_ids)
-        await self.bot.mongo.discord_db.messages.update_many({"_id": {'$in': message_ids}},
-                                                             {'$set': {"deleted": True}})
+        await self.bot.mongo.mark_messages_deleted(list(payload.message_ids))
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
@@ -43,8 +72,7 @@ class DBMaintainer(commands.Cog):
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
-        await self.bot.mongo.discord_db.members.update_one({"_id": {"user_id": member.id, "guild_id": member.guild.id}},
-                                                           {'$set': {"deleted": True}})
+        await self.bot.mongo.remove_member(member)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
@@ -68,8 +96,7 @@ class DBMaintainer(commands.Cog):
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
         if isinstance(channel, discord.TextChannel):
-            await self.bot.mongo.discord_db.channels.update_one({"_id": channel.id},
-                                                                {'$set': {"deleted": True}})
+            await self.bot.mongo.mark_channel_deleted(channel.id)
 
     @commands.Cog.listener()
     async def on_guild_channel_create(self, channel):
@@ -79,6 +106,8 @@ class DBMaintainer(commands.Cog):
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
         await self.bot.mongo.insert_guild(guild)
+        if not self.bot.mongo.has_message_stats(guild.id):
+            await self.bot.mongo.rebuild_message_stats(guild.id)
         channels = await guild.fetch_channels()
         for channel in channels:
             if isinstance(channel, discord.TextChannel):
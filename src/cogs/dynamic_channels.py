@@ -39,8 +39,7 @@ class DynamicChannels(commands.Cog):
                 old_count = int(old_count)
             except (IndexError, ValueError):
                 old_count = 0
-            count = await self.bot.mongo.discord_db.messages.count_documents({"guild_id": channel.guild.id,
-                                                                              "deleted": False})
+            count = await self.bot.mongo.count_messages(channel.guild.id, undeleted=True)
             if count - old_count > count / 200:
                 print(f"Updating messages. {count - old_count = } and {count / 200 = }")
                 await channel.edit(name=f"Messages: {count:,}")
@@ -1,8 +1,6 @@
-import concurrent.futures
 import inspect
 import secrets
 import traceback
-from functools import partial
 from typing import Optional
 
 import discord
@@ -13,13 +11,15 @@ import humanize as humanize
 from aiohttp import web
 from discord.ext import commands, tasks
 from discord.ext.commands import converter
+from pymongo.errors import BulkWriteError
 
 from src.checks.role_check import is_staff
 from src.checks.user_check import is_owner
 from src.helpers.graph_helper import plot_stats, plot_and_extrapolate
 from src.helpers.hypixel_helper import *
-from src.helpers.hypixel_stats import HypixelStats, create_delta_embeds
+from src.helpers.hypixel_stats import HypixelStats, HypixelStatsHistory, create_delta_embeds
 from src.helpers.paginator import EmbedPaginator
+from src.storage import config
 from src.storage.token import hypixel_token
 
 
@@ -34,29 +34,51 @@ class Hypixel(commands.Cog):
         self.last_reset = datetime.datetime.now()
         # noinspection PyUnresolvedReferences
         self.hypixel_api = HypixelAPI(self.bot, key=hypixel_token)
+        self.card_renderer = CardRenderer(self.bot.loop)
         self.update_hypixel_info.add_exception_type(discord.errors.DiscordServerError)
         self.update_hypixel_info.add_exception_type(discord.errors.HTTPException)
         self.update_hypixel_info.start()
         self.auto_restart.start()
-        self.user_to_files = {}
+        # name.lower() -> CachedCard
+        self.user_to_files = TTLCache(config.hypixel_card_cache_size, ttl=60 * 60,
+                                      max_bytes=config.hypixel_card_cache_bytes, sizeof=lambda card: len(card.data))
+        # name.lower() -> task drawing that card for the website, so simultaneous requests share one render.
+        self.card_refreshes = {}
+        # channel_id -> that channel's slots (see send_embeds), loaded from its channels document on first use.
+        self.channel_slots = {}
+        self.edit_queues: dict[int, ChannelEditQueue] = {}
+        self.poll_scheduler = PollScheduler(config.hypixel_poll_intervals, config.hypixel_dormant_poll_interval)
+        # uuid -> the player as of the last time they were polled, shown again until they're next polled.
+        self.tracked_players = {}
+        # uuid -> HypixelStats of their newest statistics document, loaded by load_latest_stats.
+        self.latest_stats = {}
+        self.latest_stats_loaded = asyncio.Event()
+        self.bot.loop.create_task(self.load_latest_stats())
+        # username.lower() -> uuid, and usernames playerdb says don't exist (for less time, in case they're taken).
+        self.player_uuids = TTLCache(config.hypixel_uuid_cache_size, ttl=config.hypixel_uuid_cache_seconds)
+        self.unknown_players = TTLCache(config.hypixel_uuid_cache_size, ttl=config.hypixel_unknown_player_seconds)
         self.token_last_used = {}
         self.last_ten_updates = []
         self.time_taken = []
         self.user_count = 0
         self.runs = 0
         self.latest_tokens = []
-        self.head_images = {}
+        self.head_images = TTLCache(config.hypixel_head_cache_size, ttl=300,
+                                    max_bytes=config.hypixel_head_cache_bytes, sizeof=len)
         self.external_ip = None
         self.smooth_mode = True
         self.site = None
         self.app = web.Application()
-        self.user_stats_cache = {}
+        # uuid -> (player, last fetched). Kept longer than the 30 seconds it's fresh for, as check_valid_player only
+        # needs to know the player exists.
+        self.user_stats_cache = TTLCache(config.hypixel_stats_cache_size, ttl=10 * 60,
+                                         max_bytes=config.hypixel_stats_cache_bytes)
         self.app.add_routes(
             [web.get("/ping", self.website_ping),
              web.get('/{user}-{uid}.png', self.request_image), web.get('/{user}.png', self.request_image),
              web.get('/{user}', self.request_image), web.get('/{user}-{uid}', self.request_image)])
         self.bot.loop.create_task(self.setup_website())
-        self.bot.loop.create_task(self.hypixel_api.queue_loop())
+        self.hypixel_api.start()
 
     async def setup_website(self):
         """Sets up the website in the bot's loop.
@@ -154,6 +176,9 @@ class Hypixel(commands.Cog):
         """
         # Gets raw information from the API via my rate limit abiding queue in hypixel_helper
         player = await self.hypixel_api.get_player(user_uuid, prioritize)
+        # Players who have never joined (or an API error reply) have no stats to show.
+        if player.get("stats") is None:
+            raise KeyError(f"No stats for {user_uuid}")
         self.bot.loop.create_task(self.store_discord_data(player))
         # They are online if they last logged in after they last logged out
         try:
@@ -180,58 +205,69 @@ class Hypixel(commands.Cog):
 
     async def get_head_image(self, user_uuid):
         # If the head image has been cached less than 5 mins ago, used the cached version
-        if user_uuid in self.head_images and (datetime.datetime.now() -
-                                              self.head_images[user_uuid][1]).total_seconds() < 300:
-            return self.head_images[user_uuid][0]
-        else:
-            # Else fetch it from cravatar, cache it and use that version
-            async with aiohttp.ClientSession() as session:
-                async with session.get("http://cravatar.eu/helmavatar/{}/64.png".format(user_uuid)) as response:
-                    head_image = await response.read()
-                    self.head_images[user_uuid] = (head_image, datetime.datetime.now())
-                    return head_image
+        head_image = self.head_images.get(user_uuid)
+        if head_image is not None:
+            return head_image
+        # Else fetch it from cravatar, cache it and use that version
+        async with aiohttp.ClientSession() as session:
+            async with session.get("http://cravatar.eu/helmavatar/{}/64.png".format(user_uuid)) as response:
+                head_image = await response.read()
+                self.head_images.set(user_uuid, head_image)
+                return head_image
 
-    async def get_expanded_player(self, user_uuid, pool, reset=False, prioritize=False):
+    async def get_expanded_player(self, user_uuid, reset=False, prioritize=False):
         """
 
         :param prioritize: Whether to prioritize this request (normally, if it is a user command).
         :param user_uuid: The minecraft uuid of the player in question.
-        :param pool: Instance of concurrent.futures.ProcessPoolExecutor
         :param reset: Whether to still update the embeds (later) even if the image hasn't changed
         :return: player dictionary with player["file"] being the generated image.
         """
-        if user_uuid in self.user_stats_cache:
-            player, last_checked = self.user_stats_cache[user_uuid]
-            if (datetime.datetime.now() - last_checked).total_seconds() > 30:
-                player = await self.get_user_stats(user_uuid, prioritize)
-        else:
+        player = await self.prepare_player(user_uuid, prioritize)
+        if self.reuse_card(player, reset):
+            return player
+        return await self.finish_player(player, await self.card_renderer.render(player), reset)
+
+    async def prepare_player(self, user_uuid, prioritize=False):
+        """Gets everything needed to draw a player's card."""
+        player, last_checked = self.user_stats_cache.get(user_uuid, (None, None))
+        if player is None or (datetime.datetime.now() - last_checked).total_seconds() > 30:
             player = await self.get_user_stats(user_uuid, prioritize)
-        self.user_stats_cache[user_uuid] = (player, datetime.datetime.now())
+            self.user_stats_cache.set(user_uuid, (player, datetime.datetime.now()))
+        # A copy, so the head image and card added below don't end up in (and bloat) the cached stats.
+        player = dict(player)
         player["head_image"] = await self.get_head_image(player["uuid"])
-        # Run the get_file_for_member function in another process and await its completion
-        member_file = await self.bot.loop.run_in_executor(pool, partial(get_file_for_member, player))
-        last_file = None
-        if not reset:
-            # Check whether the image has changed.
-            if player["name"].lower() in self.user_to_files:
-                last_file = BytesIO(self.user_to_files[player["name"].lower()][0])
-            if last_file is None:
-                same_file = False
-            else:
-                same_file = await self.bot.loop.run_in_executor(pool, partial(are_equal, last_file, member_file))
-                if same_file:
-                    member_file.close()
-                    member_file = last_file
-                else:
-                    last_file.close()
-        else:
-            # If we're resetting, mark the image to be changed in the embed.
-            same_file = False
-        player["file"] = member_file.read()
-        player["unchanged"] = same_file
-        self.user_to_files[player["name"].lower()] = (player["file"], datetime.datetime.now())
-        # Remember to close the file since we're only storing the raw bytes.
-        member_file.close()
+        return player
+
+    def reuse_card(self, player, reset=False):
+        """If nothing drawn on the player's card has changed since it was last rendered, attaches that card to the
+        player and returns True, so it doesn't need rendering (or comparing) again."""
+        name = player["name"].lower()
+        player["fingerprint"] = get_card_fingerprint(player)
+        card = self.user_to_files.get(name)
+        if card is None or card.fingerprint != player["fingerprint"]:
+            return False
+        player["file"] = card.data
+        # If we're resetting, mark the image to be changed in the embed anyway.
+        player["unchanged"] = not reset
+        card.checked_at = datetime.datetime.now()
+        self.user_to_files.set(name, card)
+        return True
+
+    async def finish_player(self, player, member_data, reset=False):
+        """Attaches a freshly rendered card to the player. If the card couldn't be rendered, their last card is used
+        instead (or None is returned if there isn't one)."""
+        name = player["name"].lower()
+        if member_data is None:
+            card = self.user_to_files.get(name)
+            if card is None:
+                return None
+            player["file"] = card.data
+            player["unchanged"] = not reset
+            return player
+        player["file"] = member_data
+        player["unchanged"] = False
+        self.user_to_files.set(name, CachedCard(member_data, player["fingerprint"]))
         return player
 
     @staticmethod
@@ -258,42 +294,86 @@ class Hypixel(commands.Cog):
         """
         # The username as specified in the routes.
         username = request.match_info['user']
-        # The current time.
-        now = datetime.datetime.now()
-        # Checks cache for member, if not in cache data is None and last_timestamp is 0.
-        data, last_timestamp = self.user_to_files.get(username.lower(), (None, datetime.datetime(1970, 1, 1)))
-        # If the user is not cached or the cached version is more than 5 minutes old...
-        if data is None or (now - last_timestamp).total_seconds() > 300:
-            # Convert username into minecraft uuid
-            uuid = await self.uuid_from_identifier(username)
-            # Returns 404 (not found) if the minecraft user doesn't exist.
-            if uuid is None:
-                return web.Response(status=404)
-            # Returns 404 if the user has missing or no bedwars stats.
-            valid = await self.check_valid_player(uuid)
-            if not valid:
-                return web.Response(status=404)
-            # Calls get_expanded_player to get the player dictionary, with a new ProcessPoolExecutor to put the process
-            # in, separate from the embeds so it can execute independently.
-            with concurrent.futures.ProcessPoolExecutor() as pool:
-                player = await self.get_expanded_player(uuid, pool, True)
-            data = player["file"]
-            last_timestamp = datetime.datetime.now()
-            # Caches the image and timestamp
-            self.user_to_files[username.lower()] = (data, last_timestamp)
-        response = web.StreamResponse()
+        # Checks cache for member.
+        card = self.user_to_files.get(username.lower())
+        # If the user is not cached, draw their card while the browser waits.
+        if card is None:
+            status = await self.refresh_card(username)
+            card = self.user_to_files.get(username.lower())
+            if card is None:
+                return web.Response(status=status if status != 200 else 503)
+        # If the cached version is more than 5 minutes old, either send it anyway and redraw it in the background
+        # (stale-while-revalidate), or wait for the new one.
+        elif card.age > 300:
+            if config.hypixel_image_stale_while_revalidate:
+                self.bot.loop.create_task(self.refresh_card(username))
+            else:
+                await self.refresh_card(username)
+                card = self.user_to_files.get(username.lower(), card)
+        headers = {"ETag": card.etag,
+                   # Tells browsers to delete from cache after 15 seconds (45 / 3)
+                   "Cache-Control": "max-age=15"}
+        # The browser already has this card, so there's no need to send it again.
+        if self.card_not_modified(request, card):
+            return web.Response(status=304, headers=headers)
+        response = web.StreamResponse(headers=headers)
         # Specifies it's a png.
         response.content_type = "image/png"
-        response.content_length = len(data)
-        # Tells browsers to delete from cache after 15 seconds (45 / 3)
-        response.headers["Cache-Control"] = "max-age=15"
+        response.content_length = len(card.data)
+        response.last_modified = card.modified_at
         # Sends browser headers.
         await response.prepare(request)
         # Sends image.
-        await response.write(data)
+        await response.write(card.data)
         # Closes connection.
         return response
 
+    @staticmethod
+    def card_not_modified(request: web.Request, card):
+        """Whether the browser's cached copy (per If-None-Match, or If-Modified-Since without it) is card."""
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return any(tag.strip() in ("*", card.etag, "W/" + card.etag) for tag in if_none_match.split(","))
+        if_modified_since = request.if_modified_since
+        return if_modified_since is not None and int(card.modified_at) <= if_modified_since.timestamp()
+
+    async def refresh_card(self, username):
+        """Draws username's card for the website and caches it under username. If it's already being drawn, waits for
+        that instead. Returns the status code to send if it couldn't be drawn, or 200 if it was."""
+        key = username.lower()
+        task = self.card_refreshes.get(key)
+        if task is None:
+            task = self.bot.loop.create_task(self.draw_card(username))
+            self.card_refreshes[key] = task
+            task.add_done_callback(lambda _: self.card_refreshes.pop(key, None))
+        # Shielded, so a browser giving up doesn't cancel the card for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    async def draw_card(self, username):
+        try:
+            # Convert username into minecraft uuid
+            uuid = await self.uuid_from_identifier(username)
+            # Returns 404 (not found) if the minecraft user doesn't exist.
+            if uuid is None:
+                return 404
+            # Returns 404 if the user has missing or no bedwars stats.
+            valid = await self.check_valid_player(uuid)
+            if not valid:
+                return 404
+            # Calls get_expanded_player to get the player dictionary, with the card drawn by the render pool.
+            player = await self.get_expanded_player(uuid, True)
+            if player is None:
+                return 503
+            # get_expanded_player caches it under the player's name, which might not be what was asked for.
+            card = self.user_to_files.get(player["name"].lower())
+            if card is None:
+                return 503
+            self.user_to_files.set(username.lower(), card)
+            return 200
+        except Exception:
+            print(traceback.format_exc())
+            return 503
+
     @commands.command(aliases=["hinfo", "hypixelinfo"])
     async def hypixel_info(self, ctx, username: Optional[str]):
         """Runs the hinfo command.
@@ -302,7 +382,6 @@ class Hypixel(commands.Cog):
         print("Starting hinfo.")
         if username is None:
             username = await self.discord_to_hypixel(ctx.author)
-        now = datetime.datetime.now()
         async with ctx.typing():
             """Checks cache for file. Can probably be extrapolated into a method, but this replies to the calling
             command with information about why it failed if it does, rather than web status codes.
@@ -313,8 +392,8 @@ class Hypixel(commands.Cog):
             if username is None or uuid is None:
                 return
             username = await self.username_from_uuid(uuid)
-            data, last_timestamp = self.user_to_files.get(username.lower(), (None, datetime.datetime(1970, 1, 1)))
-            if data is None or (now - last_timestamp).total_seconds() > 300:
+            card = self.user_to_files.get(username.lower())
+            if card is None or card.age > 300:
                 print("running check valid.")
                 valid = await self.check_valid_player(uuid, prioritize=True)
                 print("check valid done.")
@@ -322,12 +401,16 @@ class Hypixel(commands.Cog):
                     await ctx.reply(embed=self.bot.create_error_embed("That user hasn't played on hypixel. Get them to "
                                                                       "log in (and out!) at least once."))
                     return
-                with concurrent.futures.ProcessPoolExecutor() as pool:
-                    print("running get expanded player")
-                    player = await self.get_expanded_player(uuid, pool, True, prioritize=True)
+                print("running get expanded player")
+                player = await self.get_expanded_player(uuid, True, prioritize=True)
                 print("expanded player done")
+                if player is None:
+                    await ctx.reply(embed=self.bot.create_error_embed("Drawing that player's card took too long, "
+                                                                      "please try again."))
+                    return
                 data = player["file"]
-                self.user_to_files[username.lower()] = (data, datetime.datetime.now())
+            else:
+                data = card.data
             # Wraps the data (bytes) in file-like object so discord.py can take it as a file.
             file = BytesIO(data)
             discord_file = discord.File(fp=file, filename=f"{username}.png")
@@ -368,7 +451,9 @@ class Hypixel(commands.Cog):
         channel_collection = self.hypixel_db.channels
         async for old_channel in channel_collection.find({"guild_id": ctx.guild.id}):
             await self.delete_channel_from_all_users(old_channel.get("_id"))
+            self.forget_channel(old_channel.get("_id"))
         await channel_collection.delete_many({"guild_id": ctx.guild.id})
+        self.forget_channel(channel.id)
         channel_document = {"_id": channel.id, "guild_id": ctx.guild.id}
         await self.bot.mongo.force_insert(channel_collection, channel_document)
         await sent.edit(embed=self.bot.create_completed_embed("Added Channel!",
@@ -381,27 +466,36 @@ class Hypixel(commands.Cog):
             channels.remove(channel_id)
             await self.hypixel_db.players.update_one({"_id": player.get("_id")}, {"$set": {"channels": channels}})
 
-    @staticmethod
-    async def uuid_from_identifier(identifier):
+    async def uuid_from_identifier(self, identifier):
         """Makes a request to playerdb.co (higher ratelimit than mojang) to get the UUID from a username.
+        Answers (including "no such player") are cached, see player_uuids and unknown_players.
         :param identifier: Either a username or uuid of a player. Could be neither then will return None.
         :return: The player's UUID or None, if it is not a valid UUID.
         """
         try:
             if mcuuid.tools.is_valid_mojang_uuid(identifier):
                 return identifier.replace("-", "")
-            else:
-                async with aiohttp.ClientSession() as session:
-                    request = await session.get("https://playerdb.co/api/player/minecraft/" + identifier)
-                    if request.status != 200:
-                        return None
-                    json_response = await request.json()
-                    if not json_response.get("success", False):
-                        return None
-                    prospective_uuid = json_response.get("data", {}).get("player", {}).get("id", None)
-                    if prospective_uuid is not None:
-                        return prospective_uuid.replace("-", "")
-                    return prospective_uuid
+            key = identifier.lower()
+            uuid = self.player_uuids.get(key)
+            if uuid is not None:
+                return uuid
+            if self.unknown_players.get(key) is not None:
+                return None
+            async with aiohttp.ClientSession() as session:
+                request = await session.get("https://playerdb.co/api/player/minecraft/" + identifier)
+                if request.status != 200:
+                    # Server errors might not be the player's fault, so only client errors are remembered.
+                    if 400 <= request.status < 500 and request.status != 429:
+                        self.unknown_players.set(key, True)
+                    return None
+                json_response = await request.json()
+                prospective_uuid = json_response.get("data", {}).get("player", {}).get("id", None)
+                if not json_response.get("success", False) or prospective_uuid is None:
+                    self.unknown_players.set(key, True)
+                    return None
+                uuid = prospective_uuid.replace("-", "")
+                self.player_uuids.set(key, uuid)
+                return uuid
         except AttributeError:
             return None
 
@@ -432,12 +526,12 @@ class Hypixel(commands.Cog):
         :return: True if they are a valid BedWars player, False if not or undetermined.
         """
         try:
-            if uuid in self.user_stats_cache:
+            if self.user_stats_cache.get(uuid) is not None:
                 return True
             # noinspection PyUnboundLocalVariable
             stats = await self.get_user_stats(uuid, prioritize)
-            self.user_stats_cache[uuid] = (stats, datetime.datetime.now())
-        except (TypeError, KeyError):
+            self.user_stats_cache.set(uuid, (stats, datetime.datetime.now()))
+        except (TypeError, KeyError, HypixelAPIError):
             return False
         return True
 
@@ -515,69 +609,140 @@ class Hypixel(commands.Cog):
             await ctx.reply(embed=self.bot.create_error_embed("You don't have a hypixel channel!"))
 
     async def send_embeds(self, channel_id, our_members):
-        """Sends all embeds to a channel that the channel is requesting.
+        """Brings a channel's messages in line with the members the channel is requesting.
+
+        Each member has a slot in the channel: one message, remembered (with the name and card fingerprint on it) in
+        the channel's document. Only slots whose member or card changed are edited, through the channel's edit queue,
+        and slots are added or deleted at the end as members come and go. The channel's history is only read (to purge
+        it) the first time, or if one of its messages has been deleted.
         :param channel_id: The channel id in question
         :param our_members: The member dictionaries that the channel is requesting
         """
-        i = 0
-        try:
-            channel = await self.bot.fetch_channel(channel_id)
-        except discord.errors.NotFound:
-            channel = None
-        except discord.errors.Forbidden:
-            channel = None
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            try:
+                channel = await self.bot.fetch_channel(channel_id)
+            except (discord.errors.NotFound, discord.errors.Forbidden):
+                channel = None
         if channel is None:
             await self.hypixel_db.channels.delete_many({"_id": channel_id})
             await self.delete_channel_from_all_users(channel_id)
+            self.forget_channel(channel_id)
             return
-        history = await channel.history(limit=None, oldest_first=True).flatten()
-        editable_messages = [message for message in history if message.author == self.bot.user]
-        member_files = [member["file"] for member in our_members]
-        if (len(editable_messages) != len(our_members) or
-                len([message for message in editable_messages if len(message.embeds) == 1]) != len(our_members)):
+        queue = self.edit_queues.get(channel_id)
+        if queue is None:
+            queue = ChannelEditQueue(self.bot.loop, channel)
+            self.edit_queues[channel_id] = queue
+        slots = self.channel_slots.get(channel_id)
+        if slots is None:
+            channel_document = await self.hypixel_db.channels.find_one({"_id": channel_id}) or {}
+            slots = channel_document.get("slots")
+        changed = False
+        if slots is None or len(queue.missing) > 0:
+            queue.clear()
             await channel.purge(limit=None)
-            new_messages = True
-        else:
-            new_messages = False
-        for member, file in zip(our_members, member_files):
+            slots = []
+            changed = True
+        for index, member in enumerate(our_members):
+            if index < len(slots) and slots[index]["name"] == member["name"] and \
+                    slots[index].get("fingerprint") == member["fingerprint"] and member["unchanged"]:
+                continue
             token = secrets.token_urlsafe(6).replace("-", "")
             embed = await self.get_user_embed(member)
             embed.set_image(url="https://hypixel.thom.club/{}-{}.png".format(member["name"], token))
-            if new_messages:
-                await channel.send(embed=embed)
+            slot = {"name": member["name"], "fingerprint": member["fingerprint"]}
+            if index < len(slots):
+                queue.edit(slots[index]["message_id"], embed)
+                slots[index].update(slot)
             else:
-                embed_member_name = editable_messages[i].embeds[0].title
-                if embed_member_name != member["name"] or not member["unchanged"]:
-                    await editable_messages[i].edit(embed=embed)
-                i += 1
-
-    async def get_with_storage(self, player_dictionary, pool, reset):
-        player_data = await self.get_expanded_player(player_dictionary.get("_id"), pool, reset)
+                message = await channel.send(embed=embed)
+                slots.append({"message_id": message.id, **slot})
+            changed = True
+        for slot in slots[len(our_members):]:
+            queue.discard(slot["message_id"])
+            try:
+                await channel.get_partial_message(slot["message_id"]).delete()
+            except discord.errors.NotFound:
+                pass
+            changed = True
+        del slots[len(our_members):]
+        self.channel_slots[channel_id] = slots
+        if changed:
+            await self.hypixel_db.channels.update_one({"_id": channel_id}, {"$set": {"slots": slots}})
+
+    def forget_channel(self, channel_id):
+        self.channel_slots.pop(channel_id, None)
+        queue = self.edit_queues.pop(channel_id, None)
+        if queue is not None:
+            queue.close()
+
+    async def load_latest_stats(self):
+        """Makes sure statistics has its (uuid, timestamp) index, then loads every tracked player's newest statistics
+        with one aggregation (which that index answers)."""
+        try:
+            await self.hypixel_db.statistics.create_index([("uuid", 1), ("timestamp", 1)])
+            tracked_uuids = await self.hypixel_db.players.distinct("_id")
+            pipeline = [{"$match": {"uuid": {"$in": tracked_uuids}}},
+                        {"$sort": {"uuid": -1, "timestamp": -1}},
+                        {"$group": {"_id": "$uuid", "stats": {"$first": "$stats"}}}]
+            async for document in self.hypixel_db.statistics.aggregate(pipeline, allowDiskUse=True):
+                self.latest_stats[document["_id"]] = HypixelStats.from_dict(document["stats"])
+        except Exception:
+            # Anyone missing is looked up when they're next stored instead.
+            print(traceback.format_exc())
+        finally:
+            self.latest_stats_loaded.set()
+
+    async def get_latest_stats(self, uuid):
+        last_stats = self.latest_stats.get(uuid)
+        if last_stats is None:
+            last_document = await self.get_player_stats(uuid)
+            if last_document is not None:
+                last_stats = HypixelStats.from_dict(last_document["stats"])
+                self.latest_stats[uuid] = last_stats
+        return last_stats
+
+    async def new_stats_documents(self, player_data):
+        """The statistics documents to insert for the games a player has played since their newest stored ones (or a
+        first one for a new player)."""
         stats = player_data.get("stats")
         bedwars = stats.get("Bedwars")
         uuid = player_data.get("uuid")
         try:
             hypixel_stats = HypixelStats.from_stats(bedwars)
         except (KeyError, AttributeError):
-            return player_data
-        last_document_query = self.hypixel_db.statistics.find({"uuid": uuid}).sort("timestamp", -1).limit(1)
-        last_document_list = await last_document_query.to_list(length=1)
-        if len(last_document_list) != 0:
-            last_document = last_document_list[0]
-            last_stats_dict = last_document["stats"]
-            last_stats = HypixelStats.from_dict(last_stats_dict)
-            if last_stats.games_played == hypixel_stats.games_played:
-                return player_data
-            stats_to_insert = HypixelStats.split_up(last_stats, hypixel_stats)
-            for statistic in stats_to_insert:
-                player_document = {"uuid": uuid, "stats": statistic.to_dict(),
-                                   "timestamp": datetime.datetime.now()}
-                await self.hypixel_db.statistics.insert_one(player_document)
+            return []
+        last_stats = await self.get_latest_stats(uuid)
+        if last_stats is None:
+            stats_to_insert = [hypixel_stats]
+        elif last_stats.games_played == hypixel_stats.games_played:
+            return []
         else:
-            player_document = {"uuid": uuid, "stats": hypixel_stats.to_dict(),
-                               "timestamp": datetime.datetime.now()}
-            await self.hypixel_db.statistics.insert_one(player_document)
-        return player_data
+            stats_to_insert = HypixelStats.split_up(last_stats, hypixel_stats)
+        return [{"uuid": uuid, "stats": statistic.to_dict(), "timestamp": datetime.datetime.now()}
+                for statistic in stats_to_insert]
+
+    async def store_stats(self, members):
+        """Stores any new statistics for members, with one insert_many for all of them."""
+        await self.latest_stats_loaded.wait()
+        documents = [document for member_documents in
+                     await asyncio.gather(*[self.new_stats_documents(member) for member in members])
+                     for document in member_documents]
+        if len(documents) == 0:
+            return
+        try:
+            await self.hypixel_db.statistics.insert_many(documents, ordered=False)
+            failed = set()
+        except BulkWriteError as e:
+            # The rest went in, so they mustn't be inserted again next time.
+            write_errors = e.details.get("writeErrors", [])
+            failed = set(x.get("index") for x in write_errors)
+            for write_error in write_errors:
+                print(f"Couldn't store statistics: {write_error.get('errmsg')}")
+        # Only once they're stored, so anything that failed to insert is tried again next time.
+        for index, document in enumerate(documents):
+            if index not in failed:
+                self.latest_stats[document["uuid"]] = HypixelStats.from_dict(document["stats"])
 
     @commands.command()
     async def track_player(self, ctx, username: Optional[str]):
@@ -615,19 +780,50 @@ class Hypixel(commands.Cog):
             # Gets a list of players.
             players_query = self.hypixel_db.players.find()
             all_players = await players_query.to_list(length=None)
+            watched = {player_dict.get("_id"): len(player_dict.get("channels", [])) > 0 for player_dict in all_players}
+            untracked = [uuid for uuid in self.tracked_players if uuid not in watched]
+            for uuid in untracked:
+                self.tracked_players.pop(uuid)
+                self.latest_stats.pop(uuid, None)
+            self.poll_scheduler.forget(untracked)
             now = datetime.datetime.now()
             # Completely refresh the embeds every 3 minutes. Just so last update time isn't more than 3 mins ago.
             reset = (now - self.last_reset).total_seconds() > 180
             # Fetches hypixel data in the main thread, then
-            # runs a pool of processes (machine core count simultaneously) to generate the player images.
-            member_futures = []
+            # hands every card to the render pool in one go, split into a batch per worker.
             if reset:
                 self.last_reset = datetime.datetime.now()
-            with concurrent.futures.ProcessPoolExecutor() as pool:
-                for player_dict in all_players:
-                    member_futures.append(self.bot.loop.create_task(self.get_with_storage(player_dict, pool,
-                                                                                          reset)))
-                member_dicts = await asyncio.gather(*member_futures)
+            # Only players that are due (see PollScheduler) are fetched, within the tracker's share of the rate limit.
+            to_poll = self.poll_scheduler.due(list(watched), self.poll_budget())
+            results = await asyncio.gather(*[self.prepare_player(uuid) for uuid in to_poll], return_exceptions=True)
+            players = []
+            # A player that couldn't be fetched is skipped this tick, rather than taking everyone else down with it.
+            for uuid, result in zip(to_poll, results):
+                if isinstance(result, Exception):
+                    self.poll_scheduler.failed(uuid)
+                    if not isinstance(result, (HypixelAPIError, KeyError)):
+                        print("".join(traceback.format_exception(type(result), result, result.__traceback__)))
+                    continue
+                players.append(result)
+            for player in players:
+                self.poll_scheduler.record(player, watched[player["uuid"]])
+            # Players whose cards would come out the same as last time (most offline players) aren't drawn at all.
+            reused = [self.reuse_card(player, reset) for player in players]
+            member_dicts = [player for player, was_reused in zip(players, reused) if was_reused]
+            to_render = [player for player, was_reused in zip(players, reused) if not was_reused]
+            member_data = await self.card_renderer.render_many(to_render)
+            for player, data in zip(to_render, member_data):
+                if await self.finish_player(player, data, reset) is not None:
+                    member_dicts.append(player)
+            await self.store_stats(member_dicts)
+            for member in member_dicts:
+                # Without the card and stats, which only matter the tick they were fetched.
+                self.tracked_players[member["uuid"]] = {key: value for key, value in member.items()
+                                                        if key not in ("file", "head_image", "stats")}
+            polled = {member["uuid"] for member in member_dicts}
+            # Everyone else is shown as they were, and their slots are left alone.
+            member_dicts += [dict(member, unchanged=True) for uuid, member in self.tracked_players.items()
+                             if uuid not in polled]
             # Sort offline members before online members, regardless of threat index.
             offline_members = [member for member in member_dicts if not member["online"]]
             online_members = [member for member in member_dicts if member["online"]]
@@ -635,20 +831,21 @@ class Hypixel(commands.Cog):
             online_members.sort(key=lambda x: float(x["threat_index"]))
             member_dicts = offline_members + online_members
             self.user_count = len(member_dicts)
-            # Runs send_embeds task for all known hypixel channels.
+            # Runs send_embeds task for all known hypixel channels, using the channels on the players fetched above.
+            channel_uuids = {}
+            for player_dict in all_players:
+                for channel_id in player_dict.get("channels", []):
+                    channel_uuids.setdefault(channel_id, set()).add(player_dict.get("_id"))
             pending_tasks = []
-            all_channel_ids = await self.hypixel_db.players.distinct("channels")
-            for channel_id in all_channel_ids:
-                find_query = self.hypixel_db.players.find({"channels": channel_id})
-                channel_uuids = [x.get("_id") for x in await find_query.to_list(length=None)]
-                channel_members = []
-                for member in member_dicts:
-                    if member["uuid"] in channel_uuids:
-                        channel_members.append(member)
+            for channel_id, uuids in channel_uuids.items():
+                # Until everyone on a channel has been fetched at least once (the first few ticks, if the budget can't
+                # cover every player), it's left as it is, rather than dropping and re-adding the rest's slots.
+                if any(uuid not in self.tracked_players and not self.poll_scheduler.attempted(uuid) for uuid in uuids):
+                    continue
+                channel_members = [member for member in member_dicts if member["uuid"] in uuids]
                 pending_tasks.append(self.bot.loop.create_task(
                     self.send_embeds(channel_id, channel_members)))
-            # Runs them simultaneously so we can send/edit (5 * channel_count) messages at once rather than just 5 at
-            # a time (very slow)
+            # Runs them simultaneously. The edits themselves are done by each channel's edit queue in the background.
             await asyncio.gather(*pending_tasks)
             if len(self.last_ten_updates) > 9:
                 self.last_ten_updates.pop(0)
@@ -663,6 +860,11 @@ class Hypixel(commands.Cog):
             print(e)
             print(traceback.format_exc())
 
+    def poll_budget(self):
+        """How many requests the tracker may make each update, leaving the rest of the rate limit for the others."""
+        per_minute = self.hypixel_api.ratelimit_limit * config.hypixel_tracker_rate_share
+        return max(1, int(per_minute * self.update_hypixel_info.seconds / 60))
+
     @commands.command(aliases=["hstatus"], description="Gives information about the current status of hypixel info.")
     async def hypixel_status(self, ctx):
         embed = discord.Embed(title="Current Hypixel Info Status")
@@ -684,7 +886,34 @@ class Hypixel(commands.Cog):
         average_request_time = round(average_request_time, 2)
         embed.add_field(name="Average Time For Requests", value=f"{average_request_time} seconds")
         embed.add_field(name="Total Players", value=f"{self.user_count}")
+        embed.add_field(name="Players Polled", value=f"{self.poll_scheduler.polled} last update "
+                                                     f"({self.poll_scheduler.deferred} due but deferred)")
         embed.add_field(name="Times Ran", value=humanize.intword(self.runs))
+        hypixel_api = self.hypixel_api
+        embed.add_field(name="API Queue", value=f"{len(hypixel_api.queues[True])} prioritized, "
+                                                f"{len(hypixel_api.queues[False])} other")
+        embed.add_field(name="API Requests In Flight", value=f"{hypixel_api.in_flight}")
+        embed.add_field(name="Average API Queue Wait", value=f"{hypixel_api.average_queue_wait:.2f} seconds")
+        embed.add_field(name="API Rate Limited", value=f"{hypixel_api.rate_limited_fraction * 100:.2f}% "
+                                                       f"({hypixel_api.retries} retries, "
+                                                       f"{hypixel_api.failures} failed)")
+        card_renderer = self.card_renderer
+        embed.add_field(name="Card Renders", value=f"{card_renderer.renders} "
+                                                   f"(average {card_renderer.average_render * 1000:.0f}ms, "
+                                                   f"slowest {card_renderer.slowest_render * 1000:.0f}ms, "
+                                                   f"{card_renderer.failures} failed)")
+        edit_queues = self.edit_queues.values()
+        embed.add_field(name="Message Edits", value=f"{sum(queue.edits for queue in edit_queues)} made, "
+                                                    f"{sum(len(queue.pending) for queue in edit_queues)} queued, "
+                                                    f"{sum(queue.replaced for queue in edit_queues)} superseded")
+        embed.add_field(name="API Requests Saved", value=f"{hypixel_api.coalesced} shared, "
+                                                         f"{hypixel_api.response_cache.hits} cached")
+        for name, cache in {"Card Cache": self.user_to_files, "Head Cache": self.head_images,
+                            "Stats Cache": self.user_stats_cache}.items():
+            embed.add_field(name=name, value=f"{len(cache)}/{cache.max_size} entries, "
+                                             f"{humanize.naturalsize(cache.total_bytes)}/"
+                                             f"{humanize.naturalsize(cache.max_bytes)}\n"
+                                             f"{cache.hit_rate * 100:.2f}% hit rate, {cache.evictions} evictions")
         embed.timestamp = self.last_ten_updates[-1]
         if time_since_last.total_seconds() < 300:
             embed.colour = discord.Colour.green()
@@ -903,28 +1132,28 @@ class Hypixel(commands.Cog):
     async def get_game_stats(self, ctx, username, num_games):
         username, uuid = await self.true_username_and_uuid(ctx, username)
         if username is None or uuid is None:
-            return None, None
-        document_query = self.hypixel_db.statistics.find({"uuid": uuid}).sort("timestamp", -1).limit(num_games)
+            return None, None, None
+        document_query = self.hypixel_db.statistics.find({"uuid": uuid}, {"_id": 0, "stats": 1}).sort(
+            "timestamp", -1).limit(num_games)
         all_documents = await document_query.to_list(length=None)
         if len(all_documents) == 0:
             await ctx.reply(embed=self.bot.create_error_embed(f"{username} is not being tracked."))
             return None, None, None
-        # Oldest -> Newest list of HypixelStats objects, each representing stats after a game.
-        all_stats = [HypixelStats.from_dict(x.get("stats")) for x in all_documents[::-1]]
+        # Oldest -> Newest history, with each statistic's value after each game.
+        all_stats = HypixelStatsHistory.from_documents(all_documents[::-1])
         return all_stats, username, uuid
 
     async def graph_stats(self, ctx, username, num_games, attribute, nice_name):
         all_stats, username, uuid = await self.get_game_stats(ctx, username, num_games)
         if all_stats is None:
             return
-        all_important = [getattr(x, attribute) for x in all_stats]
+        all_important = getattr(all_stats, attribute)
         if len(all_important) == 1:
             await ctx.reply(embed=self.bot.create_error_embed(f"I can't graph {username}'s data over time. I have "
                                                               f"only tracked one game!\n\nGo play some more bedwars!"))
             return
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            data = await self.bot.loop.run_in_executor(pool, partial(plot_stats, all_important, x_label="Games",
-                                                                     y_label=nice_name, smooth=self.smooth_mode))
+        data = await self.bot.worker_pool.run(plot_stats, all_important, x_label="Games", y_label=nice_name,
+                                              smooth=self.smooth_mode)
         file = BytesIO(data)
         discord_file = discord.File(file, filename="image.png")
         embed = discord.Embed(title=f"{username}'s {nice_name} over the last {len(all_important) - 1} games")
@@ -984,10 +1213,8 @@ class Hypixel(commands.Cog):
             await ctx.reply(embed=self.bot.create_error_embed(f"I can't extrapolate {username}'s data. I have only "
                                                               f"tracked one game! \nGo play some more bedwars!"))
             return
-        all_important = [getattr(x, attribute) for x in all_stats]
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            games_estimated = await self.bot.loop.run_in_executor(pool, partial(extrapolate_threat_index,
-                                                                                all_important, amount))
+        all_important = getattr(all_stats, attribute)
+        games_estimated = await self.bot.worker_pool.run(extrapolate_threat_index, all_important, amount)
         if games_estimated == float("inf"):
             games_estimated = str("Infinite")
         else:
@@ -1005,8 +1232,8 @@ class Hypixel(commands.Cog):
 
         await ctx.reply(embed=embed)
 
-    async def get_y_function(self, pool, input_threat_indexes: list[int]):
-        a, b, c, d = await self.bot.loop.run_in_executor(pool, partial(run_curve_fit, input_threat_indexes))
+    async def get_y_function(self, input_threat_indexes: list[int]):
+        a, b, c, d = await self.bot.worker_pool.run(run_curve_fit, input_threat_indexes)
 
         def fit_function(x):
             return (a ** (x * b + c)) + d
@@ -1021,15 +1248,12 @@ class Hypixel(commands.Cog):
             await ctx.reply(embed=self.bot.create_error_embed(f"I can't extrapolate {username}'s data. I have only "
                                                               f"tracked one game! \nGo play some more bedwars!"))
             return
-        all_important = [getattr(x, attribute) for x in all_stats]
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            y_func = await self.get_y_function(pool, all_important)
-            extrapolate_max = int(round(0.5 * len(all_important))) - 1
-            values = numpy.arange(0, len(all_important) + extrapolate_max, 1)
-            data = await self.bot.loop.run_in_executor(pool, partial(plot_and_extrapolate, all_important,
-                                                                     y_func(values),
-                                                                     x_label="Games", y_label=pretty_name,
-                                                                     smooth=self.smooth_mode))
+        all_important = getattr(all_stats, attribute)
+        y_func = await self.get_y_function(all_important)
+        extrapolate_max = int(round(0.5 * len(all_important))) - 1
+        values = numpy.arange(0, len(all_important) + extrapolate_max, 1)
+        data = await self.bot.worker_pool.run(plot_and_extrapolate, all_important, y_func(values), x_label="Games",
+                                              y_label=pretty_name, smooth=self.smooth_mode)
         file = BytesIO(data)
         discord_file = discord.File(file, "image.png")
         embed = discord.Embed(title=f"Future Prediction for {username}'s {pretty_name}")
@@ -1071,3 +1295,7 @@ def setup(bot):
 def teardown(bot):
     cog = bot.get_cog("Hypixel")
     bot.loop.create_task(cog.shutdown_website())
+    bot.loop.create_task(cog.hypixel_api.close())
+    bot.loop.create_task(cog.card_renderer.shutdown())
+    for queue in cog.edit_queues.values():
+        queue.close()
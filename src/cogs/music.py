@@ -432,9 +432,8 @@ class Music(commands.Cog):
         data = await YTDLSource.get_video_data(next_song_url, self.bot.loop)
         source = YTDLSource(discord.FFmpegPCMAudio(data["url"], **local_ffmpeg_options),
                             data=data, volume=volume, resume_from=resume_from)
-        if voice_client.guild.id in self.tts_cog.guild_queues:
-            while len(self.tts_cog.guild_queues[voice_client.guild.id]) > 0:
-                await asyncio.sleep(0.1)
+        while self.tts_cog.queued(voice_client.guild.id) > 0:
+            await asyncio.sleep(0.1)
         while voice_client.is_playing():
             await asyncio.sleep(0.1)
         voice_client.play(source, after=lambda e: self.bot.loop.create_task(self.play_next_queued(voice_client)))
@@ -21,14 +21,12 @@ class OGCog(commands.Cog):
         guild_document = await self.og_coll.find_one({"_id": member.guild.id})
         assert guild_document is not None and guild_document.get("date", None) is not None
         og_date = guild_document.get("date").replace(tzinfo=datetime.timezone.utc)
-        earliest_message = await self.bot.mongo.discord_db.messages.find_one({"user_id": member.id,
-                                                                              "guild_id": member.guild.id},
-                                                                             sort=[("created_at", pymongo.ASCENDING)])
+        first_message_at = await self.bot.mongo.get_first_message_at(member.id, member.guild.id)
         first_join_date = member.joined_at
         # noinspection SpellCheckingInspection
         first_join_date = first_join_date.replace(tzinfo=datetime.timezone.utc)
-        if earliest_message is not None:
-            first_message_date = earliest_message.get("created_at").replace(tzinfo=datetime.timezone.utc)
+        if first_message_at is not None:
+            first_message_date = first_message_at.replace(tzinfo=datetime.timezone.utc)
             return first_message_date < og_date or first_join_date < og_date
         return first_join_date < og_date
 
@@ -26,7 +26,7 @@ class Purge(commands.Cog):
     @is_staff()
     async def purge_internal(self, ctx, amount: int = None, disable_bulk: bool = False,
                              member: Optional[discord.Member] = None):
-        guild_doc = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.guilds, ctx.guild.id)
+        guild_doc = await self.bot.mongo.get_guild_document(ctx.guild.id)
         purge_max = guild_doc.get("purge_max", 40)
         bulk = True
         check = check_pinned
@@ -81,7 +81,7 @@ class Purge(commands.Cog):
 
     @purge.command(aliases=["max"])
     async def maximum(self, ctx, maximum: int):
-        await self.bot.mongo.discord_db.guilds.update_one({"_id": ctx.guild.id}, {"$set": {"purge_max": maximum}})
+        await self.bot.mongo.update_guild(ctx.guild.id, {"$set": {"purge_max": maximum}})
         await ctx.reply(embed=self.bot.create_completed_embed("Set Purge Maximum", f"New purge maximum is {maximum}!"))
 
 
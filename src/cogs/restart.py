@@ -93,6 +93,8 @@ class Restart(commands.Cog):
                 await asyncio.sleep(0.05)
         except AttributeError:
             pass
+        await self.bot.worker_pool.shutdown()
+        await self.bot.mongo.close()
 
     @commands.command()
     @is_owner()
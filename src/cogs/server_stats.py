@@ -1,7 +1,5 @@
 import asyncio
-import concurrent.futures
 import datetime
-from functools import partial
 from io import BytesIO
 from typing import Optional
 
@@ -14,9 +12,10 @@ from main import UtilsBot
 from src.checks.role_check import is_high_staff, is_staff
 from src.checks.user_check import is_owner
 from src.helpers.api_helper import *
+from src.helpers.backfill_helper import BackfillScheduler, ProgressReporter
 from src.helpers.graph_helper import pie_chart_from_amount_and_labels, file_from_timestamps
+from src.helpers.score_helper import ScoreEngine
 from src.helpers.storage_helper import DataHelper
-from src.helpers.sync_mongo_helper import get_guild_score, get_user_score
 from src.storage import config
 
 exceptions = (asyncio.exceptions.TimeoutError, aiohttp.client_exceptions.ServerDisconnectedError,
@@ -32,13 +31,62 @@ class Statistics(commands.Cog):
         self.session = aiohttp.ClientSession()
         self.restarting = False
         self.data = DataHelper()
-        self.last_update = self.bot.create_processing_embed("Working...", "Starting processing!")
-        self.last_ping = datetime.datetime.now()
-        self.active_channel_ids = []
-        self.running = False
-        self.channel_lock = asyncio.Lock()
+        self.score_engine = ScoreEngine(self.bot.mongo)
+        self.backfill = BackfillScheduler(self.bot.mongo, self.add_messages_to_db,
+                                          concurrency=config.backfill_concurrency,
+                                          requests_per_second=config.backfill_requests_per_second)
+        self.progress_reporter = ProgressReporter(self.bot)
+        self.backfill.add_observer(self.progress_reporter)
         self.update_motw.start()
+        self.flush_scores.start()
+        self.flush_checkpoints.change_interval(seconds=config.backfill_checkpoint_seconds)
+        self.flush_checkpoints.start()
         self.bot.loop.create_task(self.startup_check())
+        self.bot.loop.create_task(self.restart_watcher())
+
+    def cog_unload(self):
+        self.flush_scores.cancel()
+        self.flush_checkpoints.cancel()
+        self.bot.loop.create_task(self.score_engine.flush())
+        self.bot.loop.create_task(self.backfill.flush_checkpoints())
+
+    async def restart_watcher(self):
+        if self.bot.restart_event is None:
+            self.bot.restart_event = asyncio.Event()
+        await self.bot.restart_event.wait()
+        async with self.bot.restart_waiter_lock:
+            self.bot.restart_waiters += 1
+        try:
+            await self.score_engine.flush()
+            await self.backfill.flush_checkpoints()
+        finally:
+            async with self.bot.restart_waiter_lock:
+                self.bot.restart_waiters -= 1
+
+    @tasks.loop(seconds=60, count=None)
+    async def flush_scores(self):
+        await self.score_engine.flush()
+
+    @tasks.loop(seconds=10, count=None)
+    async def flush_checkpoints(self):
+        await self.backfill.flush_checkpoints()
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.guild is None or not isinstance(message.author, discord.Member):
+            return
+        if bool(message.flags.value & 1 << 6):  # If message is ephemeral
+            return
+        self.score_engine.add_message(message)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if not member.bot:
+            self.score_engine.add_member(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.score_engine.remove_member(member.guild.id, member.id)
 
     @commands.command()
     @is_owner()
@@ -59,157 +107,92 @@ class Statistics(commands.Cog):
 
     async def startup_check(self):
         query = self.bot.mongo.discord_db.loading_stats.find({"active": True})
+        reports = {}
         async for channel_document in query:
             channel = self.bot.get_channel(channel_document.get("_id"))
+            if channel is None:
+                continue
             sent_message_id = channel_document.get("sent_message_id", None)
-            self.bot.loop.create_task(self.load_channel(channel, sent_message_id))
-        if not self.running:
-            self.bot.loop.create_task(self.update_embeds())
-
-    async def update_embeds(self):
-        self.running = True
-        pipeline = [
-            {
-                "$project": {"_id": "$guild_id"}
-            }
-        ]
-        aggregation = self.bot.mongo.discord_db.loading_stats.aggregate(pipeline=pipeline)
-        unique_guild_ids = set(x.get("_id") for x in await aggregation.to_list(length=None))
-        done_guild_ids = []
-        if len(unique_guild_ids) == 0:
-            self.running = False
-            return
-        while True:
-            for guild_id in unique_guild_ids:
-                lowest_percent = 100
-                sent_message_id = None
-                sent_message_channel_id = None
-                query = self.bot.mongo.discord_db.loading_stats.find({"guild_id": guild_id})
-                channel_documents = await query.to_list(length=None)
-                for channel_document in channel_documents:
-                    possible_sent = channel_document.get("sent_message_id", None)
-                    if possible_sent is not None:
-                        sent_message_id = possible_sent
-                        sent_message_channel_id = channel_document.get("_id")
-                    if not channel_document.get("active"):
-                        continue
-                    latest_time = channel_document.get("latest_time")
-                    percent = 1 - (
-                            (latest_time - channel_document.get("message_time")).total_seconds()
-                            /
-                            (latest_time - channel_document.get("earliest_time")).total_seconds())
-                    percent = percent * 100
-                    if percent < lowest_percent:
-                        lowest_percent = percent
-                if sent_message_id is None or sent_message_channel_id is None:
-                    continue
-                if lowest_percent == 100:
-                    done_guild_ids.append(guild_id)
-                update_channel = self.bot.get_channel(sent_message_channel_id)
-                if update_channel is not None:
-                    update_message = await update_channel.fetch_message(sent_message_id)
-                else:
-                    update_message = None
-                stars = int(round(lowest_percent / 10))
-                stars_string = "\\*" * stars
-                dashes = 10 - stars
-                if lowest_percent != 100:
-                    if update_message is not None:
-                        await update_message.edit(embed=self.bot.create_processing_embed(
-                            "Back-Dating Statistics",
-                            f"Progress: {stars_string}{'-' * dashes} ({lowest_percent:.2f}%)"))
-                else:
-                    if update_message is not None:
-                        await update_message.edit(embed=self.bot.create_completed_embed("Back-Dated Statistics!",
-                                                                                    "Finished back-dating statistics!"))
-            for guild_id in done_guild_ids:
-                unique_guild_ids.remove(guild_id)
-            done_guild_ids = []
-            if len(unique_guild_ids) == 0:
-                self.running = False
-                return
-            await asyncio.sleep(1)
+            # Older checkpoints only recorded the message, on the channel it was sent in.
+            sent_channel_id = channel_document.get("sent_channel_id", channel.id)
+            report_to = (sent_channel_id, sent_message_id) if sent_message_id is not None else None
+            job = await self.load_channel(channel, report_to)
+            if job is not None and report_to is not None:
+                reports.setdefault(report_to, []).append(job)
+        for (sent_channel_id, sent_message_id), jobs in reports.items():
+            sent_channel = self.bot.get_channel(sent_channel_id)
+            if sent_channel is None:
+                continue
+            try:
+                sent_message = await sent_channel.fetch_message(sent_message_id)
+            except discord.HTTPException:
+                continue
+            self.progress_reporter.track(sent_message, jobs)
 
     @commands.command()
     @is_staff()
     async def load_stats(self, ctx):
         sent_message = await ctx.reply(embed=self.bot.create_processing_embed("Back-dating Statistics",
                                                                               "Progress: Starting..."))
+        report_to = (sent_message.channel.id, sent_message.id)
+        jobs = []
         for channel in ctx.guild.text_channels:
-            print(channel.id)
-            channel_doc = await self.bot.mongo.discord_db.channels.find_one({"_id": channel.id})
-            if channel_doc is not None and channel_doc.get("nostore", False):
-                if channel == ctx.channel:
-                    loading_doc = {"_id": channel.id, "guild_id": channel.guild.id, "active": False,
-                                   "sent_message_id": sent_message.id}
-                    await self.bot.mongo.force_insert(self.bot.mongo.discord_db.loading_stats, loading_doc)
-                continue
-            if channel == ctx.channel:
-                self.bot.loop.create_task(self.load_channel(channel, sent_message.id))
-            else:
-                self.bot.loop.create_task(self.load_channel(channel))
-        await asyncio.sleep(1)
-        if not self.running:
-            self.bot.loop.create_task(self.update_embeds())
-
-    async def load_channel(self, channel: discord.TextChannel, sent_message_id=None):
-        channel_doc = await self.bot.mongo.discord_db.channels.find_one({"_id": channel.id})
-        if channel_doc is not None and channel_doc.get("nostore", False):
-            return
-        after = datetime.datetime(2015, 1, 1)
-        most_recent_message = channel.history(limit=1)
-        most_recent_message = await most_recent_message.flatten()
-        try:
-            most_recent_message = most_recent_message[0]
-        except IndexError:
+            job = await self.load_channel(channel, report_to)
+            if job is not None:
+                jobs.append(job)
+        await self.backfill.flush_checkpoints()
+        self.progress_reporter.track(sent_message, jobs)
+
+    async def load_channel(self, channel: discord.TextChannel, report_to=None):
+        if await self.bot.mongo.get_channel_nostore(channel):
+            return None
+        return self.backfill.schedule(channel, report_to)
+
+    async def add_messages_to_db(self, messages):
+        await self.bot.mongo.insert_channel_messages(messages)
+        for message in messages:
+            if message.guild is not None:
+                self.score_engine.add_message(message)
+
+    @commands.command()
+    @is_owner()
+    async def rebuild_stats(self, ctx):
+        sent = await ctx.reply(embed=self.bot.create_processing_embed("Rebuilding...",
+                                                                      "Recounting every member's messages."))
+        await self.bot.mongo.rebuild_message_stats(ctx.guild.id)
+        await sent.edit(embed=self.bot.create_completed_embed("Rebuilt!", "Message statistics have been recounted."))
+
+    @commands.command()
+    @is_staff()
+    async def backfill_status(self, ctx):
+        jobs = sorted(self.backfill.jobs.values(), key=lambda x: x.finished_at is not None)
+        jobs = [job for job in jobs if job.channel.guild == ctx.guild]
+        if len(jobs) == 0:
+            await ctx.reply(embed=self.bot.create_error_embed("Nothing has been back-dated here since the bot "
+                                                              "started."))
             return
-        earliest_message = channel.history(oldest_first=True, limit=1)
-        earliest_message = await earliest_message.flatten()
-        earliest_message = earliest_message[0]
-        stored_channel = await self.bot.mongo.discord_db.loading_stats.find_one({"_id": channel.id})
-        if sent_message_id is not None and stored_channel is None:
-            loading_doc = {"_id": channel.id, "guild_id": channel.guild.id, "active": True,
-                           "sent_message_id": sent_message_id}
-            await self.bot.mongo.force_insert(self.bot.mongo.discord_db.loading_stats, loading_doc)
-        if stored_channel is not None:
-            last_message_id = stored_channel.get("message_id")
-            try:
-                last_message = await channel.fetch_message(last_message_id)
-                after = last_message
-            except discord.errors.NotFound:
-                after = stored_channel.get("message_time")
-        history_iterator = channel.history(after=after, limit=None)
-        while True:
-            if history_iterator.messages.empty():
-                await history_iterator.fill_messages()
-            if history_iterator.messages.empty():
-                break
-            last_message = await self.add_messages_to_db(history_iterator.messages)
-            if last_message is not None:
-                if last_message == most_recent_message:
-                    await self.bot.mongo.discord_db.loading_stats.update_one({"_id": channel.id},
-                                                                             {"$set": {"active": False}})
-                    return True
-                loading_doc = {"_id": channel.id, "message_id": last_message.id,
-                               "message_time": last_message.created_at, "guild_id": channel.guild.id, "active": True,
-                               "sent_message_id": sent_message_id, "latest_time": most_recent_message.created_at,
-                               "earliest_time": earliest_message.created_at}
-                await self.bot.mongo.force_insert(self.bot.mongo.discord_db.loading_stats, loading_doc)
-
-    async def add_messages_to_db(self, message_queue: asyncio.Queue):
-        this_batch = []
-        while not message_queue.empty():
-            this_batch.append(message_queue.get_nowait())
-        await self.bot.mongo.insert_channel_messages(this_batch)
-        return this_batch[-1] if len(this_batch) != 0 else None
+        embed = discord.Embed(title="Back-Dating Status", colour=discord.Colour.blue())
+        total_messages = sum(job.messages for job in jobs)
+        total_rate = sum(job.messages_per_second for job in jobs if job.finished_at is None)
+        embed.description = (f"{len(self.backfill.active_jobs)} channels queued or running across all servers.\n"
+                             f"{total_messages} messages stored here, currently {total_rate:.1f} messages/s.")
+        for job in jobs[:24]:
+            if job.finished_at is not None:
+                state = "Finished"
+            elif job.started_at is None:
+                state = "Queued"
+            else:
+                state = "Running"
+            embed.add_field(name=f"#{job.channel.name}", value=f"{state}\n{job.messages} messages\n"
+                                                               f"{job.messages_per_second:.1f} messages/s")
+        await ctx.reply(embed=embed)
 
     @tasks.loop(seconds=1800, count=None)
     async def update_motw(self):
         monkey_guild: discord.Guild = self.bot.get_guild(config.monkey_guild_id)
         motw_role = monkey_guild.get_role(config.motw_role_id)
         motw_channel: discord.TextChannel = self.bot.get_channel(config.motw_channel_id)
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            results = await self.bot.loop.run_in_executor(pool, partial(get_guild_score, config.monkey_guild_id))
+        results = await self.score_engine.get_guild_score(config.monkey_guild_id)
         results = results[:12]
         members = []
         for user in results:
@@ -218,6 +201,7 @@ class Statistics(commands.Cog):
                 await self.bot.mongo.discord_db.members.update_one({"_id": {"user_id": user[0],
                                                                             "guild_id": monkey_guild.id}},
                                                                    {'$set': {"deleted": True}})
+                self.score_engine.remove_member(monkey_guild.id, user[0])
                 continue
             members.append(member)
         for member in monkey_guild.members:
@@ -275,7 +259,8 @@ class Statistics(commands.Cog):
     async def nostore(self, ctx, channel: Optional[discord.TextChannel]):
         if channel is None:
             channel = ctx.channel
-        await self.bot.mongo.discord_db.channels.update_one({"_id": channel.id}, {"$set": {"nostore": True}})
+        await self.bot.mongo.set_channel_nostore(channel.id)
+        self.score_engine.set_nostore(channel.guild.id, channel.id)
         await ctx.reply("nostore set.")
 
     @commands.command(aliases=["ghostping", "ghost"])
@@ -407,27 +392,25 @@ class Statistics(commands.Cog):
     async def leaderpie(self, ctx):
         sent = await ctx.reply(embed=self.bot.create_processing_embed("Generating leaderboard",
                                                                       "Processing messages for leaderboard..."))
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            results = await self.bot.loop.run_in_executor(pool, partial(get_guild_score, ctx.guild.id))
-            labels = []
-            amounts = []
-            for user_id, score in results[:30]:
-                member = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.members, {"user_id": user_id,
-                                                                                             "guild_id": ctx.guild.id})
-                nickname = member.get("nick", None)
-                if nickname is None:
-                    user = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.users, user_id)
-                    nickname = user.get("name", "Unknown")
-                labels.append(nickname)
-                amounts.append(score)
-            smaller_amounts = amounts[15:]
-            labels = labels[:15]
-            amounts = amounts[:15]
-            amounts.append(sum(smaller_amounts))
-            labels.append("Other")
-            await sent.edit(embed=self.bot.create_processing_embed("Got leaderboard!", "Generating pie chart."))
-            data = await self.bot.loop.run_in_executor(pool, partial(pie_chart_from_amount_and_labels,
-                                                                     labels, amounts))
+        results = await self.score_engine.get_guild_score(ctx.guild.id)
+        labels = []
+        amounts = []
+        for user_id, score in results[:30]:
+            member = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.members, {"user_id": user_id,
+                                                                                         "guild_id": ctx.guild.id})
+            nickname = member.get("nick", None)
+            if nickname is None:
+                user = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.users, user_id)
+                nickname = user.get("name", "Unknown")
+            labels.append(nickname)
+            amounts.append(score)
+        smaller_amounts = amounts[15:]
+        labels = labels[:15]
+        amounts = amounts[:15]
+        amounts.append(sum(smaller_amounts))
+        labels.append("Other")
+        await sent.edit(embed=self.bot.create_processing_embed("Got leaderboard!", "Generating pie chart."))
+        data = await self.bot.worker_pool.run(pie_chart_from_amount_and_labels, labels, amounts)
         file = BytesIO(data)
         file.seek(0)
         discord_file = discord.File(fp=file, filename="image.png")
@@ -438,8 +421,7 @@ class Statistics(commands.Cog):
     async def score(self, ctx, member: Optional[discord.Member]):
         if member is None:
             member = ctx.author
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            score = await self.bot.loop.run_in_executor(pool, partial(get_user_score, member.id, member.guild.id))
+        score = await self.score_engine.get_user_score(member.id, member.guild.id)
         embed = self.bot.create_completed_embed(f"Score for {member.nick or member.name} - past 7 days",
                                                 str(score))
         if ctx.guild.id == config.monkey_guild_id:
@@ -492,10 +474,9 @@ class Statistics(commands.Cog):
         sent = await ctx.reply(embed=self.bot.create_processing_embed("Counting...",
                                                                       f"Counting {member.name}'s amount of "
                                                                       f"messages!"))
-        guild_count = await self.bot.mongo.discord_db.messages.count_documents({"guild_id": ctx.guild.id})
-        member_count = await self.bot.mongo.discord_db.messages.count_documents({"user_id": member.id,
-                                                                                 "guild_id": ctx.guild.id})
-        percentage = (member_count / guild_count) * 100
+        guild_count = await self.bot.mongo.count_messages(ctx.guild.id)
+        member_count = await self.bot.mongo.count_messages(ctx.guild.id, member.id)
+        percentage = (member_count / guild_count) * 100 if guild_count else 0
         embed = self.bot.create_completed_embed(f"Amount of messages {member.name} has sent!",
                                                 f"{member.name} has sent {member_count:,} messages. "
                                                 f"That's {percentage:.3f}% "
@@ -505,7 +486,7 @@ class Statistics(commands.Cog):
     @commands.command(description="Count how many messages have been sent in this guild!")
     async def messages(self, ctx):
         sent = await ctx.reply(embed=self.bot.create_processing_embed("Counting...", "Counting all messages sent..."))
-        amount = await self.bot.mongo.discord_db.messages.count_documents({"guild_id": ctx.guild.id, "deleted": False})
+        amount = await self.bot.mongo.count_messages(ctx.guild.id, undeleted=True)
         await sent.edit(embed=self.bot.create_completed_embed(
             title="Total Messages sent in this guild!", text=f"**{amount:,}** messages!"
         ))
@@ -530,8 +511,7 @@ class Statistics(commands.Cog):
             ]
             aggregation = self.bot.mongo.discord_db.messages.aggregate(pipeline=pipeline)
             times = [x.get("_id") for x in await aggregation.to_list(length=None)]
-            with concurrent.futures.ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(file_from_timestamps, times, group))
+            data = await self.bot.worker_pool.run(file_from_timestamps, times, group)
             file = BytesIO(data)
             file.seek(0)
             discord_file = discord.File(fp=file, filename="image.png")
@@ -543,8 +523,7 @@ class Statistics(commands.Cog):
     async def leaderboard(self, ctx):
         sent = await ctx.reply(embed=self.bot.create_processing_embed("Generating leaderboard",
                                                                       "Processing messages for leaderboard..."))
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            results = await self.bot.loop.run_in_executor(pool, partial(get_guild_score, ctx.guild.id))
+        results = await self.score_engine.get_guild_score(ctx.guild.id)
         results = results[:12]
         embed = discord.Embed(title="Activity Leaderboard - Past 7 Days", colour=discord.Colour.green())
         embed.description = "```"
@@ -583,13 +562,7 @@ class Statistics(commands.Cog):
             await ctx.reply(embed=embed)
 
     async def get_first_message(self, guild_id, user_id):
-        query = self.bot.mongo.discord_db.messages.find({"user_id": user_id, "guild_id": guild_id})
-        query.sort("created_at", 1).limit(1)
-        first_message = await query.to_list(length=1)
-        try:
-            return first_message[0]
-        except IndexError:
-            return {}
+        return await self.bot.mongo.get_first_message(user_id, guild_id)
 
     @commands.command()
     async def stats(self, ctx, member: Optional[discord.Member], group: Optional[str] = "m"):
@@ -612,8 +585,7 @@ class Statistics(commands.Cog):
         ]
         aggregation = self.bot.mongo.discord_db.messages.aggregate(pipeline)
         times = [x.get("_id") for x in await aggregation.to_list(length=None)]
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            data = await self.bot.loop.run_in_executor(pool, partial(file_from_timestamps, times, group))
+        data = await self.bot.worker_pool.run(file_from_timestamps, times, group)
         file = BytesIO(data)
         file.seek(0)
         discord_file = discord.File(fp=file, filename="image.png")
@@ -632,6 +604,7 @@ class Statistics(commands.Cog):
         channel = await self.bot.mongo.find_by_id(self.bot.mongo.discord_db.channels, channel.id)
         await self.bot.mongo.discord_db.channels.update_one({"_id": channel["_id"]},
                                                             {'$set': {"excluded": not channel.get("excluded", False)}})
+        self.score_engine.set_excluded(ctx.guild.id, channel["_id"], not channel.get("excluded", False))
         await sent.edit(embed=self.bot.create_completed_embed("Changed excluded status!",
                                                               f"Channel has been "
                                                               f"{'un' if channel.get('excluded', False) else ''}"
@@ -658,8 +631,7 @@ class Statistics(commands.Cog):
         message_list = [x.get("_id") for x in await aggregation.to_list(length=None)]
         await sent.edit(embed=self.bot.create_processing_embed("Processing messages",
                                                                "Creating graph of all server messages..."))
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            raw_data = await self.bot.loop.run_in_executor(pool, partial(file_from_timestamps, message_list, group))
+        raw_data = await self.bot.worker_pool.run(file_from_timestamps, message_list, group)
         file = BytesIO(raw_data)
         file.seek(0)
         discord_file = discord.File(fp=file, filename="image.png")
@@ -1,17 +1,20 @@
-import asyncio
 import datetime
+import traceback
 from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from io import BytesIO
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from main import UtilsBot
+from src.checks.user_check import is_owner
 from src.helpers.graph_helper import plot_multiple, tfm_graph
 from src.helpers.models.skyblock_models import Rarity
+from src.helpers.cache_helper import TTLCache
 from src.helpers.paginator import Paginator
+from src.helpers.skyblock_helper import ItemNameIndex, PriceRollups
+from src.storage import config
 
 PROFITS_START_DATE = datetime.datetime(2021, 12, 14, 0, 0, 0, tzinfo=datetime.timezone.utc)
 FLIPS_START_DATE = datetime.datetime(2022, 1, 12, 21, 0, 0, tzinfo=datetime.timezone.utc)
@@ -24,6 +27,35 @@ class Skyblock(commands.Cog):
         self.cached_graphs = defaultdict(bytes)
         self.last_cached_time = defaultdict(lambda: datetime.datetime(2021, 12, 14, 0, 0, 0,
                                                                       tzinfo=datetime.timezone.utc))
+        # Graph name -> {hour: total}, see hourly_totals.
+        self.hourly_rollups = {}
+        self.indexed_collections = set()
+        self.price_rollups = PriceRollups(self.skyblock_db,
+                                          datetime.timedelta(hours=config.skyblock_rollup_refresh_hours))
+        self.update_price_rollups.start()
+        self.item_names = ItemNameIndex(self.skyblock_db)
+        # Rendered price charts (and sell prices), see send_price_chart.
+        self.charts = TTLCache(config.skyblock_chart_cache_size, ttl=6 * 60 * 60,
+                               max_bytes=config.skyblock_chart_cache_bytes)
+        self.refresh_item_names.start()
+
+    def cog_unload(self):
+        self.update_price_rollups.cancel()
+        self.refresh_item_names.cancel()
+
+    @tasks.loop(seconds=600, count=None)
+    async def refresh_item_names(self):
+        try:
+            await self.item_names.refresh()
+        except Exception:
+            print(traceback.format_exc())
+
+    @tasks.loop(seconds=600, count=None)
+    async def update_price_rollups(self):
+        try:
+            await self.price_rollups.refresh()
+        except Exception:
+            print(traceback.format_exc())
 
     @commands.group(case_insensitive=True, aliases=["sb"])
     async def skyblock(self, ctx):
@@ -33,42 +65,42 @@ class Skyblock(commands.Cog):
                                                               "subcommands: `history`, `average`, `minimum`, `book`,"
                                                               "`tfm`"))
 
-    @staticmethod
-    async def do_profits_db_lookup(client, current_datetime, next_datetime, calculation):
-        flips = await client.tfm.profits.find({"timestamp": {"$gt": current_datetime, "$lt": next_datetime}}).to_list(
-            length=None)
-        profit = sum([calculation(x) for x in flips])
-        return current_datetime, profit
-
-    @staticmethod
-    async def do_flips_db_lookup(client, current_datetime, next_datetime, calculation):
-        flips = await client.tfm.flips.find({"timestamp": {"$gt": current_datetime, "$lt": next_datetime}}).to_list(
-            length=None)
-        profit = sum([calculation(x) for x in flips])
-        return current_datetime, profit
-
-    async def produce_graph(self, ctx, name, y_label, calculation, db_lookup_func):
+    async def hourly_totals(self, name, collection_name, expression):
+        """(hour, total) for each hour (UTC) of the last 30 days, totalling expression over the documents in
+        tfm.<collection_name> from that hour. Mongo does the totalling, and finished hours are cached in
+        hourly_rollups, so each call only totals the hours since the last one."""
+        collection = self.bot.mongo.client.tfm[collection_name]
+        if collection_name not in self.indexed_collections:
+            await collection.create_index("timestamp")
+            self.indexed_collections.add(collection_name)
+        this_hour = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        start = this_hour - datetime.timedelta(days=30)
+        rollups = self.hourly_rollups.setdefault(name, {})
+        for hour in [hour for hour in rollups if hour < start]:
+            del rollups[hour]
+        # The newest cached hour might not have finished when it was totalled, so it's done again.
+        since = max(rollups, default=start)
+        hour = since
+        while hour <= this_hour:
+            # Hours without any documents aren't in the results, but still count (as 0) towards the averages.
+            rollups[hour] = 0
+            hour += datetime.timedelta(hours=1)
+        pipeline = [{"$match": {"timestamp": {"$gte": since}}},
+                    {"$group": {"_id": {"$subtract": ["$timestamp", {"$mod": [{"$toLong": "$timestamp"},
+                                                                              60 * 60 * 1000]}]},
+                                "total": {"$sum": expression}}}]
+        async for document in collection.aggregate(pipeline):
+            rollups[document["_id"]] = document["total"]
+        return sorted(rollups.items())
+
+    async def produce_graph(self, ctx, name, y_label, expression, collection_name):
         data = self.cached_graphs[name]
         # If data is none (no cache), or it's from last hour, or it's greater than 2 hours old:
         if data is None or self.last_cached_time[name].hour != datetime.datetime.utcnow().hour or \
                 ((datetime.datetime.utcnow() - self.last_cached_time[name]).total_seconds() / 3600) > 2:
             async with ctx.typing():
-                client = self.bot.mongo.client
-                # current_datetime = PROFITS_START_DATE if db_lookup_func == self.do_profits_db_lookup else \
-                #     FLIPS_START_DATE
-                tasks = []
-                now = datetime.datetime.now()
-                now = now.replace(tzinfo=datetime.timezone.utc)
-                current_datetime = now - datetime.timedelta(days=30)
-                while current_datetime < now:
-                    next_datetime = current_datetime + datetime.timedelta(hours=1)
-                    tasks.append(db_lookup_func(client, current_datetime, next_datetime,
-                                                calculation))
-                    current_datetime = next_datetime
-                flip_data = await asyncio.gather(*tasks)
-                with ProcessPoolExecutor() as pool:
-                    data = await self.bot.loop.run_in_executor(pool, partial(tfm_graph, flip_data,
-                                                                             y_label))
+                flip_data = await self.hourly_totals(name, collection_name, expression)
+                data = await self.bot.worker_pool.run(tfm_graph, flip_data, y_label)
                 self.cached_graphs[name] = data
                 self.last_cached_time[name] = datetime.datetime.utcnow()
         file = BytesIO(data)
@@ -80,15 +112,11 @@ class Skyblock(commands.Cog):
     async def tfm(self, ctx):
         if ctx.invoked_subcommand is not None:
             return
-
-        def find_true_profit(x):
-            if "sell_price" in x:
-                return (x["sell_price"] * 0.99) - x["price"]
-            # target is 80% of the price, take 2% for tax
-            return (x["target"] / 0.82) - x["price"]
-
-        await self.produce_graph(ctx, "tfm", "Average Profit (coins)", find_true_profit,
-                                 self.do_profits_db_lookup)
+        # If it sold, its sell price less 1% tax. Otherwise the target is 80% of the price, take 2% for tax.
+        true_profit = {"$cond": [{"$ne": [{"$type": "$sell_price"}, "missing"]},
+                                 {"$subtract": [{"$multiply": ["$sell_price", 0.99]}, "$price"]},
+                                 {"$subtract": [{"$divide": ["$target", 0.82]}, "$price"]}]}
+        await self.produce_graph(ctx, "tfm", "Average Profit (coins)", true_profit, "profits")
 
     @tfm.command(name="help")
     async def tfm_help(self, ctx):
@@ -98,25 +126,24 @@ class Skyblock(commands.Cog):
 
     @tfm.command()
     async def cost(self, ctx):
-        await self.produce_graph(ctx, "cost", "Average Cost (coins)", lambda x: x["price"],
-                                 self.do_profits_db_lookup)
+        await self.produce_graph(ctx, "cost", "Average Cost (coins)", "$price", "profits")
 
     @tfm.command()
     async def purchases(self, ctx):
-        await self.produce_graph(ctx, "purchases", "Average Purchases", lambda x: 1,
-                                 self.do_profits_db_lookup)
+        await self.produce_graph(ctx, "purchases", "Average Purchases", 1, "profits")
 
     @tfm.group()
     async def flips(self, ctx):
         if ctx.invoked_subcommand is not None:
             return
-        await self.produce_graph(ctx, "flips_profit", "Average Theoretical Profit (coins)",
-                                 lambda x: ((x["target"] + x["lowBin"]) // 2) - x["price"], self.do_flips_db_lookup)
+        theoretical_profit = {"$subtract": [{"$floor": {"$divide": [{"$add": ["$target", "$lowBin"]}, 2]}},
+                                            "$price"]}
+        await self.produce_graph(ctx, "flips_profit", "Average Theoretical Profit (coins)", theoretical_profit,
+                                 "flips")
 
     @flips.command()
     async def count(self, ctx):
-        await self.produce_graph(ctx, "flips_count", "Average Theoretical Flips",
-                                 lambda x: 1, self.do_flips_db_lookup)
+        await self.produce_graph(ctx, "flips_count", "Average Theoretical Flips", 1, "flips")
 
     @skyblock.group(case_insensitive=True)
     async def book(self, ctx):
@@ -125,125 +152,11 @@ class Skyblock(commands.Cog):
                                                               "Please specify a subcommand. Valid "
                                                               "subcommands: `history`, `average`, `minimum`"))
 
-    async def all_auctions_average_data(self):
-        pipeline = [{
-            "$unwind": "$updates"
-        },
-            {
-                "$group": {
-                    "_id": "$updates",
-                    "minimum": {
-                        "$min": "$starting_bid"
-                    },
-                    "average": {
-                        "$avg": "$starting_bid"
-                    },
-                    "maximum": {
-                        "$max": "$starting_bid"
-                    }
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "auction_updates",
-                    "localField": "_id",
-                    "foreignField": "_id",
-                    "as": "auction"
-                }
-            },
-            {
-                "$project": {
-                    "_id": "$auction.timestamp",
-                    "minimum": 1,
-                    "average": 1,
-                    "maximum": 1
-                }
-            },
-            {
-                "$unwind": "$_id"
-            }
-        ]
-        auctions = await self.skyblock_db.auctions.aggregate(pipeline=pipeline).to_list(length=None)
-        return auctions
-
-    async def auctions_from_names(self, names, rarity=Rarity.ALL):
-        pipeline = [
-            {
-                "$match": {
-                    "item_name": {
-                        "$in": names
-                    },
-                    "bin": True,
-                    "sold": True,
-                    "tier": rarity.name if rarity != Rarity.ALL else {"$exists": True},
-                    "count": 1
-                }
-            },
-            {
-                "$unwind": "$updates"
-            },
-            {
-                "$group": {
-                    "_id": "$updates",
-                    "minimum": {
-                        "$min": "$starting_bid"
-                    },
-                    "average": {
-                        "$avg": "$starting_bid"
-                    },
-                    "maximum": {
-                        "$max": "$starting_bid"
-                    }
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "auction_updates",
-                    "localField": "_id",
-                    "foreignField": "_id",
-                    "as": "auction"
-                }
-            },
-            {
-                "$project": {
-                    "_id": "$auction.timestamp",
-                    "minimum": 1,
-                    "average": 1,
-                    "maximum": 1
-                }
-            },
-            {
-                "$unwind": "$_id"
-            }
-        ]
-        auctions = await self.skyblock_db.auctions.aggregate(pipeline=pipeline).to_list(length=None)
-        return auctions
-
     async def all_auctions_determine(self):
-        minimum_prices = []
-        average_prices = []
-        maximum_prices = []
-        for auction in await self.all_auctions_average_data():
-            minimum_prices.append((auction["_id"], auction["minimum"]))
-            average_prices.append((auction["_id"], auction["average"]))
-            maximum_prices.append((auction["_id"], auction["maximum"]))
-        minimum_prices.sort(key=lambda x: x[0])
-        average_prices.sort(key=lambda x: x[0])
-        maximum_prices.sort(key=lambda x: x[0])
-        return minimum_prices, average_prices, maximum_prices
+        return await self.price_rollups.price_history()
 
     async def get_item_from_name(self, item_names, rarity=Rarity.ALL):
-        minimum_prices = []
-        average_prices = []
-        maximum_prices = []
-        for auction in await self.auctions_from_names(item_names, rarity):
-            minimum_prices.append((auction["_id"], auction["minimum"]))
-            average_prices.append((auction["_id"], auction["average"]))
-            maximum_prices.append((auction["_id"], auction["maximum"]))
-        minimum_prices.sort(key=lambda x: x[0])
-        average_prices.sort(key=lambda x: x[0])
-        maximum_prices.sort(key=lambda x: x[0])
-        return minimum_prices, average_prices, maximum_prices
+        return await self.price_rollups.price_history(item_names, rarity)
 
     async def get_item_data(self, query, enchant_id=None, level=None):
         minimum_prices = []
@@ -273,77 +186,48 @@ class Skyblock(commands.Cog):
             raise ValueError
         return await self.get_item_data("Enchanted Book", enchantment_document["_id"], level)
 
-    @book.command(name="history")
-    async def book_history(self, ctx, *, query):
-        query = query.lower()
-        async with ctx.typing():
-            try:
-                minimum_prices, average_prices, maximum_prices = await self.book_extract(ctx, query)
-            except ValueError:
-                return
+    async def send_price_chart(self, ctx, key, get_prices, title, series):
+        """Replies with a chart of the prices get_prices returns, drawing only the lines named in series.
+
+        Charts are cached under key plus the rolled up prices' version, so the same chart is only drawn (and its
+        prices only fetched) again once there are new prices in it.
+        """
+        key = (*key, self.price_rollups.version)
+        data = self.charts.get(key)
+        if data is None:
+            minimum_prices, average_prices, maximum_prices = await get_prices()
             if len(maximum_prices) == 0:
                 await ctx.reply(embed=self.bot.create_error_embed("No auctions could be found."))
                 return
-            with ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(plot_multiple,
-                                                                         title=f"Prices for {query} books",
-                                                                         x_label="Date",
-                                                                         y_label="Price in coins",
-                                                                         Minimum=minimum_prices,
-                                                                         Average=average_prices,
-                                                                         Maximum=maximum_prices))
-            file = BytesIO(data)
-            file.seek(0)
-            discord_file = discord.File(fp=file, filename="image.png")
-            await ctx.reply(file=discord_file)
+            lines = {"Minimum": minimum_prices, "Average": average_prices, "Maximum": maximum_prices}
+            data = await self.bot.worker_pool.run(plot_multiple, title=title, x_label="Date",
+                                                  y_label="Price in coins", **{name: lines[name] for name in series})
+            self.charts.set(key, data)
+        file = BytesIO(data)
+        file.seek(0)
+        discord_file = discord.File(fp=file, filename="image.png")
+        await ctx.reply(file=discord_file)
 
-    @book.command(name="average")
-    async def book_average(self, ctx, *, query):
-        print(ctx)
-        print(type(ctx))
-        print(self)
-        query = query.lower()
+    async def book_chart(self, ctx, command, query, title, series):
+        query = " ".join(query.lower().split())
         async with ctx.typing():
             try:
-                minimum_prices, average_prices, maximum_prices = await self.book_extract(ctx, query)
+                await self.send_price_chart(ctx, ("book", command, query), partial(self.book_extract, ctx, query),
+                                            title.format(query), series)
             except ValueError:
                 return
-            if len(maximum_prices) == 0:
-                await ctx.reply(embed=self.bot.create_error_embed("No auctions could be found."))
-                return
-            with ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(plot_multiple,
-                                                                         title=f"Average prices for {query} books",
-                                                                         x_label="Date",
-                                                                         y_label="Price in coins",
-                                                                         Minimum=minimum_prices,
-                                                                         Average=average_prices))
-            file = BytesIO(data)
-            file.seek(0)
-            discord_file = discord.File(fp=file, filename="image.png")
-            await ctx.reply(file=discord_file)
+
+    @book.command(name="history")
+    async def book_history(self, ctx, *, query):
+        await self.book_chart(ctx, "history", query, "Prices for {} books", ("Minimum", "Average", "Maximum"))
+
+    @book.command(name="average")
+    async def book_average(self, ctx, *, query):
+        await self.book_chart(ctx, "average", query, "Average prices for {} books", ("Minimum", "Average"))
 
     @book.command(name="minimum")
     async def book_minimum(self, ctx, *, query):
-        query = query.lower()
-        async with ctx.typing():
-            try:
-                minimum_prices, average_prices, maximum_prices = await self.book_extract(ctx, query)
-            except ValueError:
-                return
-            if len(maximum_prices) == 0:
-                await ctx.reply(embed=self.bot.create_error_embed("No auctions could be found."))
-                return
-            with ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(plot_multiple,
-                                                                         title=f"Minimum prices for {query} books",
-                                                                         x_label="Date",
-                                                                         y_label="Price in coins",
-                                                                         Minimum=minimum_prices))
-            file = BytesIO(data)
-            file.seek(0)
-            discord_file = discord.File(fp=file, filename="image.png")
-            await ctx.reply(file=discord_file)
+        await self.book_chart(ctx, "minimum", query, "Minimum prices for {} books", ("Minimum",))
 
     async def auctions_from_query(self, query, enchant_id=None, level=None):
         pipeline = [
@@ -390,11 +274,11 @@ class Skyblock(commands.Cog):
                 "$unwind": "$_id"
             }
         ]
+        await self.item_names.ensure_loaded()
         match_dict = {"bin": True,
                       "sold": True,
                       "item_name": {
-                          "$regex": f".*{query}.*",
-                          "$options": 'i'}}
+                          "$in": self.item_names.matches(query)}}
 
         if enchant_id is not None:
             match_dict["item_name"] = "Enchanted Book"
@@ -415,52 +299,25 @@ class Skyblock(commands.Cog):
     async def get_bin_auctions(self, query, enchant_id=None, level=None):
         return await self.auctions_from_query(query, enchant_id, level)
 
-    @skyblock.command()
-    async def history(self, ctx, *, query):
+    async def item_chart(self, ctx, command, query, title, series):
         async with ctx.typing():
             if query.lower() == "all":
-                minimum_prices, average_prices, maximum_prices = await self.all_auctions_determine()
-            else:
-                valid_names, rarity = await self.ask_name(ctx, query)
-                minimum_prices, average_prices, maximum_prices = await self.get_item_from_name(valid_names, rarity)
-            if len(maximum_prices) == 0:
-                await ctx.reply(embed=self.bot.create_error_embed("No auctions could be found."))
+                await self.send_price_chart(ctx, (command, "all"), self.all_auctions_determine, title.format(query),
+                                            series)
                 return
-            with ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(plot_multiple,
-                                                                         title=f"Historical prices for {query}",
-                                                                         x_label="Date",
-                                                                         y_label="Price in coins",
-                                                                         Minimum=minimum_prices,
-                                                                         Average=average_prices,
-                                                                         Maximum=maximum_prices))
-            file = BytesIO(data)
-            file.seek(0)
-            discord_file = discord.File(fp=file, filename="image.png")
-            await ctx.reply(file=discord_file)
+            valid_names, rarity = await self.ask_name(ctx, query)
+            # Keyed by what the query resolved to, so different ways of asking for the same items share a chart.
+            key = (command, tuple(sorted(valid_names)), rarity.name)
+            await self.send_price_chart(ctx, key, partial(self.get_item_from_name, valid_names, rarity),
+                                        title.format(valid_names[0] if len(valid_names) == 1 else query), series)
+
+    @skyblock.command()
+    async def history(self, ctx, *, query):
+        await self.item_chart(ctx, "history", query, "Historical prices for {}", ("Minimum", "Average", "Maximum"))
 
     @skyblock.command()
     async def average(self, ctx, *, query):
-        async with ctx.typing():
-            if query.lower() == "all":
-                minimum_prices, average_prices, maximum_prices = await self.all_auctions_determine()
-            else:
-                valid_names, rarity = await self.ask_name(ctx, query)
-                minimum_prices, average_prices, maximum_prices = await self.get_item_from_name(valid_names, rarity)
-            if len(maximum_prices) == 0:
-                await ctx.reply(embed=self.bot.create_error_embed("No auctions could be found."))
-                return
-            with ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(plot_multiple,
-                                                                         title=f"Average prices for {query}",
-                                                                         x_label="Date",
-                                                                         y_label="Price in coins",
-                                                                         Minimum=minimum_prices,
-                                                                         Average=average_prices))
-            file = BytesIO(data)
-            file.seek(0)
-            discord_file = discord.File(fp=file, filename="image.png")
-            await ctx.reply(file=discord_file)
+        await self.item_chart(ctx, "average", query, "Average prices for {}", ("Minimum", "Average"))
 
     async def ask_rarity(self, ctx):
         await ctx.reply(
@@ -482,8 +339,11 @@ class Skyblock(commands.Cog):
         return Rarity(rarity_index)
 
     async def ask_name(self, ctx, query):
-        all_names = await self.skyblock_db.auctions.distinct("item_name")
-        valid_names = [x for x in all_names if query.lower() in x.lower()]
+        await self.item_names.ensure_loaded()
+        valid_names = self.item_names.matches(query)
+        if len(valid_names) == 0:
+            # Nothing contains it, so it's probably misspelt.
+            valid_names = self.item_names.suggestions(query)
         if len(valid_names) == 0:
             await ctx.reply(embed=self.bot.create_error_embed("I couldn't find any items matching that name!"))
             ctx.kwargs["resolved"] = True
@@ -513,60 +373,23 @@ class Skyblock(commands.Cog):
 
     @skyblock.command()
     async def minimum(self, ctx, *, query):
-        async with ctx.typing():
-            if query.lower() == "all":
-                minimum_prices, average_prices, maximum_prices = await self.all_auctions_determine()
-            else:
-                valid_names, rarity = await self.ask_name(ctx, query)
-                minimum_prices, average_prices, maximum_prices = await self.get_item_from_name(valid_names, rarity)
-            if len(maximum_prices) == 0:
-                await ctx.reply(embed=self.bot.create_error_embed("No auctions could be found."))
-                return
-            with ProcessPoolExecutor() as pool:
-                data = await self.bot.loop.run_in_executor(pool, partial(plot_multiple,
-                                                                         title=f"Minimum prices for {query}",
-                                                                         x_label="Date",
-                                                                         y_label="Price in coins",
-                                                                         Minimum=minimum_prices))
-            file = BytesIO(data)
-            file.seek(0)
-            discord_file = discord.File(fp=file, filename="image.png")
-            await ctx.reply(file=discord_file)
+        await self.item_chart(ctx, "minimum", query, "Minimum prices for {}", ("Minimum",))
 
     async def get_sell_price(self, names, rarity):
-        pipeline = [
-            {
-                "$match": {
-                    "item_name": {
-                        "$in": names
-                    },
-                    "bin": True,
-                    "sold": True,
-                    "tier": rarity.name if rarity != Rarity.ALL else {"$exists": True},
-                    "count": 1
-                }
-            },
-            {
-                "$unwind": "$updates"
-            },
-            {
-                "$group": {
-                    "_id": None,
-                    "minimum": {
-                        "$min": "$starting_bid"
-                    },
-                    "average": {
-                        "$avg": "$starting_bid"
-                    },
-                    "maximum": {
-                        "$max": "$starting_bid"
-                    }
-                }
-            }
-        ]
-        data = await self.skyblock_db.auctions.aggregate(pipeline).to_list(length=None)
-        data = data[0]
-        return data["minimum"], round(data["average"], 2), data["maximum"]
+        key = ("sell_price", tuple(sorted(names)), rarity.name, self.price_rollups.version)
+        prices = self.charts.get(key)
+        if prices is None:
+            prices = await self.price_rollups.sell_price(names, rarity)
+            self.charts.set(key, prices)
+        return prices
+
+    @skyblock.command()
+    @is_owner()
+    async def rebuild_prices(self, ctx):
+        sent = await ctx.reply(embed=self.bot.create_processing_embed("Rebuilding...",
+                                                                      "Rolling up every auction update's prices."))
+        await self.price_rollups.refresh(rebuild=True)
+        await sent.edit(embed=self.bot.create_completed_embed("Rebuilt!", "Auction prices have been rolled up again."))
 
     @skyblock.command(aliases=["sp"])
     async def sell_price(self, ctx, *, query):
@@ -1,6 +1,6 @@
 import asyncio
-import concurrent.futures
-from functools import partial
+import traceback
+from io import BytesIO
 from typing import Optional
 
 import discord
@@ -10,7 +10,7 @@ from discord.ext import commands
 from main import UtilsBot
 from src.checks.custom_check import speak_changer_check
 from src.checks.role_check import is_high_staff
-from src.helpers.tts_helper import get_speak_file
+from src.helpers.tts_helper import SpeechSynthesizer
 from src.storage import config
 from src.storage import messages
 
@@ -18,11 +18,40 @@ from src.storage import messages
 class TTS(commands.Cog):
     def __init__(self, bot: UtilsBot):
         self.bot = bot
-        self.index_num = 0
-        self.queue_change_lock = asyncio.Lock()
-        self.guild_queues = {}
-        self.uid = 0
         self.tts_db = self.bot.mongo.client.tts
+        self.synthesizer = SpeechSynthesizer(self.bot.loop, max_workers=config.tts_workers,
+                                             max_entries=config.tts_cache_size, max_bytes=config.tts_cache_bytes,
+                                             ttl=config.tts_cache_seconds, timeout=config.tts_synthesis_timeout)
+        self.guild_settings = {}
+        # Per guild, messages waiting to be played in the order they were sent, and the task playing them.
+        self.playback_queues = {}
+        self.players = {}
+        self.queued_counts = {}
+
+    def cog_unload(self):
+        for player in self.players.values():
+            player.cancel()
+        self.bot.loop.create_task(self.synthesizer.close())
+
+    async def get_guild_settings(self, guild_id):
+        settings = self.guild_settings.get(guild_id)
+        if settings is None:
+            settings = await self.tts_db.settings.find_one({"_id": guild_id})
+            if settings is None:
+                settings = {"_id": guild_id, "speed": 1.0, "lang": "en", "tld": "com"}
+                await self.bot.mongo.force_insert(self.tts_db.settings, settings)
+            self.guild_settings[guild_id] = settings
+        return settings
+
+    async def change_guild_setting(self, guild_id, key, value):
+        settings = dict(await self.get_guild_settings(guild_id))
+        settings[key] = value
+        await self.bot.mongo.force_insert(self.tts_db.settings, settings)
+        self.guild_settings[guild_id] = settings
+
+    def queued(self, guild_id):
+        """How many messages are waiting to be (or being) spoken in a guild."""
+        return self.queued_counts.get(guild_id, 0)
 
     @commands.command(pass_context=True)
     @speak_changer_check()
@@ -78,11 +107,7 @@ class TTS(commands.Cog):
     async def speed(self, ctx, new_speed: float):
         if new_speed < 0:
             await ctx.reply(embed=self.bot.create_error_embed("A speed less than 0 makes no sense."))
-        old_guild_document = await self.tts_db.settings.find_one({"_id": ctx.guild.id})
-        if old_guild_document is None:
-            old_guild_document = {"_id": ctx.guild.id, "speed": 1.0, "lang": "en", "tld": "com"}
-        old_guild_document["speed"] = new_speed
-        await self.bot.mongo.force_insert(self.tts_db.settings, old_guild_document)
+        await self.change_guild_setting(ctx.guild.id, "speed", new_speed)
         await ctx.reply(embed=self.bot.create_completed_embed("Speed Changed!", "New speed in here is {}. "
                                                                                 "(default 1.0)".format(new_speed)))
 
@@ -116,11 +141,7 @@ class TTS(commands.Cog):
                 await ctx.reply(embed=lang_embed)
                 return
         new_lang = in_lang
-        old_guild_document = await self.tts_db.settings.find_one({"_id": ctx.guild.id})
-        if old_guild_document is None:
-            old_guild_document = {"_id": ctx.guild.id, "speed": 1.0, "lang": "en", "tld": "com"}
-        old_guild_document["lang"] = new_lang
-        await self.bot.mongo.force_insert(self.tts_db.settings, old_guild_document)
+        await self.change_guild_setting(ctx.guild.id, "lang", new_lang)
         lang_real_name = gtts.lang.tts_langs()[new_lang]
         await ctx.reply(embed=self.bot.create_completed_embed("Language changed!",
                                                               f"Changed voice language to {lang_real_name}"))
@@ -128,11 +149,7 @@ class TTS(commands.Cog):
     @commands.command(pass_context=True)
     @speak_changer_check()
     async def tld(self, ctx, new_tld):
-        old_guild_document = await self.tts_db.settings.find_one({"_id": ctx.guild.id})
-        if old_guild_document is None:
-            old_guild_document = {"_id": ctx.guild.id, "speed": 1.0, "lang": "en", "tld": "com"}
-        old_guild_document["tld"] = new_tld
-        await self.bot.mongo.force_insert(self.tts_db.settings, old_guild_document)
+        await self.change_guild_setting(ctx.guild.id, "tld", new_tld)
         await ctx.reply(embed=self.bot.create_completed_embed("TLD Changed!",
                                                               "Attempted to change TLD to {}".format(new_tld)))
 
@@ -201,35 +218,47 @@ class TTS(commands.Cog):
                 voice_client = await voice_channel.connect()
         else:
             voice_client = await voice_channel.connect()
-        old_guild_document = await self.tts_db.settings.find_one({"_id": member.guild.id})
-        if old_guild_document is None:
-            old_guild_document = {"_id": member.guild.id, "speed": 1.0, "lang": "en", "tld": "com"}
-            await self.bot.mongo.force_insert(self.tts_db.settings, old_guild_document)
-        lang = old_guild_document.get("lang")
-        speed = old_guild_document.get("speed")
-        tld = old_guild_document.get("tld")
-        with concurrent.futures.ProcessPoolExecutor() as pool:
-            output = await self.bot.loop.run_in_executor(pool, partial(get_speak_file, content,
-                                                                       lang, speed, tld))
-        if member.guild.id not in self.guild_queues:
-            async with self.queue_change_lock:
-                self.guild_queues[member.guild.id] = []
-        async with self.queue_change_lock:
-            our_uid = self.uid
-            self.uid += 1
-            self.guild_queues[member.guild.id].append(our_uid)
+        settings = await self.get_guild_settings(member.guild.id)
+        # Synthesis starts straight away, so it runs while anything queued before it is still playing.
+        synthesis = self.bot.loop.create_task(self.synthesizer.synthesize(content, settings.get("lang"),
+                                                                          settings.get("tld"), settings.get("speed")))
+        self.enqueue(member.guild, synthesis)
+        return True
+
+    def enqueue(self, guild, synthesis):
+        queue = self.playback_queues.get(guild.id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.playback_queues[guild.id] = queue
+            self.players[guild.id] = self.bot.loop.create_task(self.play_queue(guild, queue))
+        self.queued_counts[guild.id] = self.queued(guild.id) + 1
+        queue.put_nowait(synthesis)
+
+    async def play_queue(self, guild, queue):
+        while True:
+            synthesis = await queue.get()
+            try:
+                await self.play_synthesis(guild, synthesis)
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                self.queued_counts[guild.id] -= 1
+
+    async def play_synthesis(self, guild, synthesis):
+        output = await synthesis
+        # Looked up now rather than when the message was queued, as the bot may have moved channel since.
+        voice_client = guild.voice_client
+        if voice_client is None or not voice_client.is_connected() or len(output) == 0:
+            return
         while voice_client.is_playing():
             await asyncio.sleep(0.05)
-        while self.guild_queues[member.guild.id][0] != our_uid:
-            await asyncio.sleep(0.05)
+        finished = asyncio.Event()
         try:
-            voice_client.play(discord.PCMAudio(output))
+            voice_client.play(discord.PCMAudio(BytesIO(output)),
+                              after=lambda _: self.bot.loop.call_soon_threadsafe(finished.set))
         except discord.errors.ClientException:
-            pass
-        while voice_client.is_playing():
-            await asyncio.sleep(0.05)
-        self.guild_queues[member.guild.id].pop(0)
-        return True
+            return
+        await finished.wait()
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -0,0 +1,265 @@
+import asyncio
+import time
+import traceback
+
+import discord
+from pymongo import UpdateOne
+
+from src.helpers.rate_helper import RateBudget
+
+PAGE_SIZE = 100
+MAX_RETRIES = 5
+
+
+class BackfillJob:
+    def __init__(self, channel: discord.TextChannel, report_to=None):
+        self.channel = channel
+        # (channel_id, message_id) of the progress message, kept in the checkpoint so it can be picked up again
+        self.report_to = report_to
+        self.messages = 0
+        self.pages = 0
+        self.started_at = None
+        self.finished_at = None
+        self.failed = False
+        self.earliest_time = None
+        self.latest_time = None
+        self.message_time = None
+
+    @property
+    def percent(self):
+        if self.finished_at is not None:
+            return 100.0
+        if self.latest_time is None:
+            return 0.0
+        total = (self.latest_time - self.earliest_time).total_seconds()
+        if total <= 0:
+            return 0.0
+        remaining = (self.latest_time - self.message_time).total_seconds()
+        return min(100.0, max(0.0, (1 - remaining / total) * 100))
+
+    @property
+    def messages_per_second(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return self.messages / elapsed if elapsed > 0 else 0.0
+
+
+class BackfillObserver:
+    """Told about backfill progress as it happens. Called from the backfill tasks, so these mustn't block."""
+
+    def on_progress(self, job: BackfillJob):
+        pass
+
+    def on_finished(self, job: BackfillJob):
+        pass
+
+
+class BackfillScheduler:
+    """Back-dates message history for any number of channels.
+
+    At most concurrency channels are fetched at once, however many guilds asked for them, and every page request
+    draws from one RateBudget. Each channel is fetched one page at a time, oldest first, so there is never more than
+    one request queued on a channel's rate limit bucket (discord.py waits those out itself). Storing a page overlaps
+    with fetching the next one. Progress is published to observers as each page is stored. It only goes to the
+    loading_stats collection when flush_checkpoints is called, as a checkpoint that jobs resume from after a restart.
+    """
+
+    def __init__(self, mongo, store_messages, concurrency=4, requests_per_second=8):
+        self.mongo = mongo
+        self.store_messages = store_messages
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.budget = RateBudget(requests_per_second)
+        self.jobs: dict[int, BackfillJob] = {}
+        self.checkpoints = {}
+        self.observers: list[BackfillObserver] = []
+
+    def add_observer(self, observer: BackfillObserver):
+        self.observers.append(observer)
+
+    def notify_progress(self, job: BackfillJob):
+        for observer in self.observers:
+            observer.on_progress(job)
+
+    def schedule(self, channel: discord.TextChannel, report_to=None):
+        job = self.jobs.get(channel.id)
+        if job is not None and job.finished_at is None:
+            if report_to is not None:
+                job.report_to = report_to
+            return job
+        job = BackfillJob(channel, report_to)
+        self.jobs[channel.id] = job
+        # Checkpointed straight away, so channels still waiting for their turn are picked up again after a restart.
+        self.checkpoint(job, {}, active=True)
+        asyncio.get_event_loop().create_task(self.run_job(job))
+        return job
+
+    async def run_job(self, job: BackfillJob):
+        try:
+            async with self.semaphore:
+                job.started_at = time.monotonic()
+                await self.backfill(job)
+        except Exception:
+            job.failed = True
+            print(traceback.format_exc())
+        finally:
+            job.finished_at = time.monotonic()
+            for observer in self.observers:
+                observer.on_finished(job)
+
+    async def fetch_page(self, channel: discord.TextChannel, **kwargs):
+        for attempt in range(MAX_RETRIES):
+            await self.budget.acquire()
+            try:
+                return await channel.history(**kwargs).flatten()
+            except discord.HTTPException as e:
+                if isinstance(e, discord.Forbidden) or e.status < 500 or attempt == MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    def checkpoint(self, job: BackfillJob, stored_channel, **fields):
+        sent_channel_id, sent_message_id = job.report_to or (None, None)
+        checkpoint = {**stored_channel, "guild_id": job.channel.guild.id, "sent_channel_id": sent_channel_id,
+                      "sent_message_id": sent_message_id, **fields}
+        stored_channel.update(checkpoint)
+        self.checkpoints[job.channel.id] = checkpoint
+
+    async def backfill(self, job: BackfillJob):
+        channel = job.channel
+        stored_channel = await self.mongo.discord_db.loading_stats.find_one({"_id": channel.id}) or {}
+        stored_channel.pop("_id", None)
+        try:
+            most_recent = await self.fetch_page(channel, limit=1)
+        except discord.Forbidden:
+            most_recent = []
+        if len(most_recent) == 0:
+            self.checkpoint(job, stored_channel, active=False)
+            return
+        latest_time = most_recent[0].created_at
+        earliest_time = stored_channel.get("earliest_time")
+        if earliest_time is None:
+            earliest = await self.fetch_page(channel, limit=1, oldest_first=True)
+            earliest_time = earliest[0].created_at
+        job.latest_time, job.earliest_time = latest_time, earliest_time
+        job.message_time = stored_channel.get("message_time", earliest_time)
+        self.checkpoint(job, stored_channel, active=True, latest_time=latest_time, earliest_time=earliest_time,
+                        message_time=job.message_time)
+        self.notify_progress(job)
+        last_message_id = stored_channel.get("message_id")
+        after = discord.Object(id=last_message_id) if last_message_id is not None else discord.Object(id=0)
+        storing = None
+        while True:
+            try:
+                page = await self.fetch_page(channel, limit=PAGE_SIZE, after=after, oldest_first=True)
+            except discord.Forbidden:
+                page = []
+            if storing is not None:
+                await storing
+                storing = None
+            if len(page) == 0:
+                break
+            after = page[-1]
+            job.pages += 1
+            storing = asyncio.get_event_loop().create_task(self.store_page(job, stored_channel, page))
+            if len(page) < PAGE_SIZE or after.id >= most_recent[0].id:
+                await storing
+                break
+        self.checkpoint(job, stored_channel, active=False)
+        await self.flush_checkpoints()
+
+    async def store_page(self, job: BackfillJob, stored_channel, page):
+        await self.store_messages(page)
+        job.messages += len(page)
+        job.message_time = page[-1].created_at
+        self.checkpoint(job, stored_channel, message_id=page[-1].id, message_time=job.message_time)
+        self.notify_progress(job)
+
+    async def flush_checkpoints(self):
+        if len(self.checkpoints) == 0:
+            return
+        checkpoints = self.checkpoints
+        self.checkpoints = {}
+        requests = [UpdateOne({"_id": channel_id}, {"$set": checkpoint}, upsert=True)
+                    for channel_id, checkpoint in checkpoints.items()]
+        try:
+            await self.mongo.discord_db.loading_stats.bulk_write(requests, ordered=False)
+        except Exception:
+            for channel_id, checkpoint in checkpoints.items():
+                self.checkpoints.setdefault(channel_id, checkpoint)
+            raise
+
+    @property
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.finished_at is None]
+
+
+class ProgressReport:
+    def __init__(self, message: discord.Message, jobs):
+        self.message = message
+        self.jobs = list(jobs)
+        self.changed = asyncio.Event()
+        self.changed.set()
+        self.last_percent = None
+
+
+class ProgressReporter(BackfillObserver):
+    """Keeps "Back-Dating Statistics" messages up to date.
+
+    Each message has one writer task, which wakes up when one of its channels reports progress. It edits at most once
+    every min_interval seconds, and only when the rounded percentage has moved.
+    """
+
+    def __init__(self, bot, min_interval=2.0):
+        self.bot = bot
+        self.min_interval = min_interval
+        self.reports: dict[int, list[ProgressReport]] = {}
+
+    def track(self, message: discord.Message, jobs):
+        report = ProgressReport(message, jobs)
+        for job in report.jobs:
+            self.reports.setdefault(job.channel.id, []).append(report)
+        asyncio.get_event_loop().create_task(self.write(report))
+
+    def on_progress(self, job: BackfillJob):
+        for report in self.reports.get(job.channel.id, []):
+            if job in report.jobs:
+                report.changed.set()
+
+    on_finished = on_progress
+
+    def untrack(self, report: ProgressReport):
+        for job in report.jobs:
+            reports = self.reports.get(job.channel.id, [])
+            if report in reports:
+                reports.remove(report)
+            if len(reports) == 0:
+                self.reports.pop(job.channel.id, None)
+
+    async def write(self, report: ProgressReport):
+        try:
+            while True:
+                await report.changed.wait()
+                report.changed.clear()
+                if all(job.finished_at is not None for job in report.jobs):
+                    failed = sum(job.failed for job in report.jobs)
+                    if failed:
+                        embed = self.bot.create_error_embed(f"Back-dating stopped early for {failed} channel(s), "
+                                                            f"they'll carry on after the next restart.")
+                    else:
+                        embed = self.bot.create_completed_embed("Back-Dated Statistics!",
+                                                                "Finished back-dating statistics!")
+                    await report.message.edit(embed=embed)
+                    return
+                percent = int(min(job.percent for job in report.jobs))
+                if percent != report.last_percent:
+                    report.last_percent = percent
+                    stars = percent // 10
+                    stars_string = "\\*" * stars
+                    await report.message.edit(embed=self.bot.create_processing_embed(
+                        "Back-Dating Statistics", f"Progress: {stars_string}{'-' * (10 - stars)} ({percent}%)"))
+                await asyncio.sleep(self.min_interval)
+        except discord.HTTPException:
+            # The message was deleted or can't be edited any more, so there's nothing left to report to.
+            pass
+        finally:
+            self.untrack(report)
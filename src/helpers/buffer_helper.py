@@ -0,0 +1,205 @@
+import asyncio
+import contextlib
+import traceback
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+def merge_operators(update, other, newer=True):
+    """Merges the update operators in other into update. $inc adds up and $min/$max keep the extreme, so only $set
+    cares which of the two is newer."""
+    for operator, fields in other.items():
+        existing = update.setdefault(operator, {})
+        if operator == "$set":
+            if newer:
+                existing.update(fields)
+            else:
+                update[operator] = {**fields, **existing}
+            continue
+        for field, value in fields.items():
+            if field not in existing:
+                existing[field] = value
+            elif operator == "$inc":
+                existing[field] += value
+            elif operator == "$min":
+                existing[field] = min(existing[field], value)
+            elif operator == "$max":
+                existing[field] = max(existing[field], value)
+
+
+class WriteBuffer:
+    """Write-behind buffer for updates by _id.
+
+    Updates to the same document are merged (see merge_operators, and an upsert stays an upsert), then sent as one
+    unordered bulk_write per collection every flush_interval seconds, or sooner once max_batch documents are waiting.
+    Past max_pending waiting documents, writers wait for a flush. A batch that fails to send is merged back underneath
+    any newer writes and retried, so every write lands at least once. A batch being sent can still be read through
+    get_pending until it has been written.
+
+    on_upserted maps collection names to a callback, called with the (document_id, update) of each write that created
+    its document. It returns more writes as (collection_name, document_id, update, upsert), which are sent before the
+    flush finishes.
+    """
+
+    def __init__(self, database, flush_interval=2.0, max_batch=500, max_pending=20000):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.pending = {}
+        self.pending_count = 0
+        self.in_flight = {}
+        self.flush_lock = asyncio.Lock()
+        self.batch_ready = asyncio.Event()
+        self.space_available = asyncio.Event()
+        self.space_available.set()
+        self.closed = False
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.on_upserted = {}
+        # Only started by the first write, so MongoDB instances that never buffer anything don't leave a task behind.
+        self.task = None
+
+    @staticmethod
+    def make_key(document_id):
+        # Compound ids (e.g. members) are dicts, which can't be dictionary keys.
+        if isinstance(document_id, dict):
+            return tuple(document_id.items())
+        return document_id
+
+    def get_pending(self, collection_name, document_id):
+        """The fields waiting to be (or being) written to a document, or None if there aren't any."""
+        key = self.make_key(document_id)
+        fields = None
+        # Newer writes go on top of the batch being sent.
+        for batch in (self.in_flight, self.pending):
+            entry = batch.get(collection_name, {}).get(key)
+            if entry is not None and "$set" in entry[1]:
+                fields = {**(fields or {}), **entry[1]["$set"]}
+        return fields
+
+    def merge(self, collection_name, document_id, update, upsert, newer=True):
+        if self.merge_into(self.pending, collection_name, document_id, update, upsert, newer):
+            self.pending_count += 1
+
+    @classmethod
+    def merge_into(cls, batch, collection_name, document_id, update, upsert, newer=True):
+        """Merges a write into a batch. Returns whether it's the first for its document."""
+        collection = batch.setdefault(collection_name, {})
+        key = cls.make_key(document_id)
+        entry = collection.get(key)
+        created = entry is None
+        if created:
+            entry = [document_id, {}, upsert]
+            collection[key] = entry
+        merge_operators(entry[1], update, newer)
+        entry[2] = entry[2] or upsert
+        return created
+
+    async def update(self, collection_name, document_id, update, upsert=False):
+        if self.task is None and not self.closed:
+            self.task = asyncio.get_event_loop().create_task(self.run())
+        while self.pending_count >= self.max_pending and not self.closed:
+            self.space_available.clear()
+            self.batch_ready.set()
+            await self.space_available.wait()
+        self.merge(collection_name, document_id, update, upsert)
+        if self.pending_count >= self.max_batch:
+            self.batch_ready.set()
+
+    async def set(self, collection_name, document_id, fields, upsert=False):
+        await self.update(collection_name, document_id, {"$set": fields}, upsert)
+
+    async def run(self):
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            if not await self.flush():
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        """Writes everything waiting. Returns False if anything had to be put back for a retry."""
+        async with self.flush_lock:
+            return await self.flush_locked()
+
+    async def flush_locked(self):
+        if self.pending_count == 0:
+            return True
+        batch = self.pending
+        self.pending = {}
+        self.pending_count = 0
+        self.in_flight = batch
+        self.space_available.set()
+        self.flushes += 1
+        try:
+            return await self.write_batch(batch)
+        finally:
+            self.in_flight = {}
+
+    @contextlib.asynccontextmanager
+    async def paused(self):
+        """Flushes, then holds off any more flushes until the block is done (writes queue up as usual meanwhile).
+        Gives whether the flush wrote everything."""
+        async with self.flush_lock:
+            yield await self.flush_locked()
+
+    def notify_upserted(self, follow_ups, collection_name, entries, indices):
+        callback = self.on_upserted.get(collection_name)
+        if callback is None or len(indices) == 0:
+            return
+        try:
+            for write in callback([(entries[index][0], entries[index][1]) for index in indices]):
+                self.merge_into(follow_ups, *write)
+        except Exception:
+            print(traceback.format_exc())
+
+    async def write_batch(self, batch):
+        failed = {}
+        # Writes from on_upserted callbacks, sent straight after this batch.
+        follow_ups = {}
+        for collection_name, entries in batch.items():
+            entries = list(entries.values())
+            requests = [UpdateOne({"_id": document_id}, update, upsert=upsert)
+                        for document_id, update, upsert in entries]
+            try:
+                result = await self.database[collection_name].bulk_write(requests, ordered=False)
+                self.written += len(requests)
+                self.notify_upserted(follow_ups, collection_name, entries, list(result.upserted_ids.keys()))
+            except BulkWriteError as e:
+                # The rest of the batch went through. These documents were rejected by the server rather than
+                # lost in transit, so retrying them won't help.
+                write_errors = e.details.get("writeErrors", [])
+                self.written += len(requests) - len(write_errors)
+                self.notify_upserted(follow_ups, collection_name, entries,
+                                     [x.get("index") for x in e.details.get("upserted", [])])
+                for write_error in write_errors:
+                    print(f"Dropped buffered write to {collection_name}: {write_error.get('errmsg')}")
+            except Exception:
+                print(traceback.format_exc())
+                failed[collection_name] = entries
+        written = True
+        if len(failed) != 0:
+            self.failures += 1
+            for collection_name, entries in failed.items():
+                for document_id, update, upsert in entries:
+                    self.merge(collection_name, document_id, update, upsert, newer=False)
+            written = False
+        if len(follow_ups) != 0:
+            written = await self.write_batch(follow_ups) and written
+        return written
+
+    async def close(self):
+        self.closed = True
+        self.batch_ready.set()
+        self.space_available.set()
+        if self.task is not None:
+            await self.task
+        for _ in range(3):
+            if await self.flush():
+                return
+            await asyncio.sleep(self.flush_interval)
@@ -0,0 +1,77 @@
+import sys
+import time
+from collections import OrderedDict
+
+
+def deep_sizeof(value):
+    """Rough size in bytes of value, including everything it contains."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(key) + deep_sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item) for item in value)
+    return size
+
+
+class TTLCache:
+    """Least-recently-used cache where entries also expire ttl seconds after they were set.
+
+    With max_bytes, entries are also evicted (least recently used first) to keep the total of sizeof(value) under it.
+    A value bigger than max_bytes on its own isn't cached at all.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, max_bytes=None, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (deep_sizeof if max_bytes is not None else None)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.evictions += 1
+            return
+        self.entries[key] = (value, time.monotonic() + self.ttl, size)
+        self.total_bytes += size
+        while len(self.entries) > self.max_size or \
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._remove(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
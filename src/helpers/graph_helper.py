@@ -1,3 +1,5 @@
+import functools
+
 import humanize
 import pandas
 import matplotlib
@@ -12,6 +14,19 @@ from io import BytesIO
 matplotlib.use("Agg")
 
 
+def fresh_figure(function):
+    """These run in long-lived pool workers, so each plot has to start on (and leave behind) a clean pyplot."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        plt.close("all")
+        try:
+            return function(*args, **kwargs)
+        finally:
+            plt.close("all")
+    return wrapper
+
+
+@fresh_figure
 def file_from_timestamps(times, group):
     file = BytesIO()
     series = pandas.Series(times)
@@ -27,6 +42,7 @@ def file_from_timestamps(times, group):
     return file.read()
 
 
+@fresh_figure
 def pie_chart_from_amount_and_labels(labels, amounts):
     file = BytesIO()
     amounts = np.array(amounts)
@@ -58,6 +74,7 @@ def format_with_suffix(number, _):
     return str(number) + EXPONENT_SYMBOLS[exponent_place]
 
 
+@fresh_figure
 def tfm_graph(flip_data, y_label):
     file = BytesIO()
     series = pandas.Series([x[1] for x in flip_data], index=[x[0] for x in flip_data])
@@ -79,6 +96,7 @@ def num_humanizer(x, pos=0):
     return humanize.intword(x, format="%.2f")
 
 
+@fresh_figure
 def plot_multiple(x_label="", y_label="", title="", **kwargs):
     file = BytesIO()
     plt.gca().xaxis.set_major_formatter(dates.DateFormatter("%Y-%m-%d %H:%M"))
@@ -104,6 +122,7 @@ def plot_multiple(x_label="", y_label="", title="", **kwargs):
     return file.read()
 
 
+@fresh_figure
 def plot_stats(data, *_, x_label=None, y_label=None, smooth=True):
     file = BytesIO()
     x_values = np.arange(-len(data) + 1, 1, 1)
@@ -127,6 +146,7 @@ def plot_stats(data, *_, x_label=None, y_label=None, smooth=True):
     return file.read()
 
 
+@fresh_figure
 def plot_and_extrapolate(input_data, extrapolated_values, *_, x_label=None, y_label=None, smooth=True):
     file = BytesIO()
     x_values = np.arange(-len(input_data) + 1, 1, 1)
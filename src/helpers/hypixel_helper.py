@@ -2,15 +2,24 @@ import math
 import PIL.Image
 import PIL.ImageDraw
 import PIL.ImageFont
-import PIL.ImageChops
 import aiohttp
 import asyncio
 import aiohttp.client_exceptions
 import collections
+import copy
 import datetime
+import discord
+import hashlib
+import numpy
+import time
+import traceback
 from scipy.optimize import curve_fit
+from functools import partial
 from io import BytesIO
 from main import UtilsBot
+from src.helpers.cache_helper import TTLCache
+from src.helpers.pool_helper import WorkerPool
+from src.helpers.rate_helper import RateBudget
 
 EASY_LEVELS = 4
 EASY_LEVELS_XP = 7000
@@ -18,115 +27,259 @@ XP_PER_PRESTIGE = 96 * 5000 + EASY_LEVELS_XP
 LEVELS_PER_PRESTIGE = 100
 HIGHEST_PRESTIGE = 10
 API_URL = "https://api.hypixel.net/"
+CARD_SIZE = 1024
+CARD_TEXT_FILL = (255, 100, 255)
+# Fonts and blank cards for get_file_for_member, loaded once per process by load_card_resources.
+card_resources = None
 
 exceptions = (asyncio.exceptions.TimeoutError, aiohttp.client_exceptions.ServerDisconnectedError,
               aiohttp.client_exceptions.ClientConnectorError, aiohttp.client_exceptions.ClientPayloadError)
 waiting_exceptions = (aiohttp.client_exceptions.ClientOSError, aiohttp.client_exceptions.ContentTypeError)
 
 
-class CustomAsyncDeque(asyncio.Queue):
-    def _init(self, maxsize):
-        self._queue = collections.deque()
+class HypixelAPIError(Exception):
+    """A Hypixel API request that failed for good, after every retry."""
+
+
+class HypixelRequest:
+    __slots__ = ("endpoint", "parameters", "prioritize", "future", "queued_at", "attempts")
+
+    def __init__(self, endpoint, parameters, prioritize, future):
+        self.endpoint = endpoint
+        self.parameters = parameters or {}
+        self.prioritize = prioritize
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
 
-    def _put(self, item):
-        try:
-            if item[4]:
-                self._queue.appendleft(item)
-                return
-        except IndexError:
-            pass
-        self._queue.append(item)
 
-    def peek(self):
-        if self.empty():
-            return None
-        item = self._queue.popleft()
-        self._queue.appendleft(item)
-        return item
+class CachedCard:
+    """A player's drawn card, as cached by the Hypixel cog."""
+    __slots__ = ("data", "fingerprint", "checked_at", "modified_at")
+
+    def __init__(self, data, fingerprint):
+        self.data = data
+        self.fingerprint = fingerprint
+        # When the card was last drawn, or last found to still be up to date.
+        self.checked_at = datetime.datetime.now()
+        # When the card was last drawn, as a unix timestamp for Last-Modified.
+        self.modified_at = time.time()
+
+    @property
+    def age(self):
+        return (datetime.datetime.now() - self.checked_at).total_seconds()
+
+    @property
+    def etag(self):
+        return f'"{self.fingerprint}"'
 
 
 class HypixelAPI:
-    def __init__(self, bot: UtilsBot, key):
+    """Rate limited client for the Hypixel API.
+
+    Requests are queued and sent by queue_loop as soon as the rate limit allows, each one on its own (so a slow request
+    never holds up the rest) over one pooled, keep-alive session. The remaining allowance comes from the
+    ratelimit-remaining/ratelimit-reset headers of each response. Prioritized requests (commands someone is waiting on)
+    always go first, and the last priority_reserve requests of each window are kept for them alone.
+
+    Identical requests made at the same time share one upstream request, and successful responses are reused for
+    response_ttl seconds, so the allowance is spent on different players rather than the same one twice.
+    """
+
+    def __init__(self, bot: UtilsBot, key, request_timeout=10, max_attempts=3, priority_reserve=5, max_connections=20,
+                 response_ttl=15):
         self.bot = bot
         self.key = key
-        self.request_queue = CustomAsyncDeque()
+        self.request_timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self.max_attempts = max_attempts
+        self.priority_reserve = priority_reserve
+        self.max_connections = max_connections
+        self.session = None
+        self.queues = {True: collections.deque(), False: collections.deque()}
+        self.queue_changed = asyncio.Event()
+        self.ratelimit_limit = 120
         self.ratelimit_remaining = 1
-        self.ratelimit_reset_time = datetime.datetime.now()
-        self.ratelimit_lock = asyncio.Lock()
+        self.ratelimit_reset_time = time.monotonic()
+        self.loop_task = None
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_queue_wait = 0.0
+        self.pending_requests: dict[tuple, HypixelRequest] = {}
+        self.response_cache = TTLCache(max_size=1024, ttl=response_ttl)
+        self.coalesced = 0
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.request_timeout)
+        return self.session
+
+    async def close(self):
+        if self.loop_task is not None:
+            self.loop_task.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    def start(self):
+        self.loop_task = self.bot.loop.create_task(self.queue_loop())
+
+    @property
+    def queued(self):
+        return len(self.queues[True]) + len(self.queues[False])
+
+    @property
+    def average_queue_wait(self):
+        return self.total_queue_wait / self.requests if self.requests else 0.0
+
+    @property
+    def rate_limited_fraction(self):
+        return self.rate_limited / self.requests if self.requests else 0.0
+
+    def enqueue(self, request: HypixelRequest, retry=False):
+        request.queued_at = time.monotonic()
+        if retry:
+            self.queues[request.prioritize].appendleft(request)
+        else:
+            self.queues[request.prioritize].append(request)
+        self.queue_changed.set()
+
+    def prioritize(self, request: HypixelRequest):
+        try:
+            self.queues[False].remove(request)
+        except ValueError:
+            # Already sent, so there's nothing to speed up.
+            return
+        request.prioritize = True
+        self.enqueue(request, retry=True)
 
     async def safe_request(self, endpoint, parameters=None, prioritize=False):
-        returned_json = {}
-        completed_event = asyncio.Event()
-        stored_task = (endpoint, parameters, completed_event, returned_json, prioritize)
-        await self.request_queue.put(stored_task)
-        await completed_event.wait()
-        return returned_json
-
-    async def make_request(self, waited_event):
-        async with aiohttp.ClientSession() as session:
-            endpoint, parameters, completed_event, returned_json, _ = waited_event
-            if parameters is None:
-                parameters = {}
-            parameters["key"] = self.key
-            response: aiohttp.ClientResponse = await session.get(f"{API_URL}{endpoint}", params=parameters)
-            try:
-                returned_json.update(await response.json())
-            except aiohttp.ContentTypeError:
-                await self.request_queue.put(waited_event)
-                async with self.ratelimit_lock:
-                    self.ratelimit_remaining = 0
-                    self.ratelimit_reset_time = datetime.datetime.now() + datetime.timedelta(seconds=15)
-                return
-            except (*exceptions, *waiting_exceptions):
-                await self.request_queue.put(waited_event)
-                return
-            if response.status == 429:
-                sleep_time = int(response.headers.getone("retry-after"))
-                await self.request_queue.put(waited_event)
-                async with self.ratelimit_lock:
-                    self.ratelimit_remaining = 0
-                    self.ratelimit_reset_time = datetime.datetime.now() + datetime.timedelta(seconds=sleep_time)
-                return
-            if returned_json.get("cause", "") == "Invalid API key":
-                print("INVALID HYPIXEL API KEY")
-                self.ratelimit_remaining = 0
-                self.ratelimit_reset_time = datetime.datetime.now() + datetime.timedelta(seconds=600)
-                return
-            async with self.ratelimit_lock:
-                self.ratelimit_remaining = int(response.headers.getone("ratelimit-remaining"))
-                reset_delta = int(response.headers.getone("ratelimit-reset"))
-                self.ratelimit_reset_time = datetime.datetime.now() + datetime.timedelta(seconds=reset_delta)
-        completed_event.set()
+        key = (endpoint, tuple(sorted((parameters or {}).items())))
+        returned_json = self.response_cache.get(key)
+        if returned_json is None:
+            request = self.pending_requests.get(key)
+            if request is not None:
+                self.coalesced += 1
+                if prioritize and not request.prioritize:
+                    self.prioritize(request)
+            else:
+                request = HypixelRequest(endpoint, parameters, prioritize, self.bot.loop.create_future())
+                self.pending_requests[key] = request
+                request.future.add_done_callback(partial(self.request_done, key))
+                self.enqueue(request)
+            returned_json = await asyncio.shield(request.future)
+        # Every caller gets its own copy, since callers are free to change what they're given.
+        return copy.deepcopy(returned_json)
+
+    def request_done(self, key, future):
+        self.pending_requests.pop(key, None)
+        if future.exception() is not None:
+            return
+        returned_json = future.result()
+        if returned_json.get("success", False):
+            self.response_cache.set(key, returned_json)
+
+    def pause(self, seconds):
+        self.ratelimit_remaining = 0
+        self.ratelimit_reset_time = time.monotonic() + seconds
+
+    def update_ratelimit(self, headers):
+        try:
+            remaining = int(headers.getone("ratelimit-remaining"))
+            reset = int(headers.getone("ratelimit-reset"))
+        except (KeyError, ValueError):
+            return
+        try:
+            self.ratelimit_limit = int(headers.getone("ratelimit-limit"))
+        except (KeyError, ValueError):
+            pass
+        # The header doesn't know about requests that are still on their way, so don't count those twice.
+        self.ratelimit_remaining = max(0, remaining - self.in_flight)
+        self.ratelimit_reset_time = time.monotonic() + reset
+        self.queue_changed.set()
+
+    def retry(self, request: HypixelRequest):
+        request.attempts += 1
+        if request.attempts >= self.max_attempts:
+            self.failures += 1
+            request.future.set_exception(HypixelAPIError(f"{request.endpoint} failed {request.attempts} times"))
+            return
+        self.retries += 1
+        self.enqueue(request, retry=True)
+
+    async def make_request(self, request: HypixelRequest):
+        parameters = {**request.parameters, "key": self.key}
+        self.in_flight += 1
+        try:
+            async with self.get_session().get(f"{API_URL}{request.endpoint}", params=parameters) as response:
+                if response.status == 429:
+                    self.rate_limited += 1
+                    try:
+                        self.pause(int(response.headers.getone("retry-after")))
+                    except (KeyError, ValueError):
+                        self.pause(15)
+                    # Not the request's fault, so this doesn't count as an attempt.
+                    self.enqueue(request, retry=True)
+                    return
+                returned_json = await response.json()
+                self.update_ratelimit(response.headers)
+        except aiohttp.ContentTypeError:
+            # Hypixel (or Cloudflare in front of it) is returning error pages, so give it some time.
+            self.pause(15)
+            self.retry(request)
+            return
+        except (*exceptions, *waiting_exceptions):
+            self.retry(request)
+            return
+        except Exception as e:
+            print(traceback.format_exc())
+            self.failures += 1
+            request.future.set_exception(HypixelAPIError(f"{request.endpoint} failed: {e!r}"))
+            return
+        finally:
+            self.in_flight -= 1
+        if returned_json.get("cause", "") == "Invalid API key":
+            print("INVALID HYPIXEL API KEY")
+            self.pause(600)
+        request.future.set_result(returned_json)
+
+    def next_request(self):
+        now = time.monotonic()
+        if now >= self.ratelimit_reset_time and self.ratelimit_remaining < self.ratelimit_limit - self.in_flight:
+            # A new window has started, so assume the full allowance until a response says otherwise.
+            self.ratelimit_remaining = self.ratelimit_limit - self.in_flight
+            self.ratelimit_reset_time = now + 60
+        if len(self.queues[True]) != 0 and self.ratelimit_remaining > 0:
+            return self.queues[True].popleft()
+        if len(self.queues[False]) != 0 and self.ratelimit_remaining > self.priority_reserve:
+            return self.queues[False].popleft()
+        return None
 
     async def queue_loop(self):
         while True:
-            this_loop_tasks = []
-            if self.ratelimit_remaining < 10:
-                while datetime.datetime.now() < self.ratelimit_reset_time:
-                    peek_item = self.request_queue.peek()
-                    if peek_item is not None and peek_item[4] and self.ratelimit_remaining != 0:
-                        waited_event = await self.request_queue.get()
-                        this_loop_tasks.append(self.bot.loop.create_task(self.make_request(waited_event)))
-                    await asyncio.sleep((self.ratelimit_reset_time - datetime.datetime.now()).total_seconds())
-                self.ratelimit_remaining = 120
-            for i in range(self.ratelimit_remaining):
-                waited_event = await self.request_queue.get()
-                this_loop_tasks.append(self.bot.loop.create_task(self.make_request(waited_event)))
-            try:
-                await asyncio.gather(*this_loop_tasks)
-            except (*exceptions, *waiting_exceptions):
+            request = self.next_request()
+            if request is None:
+                self.queue_changed.clear()
+                # Wait for a new request, a response that changes the allowance, or the start of the next window.
+                timeout = max(0.05, self.ratelimit_reset_time - time.monotonic()) if self.queued else None
+                try:
+                    await asyncio.wait_for(self.queue_changed.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
                 continue
-            except Exception as e:
-                print("UNKNOWN EXCEPTION DISCOVERED")
-                print(e)
-                await asyncio.sleep(30)
-                print("30 second sleep over, trying again...")
+            self.ratelimit_remaining -= 1
+            self.requests += 1
+            self.total_queue_wait += time.monotonic() - request.queued_at
+            self.bot.loop.create_task(self.make_request(request))
 
     async def get_player(self, uuid, prioritize=False):
         uuid = uuid.replace("-", "")
         parameters = {"uuid": uuid}
         data = await self.safe_request("player", parameters, prioritize)
-        player = data.get("player", {})
+        # Players that have never joined come back as null.
+        player = data.get("player") or {}
         if "lastLogout" in player:
             player["lastLogout"] = datetime.datetime.fromtimestamp(player["lastLogout"] / 1000)
         if "lastLogin" in player:
@@ -140,6 +293,184 @@ class HypixelAPI:
         return data.get("session", {})
 
 
+class CardRenderer:
+    """Renders player cards in its own long-lived worker pool, so a tick's worth of cards doesn't queue behind graphs.
+
+    Cards are sent to the workers in batches (one batch per worker, up to max_batch cards each) rather than one job
+    per card. A batch that takes longer than timeout seconds per card is given up on, and its cards come back as None.
+    """
+
+    def __init__(self, loop, timeout=10, max_batch=8):
+        self.pool = WorkerPool(loop, initializers=(load_card_resources,))
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self.renders = 0
+        self.total_render_time = 0.0
+        self.slowest_render = 0.0
+        self.failures = 0
+
+    @property
+    def average_render(self):
+        return self.total_render_time / self.renders if self.renders else 0.0
+
+    async def render(self, member):
+        return (await self.render_many([member]))[0]
+
+    async def render_many(self, members):
+        # The full stats aren't drawn, so don't pay to send them to the workers.
+        members = [{key: value for key, value in member.items() if key not in ("stats", "file")}
+                   for member in members]
+        if len(members) == 0:
+            return []
+        batch_size = max(1, min(self.max_batch, math.ceil(len(members) / self.pool.max_workers)))
+        batches = [members[i:i + batch_size] for i in range(0, len(members), batch_size)]
+        results = await asyncio.gather(*[self.render_batch(batch) for batch in batches])
+        return [data for batch in results for data in batch]
+
+    async def render_batch(self, batch):
+        try:
+            rendered = await self.pool.run(render_cards, batch, timeout=self.timeout * len(batch))
+        except asyncio.TimeoutError:
+            self.failures += len(batch)
+            return [None] * len(batch)
+        except Exception:
+            print(traceback.format_exc())
+            self.failures += len(batch)
+            return [None] * len(batch)
+        for _, seconds in rendered:
+            self.renders += 1
+            self.total_render_time += seconds
+            self.slowest_render = max(self.slowest_render, seconds)
+        return [data for data, _ in rendered]
+
+    async def shutdown(self):
+        await self.pool.shutdown()
+
+
+class ChannelEditQueue:
+    """Edits the messages in one hypixel channel in the background, at most burst edits at once and rate a second after
+    that (Discord allows 5 message edits every 5 seconds in a channel).
+
+    Only the newest embed for each message is kept, so if edits fall behind the updates they are replaced rather than
+    piling up. Messages that turn out to have been deleted are collected in missing.
+    """
+
+    def __init__(self, loop, channel, rate=1, burst=5):
+        self.loop = loop
+        self.channel = channel
+        self.budget = RateBudget(rate, burst)
+        self.pending = collections.OrderedDict()
+        self.missing = set()
+        self.task = None
+        self.edits = 0
+        self.replaced = 0
+
+    def edit(self, message_id, embed):
+        if message_id in self.pending:
+            self.replaced += 1
+        self.pending[message_id] = embed
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.run())
+
+    def discard(self, message_id):
+        self.pending.pop(message_id, None)
+
+    def clear(self):
+        self.pending.clear()
+        self.missing.clear()
+
+    async def run(self):
+        while len(self.pending) > 0:
+            await self.budget.acquire()
+            if len(self.pending) == 0:
+                return
+            message_id, embed = self.pending.popitem(last=False)
+            try:
+                await self.channel.get_partial_message(message_id).edit(embed=embed)
+                self.edits += 1
+            except discord.NotFound:
+                self.missing.add(message_id)
+            except discord.HTTPException:
+                print(traceback.format_exc())
+
+    def close(self):
+        self.pending.clear()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class PollScheduler:
+    """Decides which tracked players are fetched on each update tick.
+
+    After each poll a player is given a next poll time: every tick while they're online or their games played or last
+    logout changed in the last recent_change seconds, then less often the longer they've been offline (see intervals,
+    pairs of (offline for under this many seconds, poll every this many seconds)), multiplied by unwatched_factor if
+    no channel shows them. Due players are polled most overdue first, up to the budget given each tick, and the rest
+    stay due for the next tick.
+    """
+
+    def __init__(self, intervals, dormant_interval, recent_change=30 * 60, unwatched_factor=4):
+        self.intervals = intervals
+        self.dormant_interval = dormant_interval
+        self.recent_change = recent_change
+        self.unwatched_factor = unwatched_factor
+        self.next_poll = {}
+        self.online = {}
+        # uuid -> (games played, last logout) when last polled, and when that last changed.
+        self.last_seen = {}
+        self.last_change = {}
+        self.polled = 0
+        self.deferred = 0
+
+    def due(self, uuids, budget):
+        """The players to poll now, costing at most budget requests (online players take two)."""
+        now = time.monotonic()
+        due = sorted((self.next_poll.get(uuid, 0), uuid) for uuid in uuids if self.next_poll.get(uuid, 0) <= now)
+        chosen = []
+        spent = 0
+        for _, uuid in due:
+            cost = 2 if self.online.get(uuid) else 1
+            if spent + cost > budget:
+                break
+            chosen.append(uuid)
+            spent += cost
+        self.polled = len(chosen)
+        self.deferred = len(due) - len(chosen)
+        return chosen
+
+    def record(self, player, watched=True):
+        uuid = player["uuid"]
+        now = time.monotonic()
+        seen = (player["stats"].get("Bedwars", {}).get("games_played_bedwars", 0), player["last_logout"])
+        if uuid in self.last_seen and self.last_seen[uuid] != seen:
+            self.last_change[uuid] = now
+        self.last_seen[uuid] = seen
+        self.online[uuid] = player["online"]
+        if player["online"] or now - self.last_change.get(uuid, -math.inf) < self.recent_change:
+            interval = 0
+        else:
+            last_logout = player["last_logout"]
+            # Players who have never logged out have a placeholder (naive) date.
+            offline_for = (datetime.datetime.now(datetime.timezone.utc) - last_logout).total_seconds() \
+                if last_logout.tzinfo is not None else math.inf
+            interval = next((every for under, every in self.intervals if offline_for < under), self.dormant_interval)
+        if not watched:
+            interval *= self.unwatched_factor
+        self.next_poll[uuid] = now + interval
+
+    def failed(self, uuid):
+        """Puts off a player that couldn't be fetched, so they don't take the front of the queue every tick."""
+        self.next_poll[uuid] = time.monotonic() + self.intervals[0][1]
+
+    def attempted(self, uuid):
+        return uuid in self.next_poll
+
+    def forget(self, uuids):
+        for uuid in uuids:
+            for values in (self.next_poll, self.online, self.last_seen, self.last_change):
+                values.pop(uuid, None)
+
+
 def get_xp_for_level(level):
     if level == 0:
         return 0
@@ -177,6 +508,23 @@ def get_level_from_xp(exp):
     return round(level + (exp_without_prestiges / 5000), 2)
 
 
+def get_levels_from_xp(experience):
+    """get_level_from_xp for a whole array of experience values at once."""
+    experience = numpy.asarray(experience, dtype=float)
+    prestiges = numpy.floor(experience / XP_PER_PRESTIGE)
+    exp_without_prestiges = experience - prestiges * XP_PER_PRESTIGE
+    # Total xp needed for each of the easy levels, so how many of them were passed is where the xp would sort in.
+    easy_totals = numpy.cumsum([get_xp_for_level(i) for i in range(1, EASY_LEVELS + 1)])
+    easy_levels = numpy.searchsorted(easy_totals, exp_without_prestiges, side="right")
+    exp_without_prestiges -= numpy.concatenate(([0], easy_totals))[easy_levels]
+    levels = prestiges * LEVELS_PER_PRESTIGE + easy_levels
+    # As in get_level_from_xp, only the first few levels (before any prestige) use the easy levels' xp.
+    next_level_xp = numpy.array([get_xp_for_level(level + 1) for level in range(EASY_LEVELS + 1)])
+    divisors = numpy.where(levels < EASY_LEVELS + 1,
+                           next_level_xp[numpy.minimum(levels, EASY_LEVELS).astype(int)], 5000)
+    return numpy.round(levels + exp_without_prestiges / divisors, 2)
+
+
 def get_colour_from_threat(threat_index):
     if threat_index <= 45:
         return 170, 170, 170
@@ -194,34 +542,70 @@ def get_colour_from_threat(threat_index):
         return 170, 0, 0
 
 
-def are_equal(file1, file2):
-    image1 = PIL.Image.open(file1)
-    image2 = PIL.Image.open(file2)
-    diff = PIL.ImageChops.difference(image1, image2)
-    file1.seek(0)
-    file2.seek(0)
-    if diff.getbbox():
-        return False
+def get_card_fingerprint(member):
+    """A hash of everything get_file_for_member draws, so identical cards can be spotted without drawing them."""
+    if member["online"]:
+        activity = (member.get("game"), member.get("mode"), member.get("map"))
     else:
-        return True
+        activity = member["last_logout"].strftime("%Y/%m/%d %H:%M")
+    card_inputs = (CARD_SIZE, member["name"], bool(member["online"]), activity, member["bedwars_level"],
+                   member["bedwars_winstreak"], round(member["fkdr"], 2), round(member["threat_index"], 1),
+                   get_colour_from_threat(member["threat_index"]),
+                   hashlib.sha1(member["head_image"]).hexdigest())
+    return hashlib.sha1(repr(card_inputs).encode("utf-8")).hexdigest()
+
+
+def load_card_resources():
+    """Loads the fonts and the blank online/offline cards (credits included) that every player card starts from.
+    Card render workers call this as they start, so it happens once per process rather than once per card."""
+    global card_resources
+    size = CARD_SIZE
+    width = size
+    height = width // 4
+    text_font = PIL.ImageFont.truetype("arial.ttf", size // 32)
+    credits_font = PIL.ImageFont.truetype("arial.ttf", size // 40)
+    backgrounds = {}
+    for online, fill in ((True, (16, 64, 16)), (False, (64, 16, 16))):
+        background = PIL.Image.new('RGB', (width, height), color=fill)
+        draw = PIL.ImageDraw.Draw(background)
+        credits_height = height // 2
+        credits_x = width - width // 64
+        credit_text = "Get the Utils bot!\nhttps://thom.club/"
+        draw.text((credits_x, credits_height), credit_text, font=credits_font, anchor="rm",
+                  fill=CARD_TEXT_FILL, align="center")
+        backgrounds[online] = background
+    card_resources = {"name_font": PIL.ImageFont.truetype("arial.ttf", size // 16), "text_font": text_font,
+                      "backgrounds": backgrounds}
+    return card_resources
+
+
+def get_card_resources():
+    return card_resources or load_card_resources()
+
+
+def render_cards(members):
+    """Renders a batch of player cards, returning (png bytes, seconds taken) for each."""
+    rendered = []
+    for member in members:
+        started_at = time.perf_counter()
+        member_file = get_file_for_member(member)
+        rendered.append((member_file.getvalue(), time.perf_counter() - started_at))
+        member_file.close()
+    return rendered
 
 
 def get_file_for_member(member):
+    resources = get_card_resources()
     head_file = BytesIO(member["head_image"])
     head_image = PIL.Image.open(head_file)
     final_file = BytesIO()
-    size = 1024
+    size = CARD_SIZE
     width = size
     height = width // 4
-    if member["online"]:
-        fill = (16, 64, 16)
-    else:
-        fill = (64, 16, 16)
-    image = PIL.Image.new('RGB', (width, height), color=fill)
+    image = resources["backgrounds"][bool(member["online"])].copy()
     draw = PIL.ImageDraw.Draw(image)
     name_colour = get_colour_from_threat(member["threat_index"])
-    name_font = PIL.ImageFont.truetype("arial.ttf", size // 16)
-    name_font.size = size // 16
+    name_font = resources["name_font"]
     # Write Name
     name_x = width // 2
     name_y = height // 6
@@ -246,8 +630,8 @@ def get_file_for_member(member):
         game_text = "{}".format(member["last_logout"].strftime("%Y/%m/%d %H:%M"))
     top_line_height = height // 8
     last_played_y = height - top_line_height
-    last_played_font = PIL.ImageFont.truetype("arial.ttf", size // 32)
-    regular_text_fill = (255, 100, 255)
+    last_played_font = resources["text_font"]
+    regular_text_fill = CARD_TEXT_FILL
     last_played_x = width // 64
     # last_played_x = max([draw.textsize(line, font=last_played_font)[0]
     #                      for line in game_text.split("\n")]) // 2 + width // 64
@@ -288,12 +672,6 @@ def get_file_for_member(member):
     threat_index_text = "Threat Index\n{}".format(round(member["threat_index"], 1))
     draw.text((threat_index_x, threat_index_y), threat_index_text, font=last_played_font, anchor="mm",
               fill=regular_text_fill, align="center")
-    credits_height = height // 2
-    credits_x = width - width // 64
-    credits_font = PIL.ImageFont.truetype("arial.ttf", size // 40)
-    credit_text = "Get the Utils bot!\nhttps://thom.club/"
-    draw.text((credits_x, credits_height), credit_text, font=credits_font, anchor="rm",
-              fill=regular_text_fill, align="center")
     image.save(fp=final_file, format="png")
     final_file.seek(0)
     return final_file
@@ -1,6 +1,7 @@
+import numpy
 from discord import Embed, Colour
 
-from src.helpers.hypixel_helper import get_level_from_xp
+from src.helpers.hypixel_helper import get_level_from_xp, get_levels_from_xp
 
 
 class GameModeStats:
@@ -247,6 +248,107 @@ class HypixelStats:
         return cls(solos, doubles, trios, fours, two_four, experience)
 
 
+def safe_divide(numerators, denominators):
+    """numerators / denominators, with 0 wherever the denominator is 0 (as HypixelStats.fkdr does)."""
+    numerators = numpy.asarray(numerators, dtype=float)
+    return numpy.divide(numerators, denominators, out=numpy.zeros_like(numerators), where=denominators != 0)
+
+
+class HypixelStatsHistory:
+    """A player's statistics after each of a run of games (oldest first), held as arrays rather than one
+    HypixelStats per game.
+
+    values[mode, field] is the array of that statistic for that game mode (both in the order of game_modes and fields),
+    and the properties match HypixelStats' but give an array with a value per game.
+    """
+    game_modes = ("solos", "doubles", "trios", "fours", "two_four")
+    fields = ("kills", "deaths", "beds_lost", "beds_broken", "wins", "losses", "games_played")
+
+    def __init__(self, values, experience):
+        self.values = values
+        self.experience = experience
+        self.totals = values.sum(axis=0)
+
+    def __len__(self):
+        return len(self.experience)
+
+    @classmethod
+    def from_documents(cls, documents):
+        """From statistics documents (only their stats are needed, so they can come from a projection)."""
+        count = len(documents)
+        all_stats = [document.get("stats") or {} for document in documents]
+        values = numpy.zeros((len(cls.game_modes), len(cls.fields), count))
+        for mode_index, mode in enumerate(cls.game_modes):
+            mode_stats = [stats.get(mode) or {} for stats in all_stats]
+            for field_index, field in enumerate(cls.fields):
+                values[mode_index, field_index] = numpy.fromiter((stats.get(field, 0) for stats in mode_stats),
+                                                                 dtype=float, count=count)
+        experience = numpy.fromiter((stats.get("experience", 0) for stats in all_stats), dtype=float, count=count)
+        return cls(values, experience)
+
+    def mode(self, mode_name, field):
+        return self.values[self.game_modes.index(mode_name), self.fields.index(field)]
+
+    def total(self, field):
+        return self.totals[self.fields.index(field)]
+
+    @property
+    def total_kills(self):
+        return self.total("kills")
+
+    @property
+    def kills(self):
+        return self.total_kills
+
+    @property
+    def total_deaths(self):
+        return self.total("deaths")
+
+    @property
+    def deaths(self):
+        return self.total_deaths
+
+    @property
+    def games_played(self):
+        return self.total("games_played")
+
+    @property
+    def wins(self):
+        return self.total("wins")
+
+    @property
+    def losses(self):
+        return self.total("losses")
+
+    @property
+    def beds_broken(self):
+        return self.total("beds_broken")
+
+    @property
+    def beds_lost(self):
+        return self.total("beds_lost")
+
+    @property
+    def fkdr(self):
+        return safe_divide(self.total_kills, self.total_deaths)
+
+    @property
+    def bblr(self):
+        return safe_divide(self.beds_broken, self.beds_lost)
+
+    @property
+    def win_rate(self):
+        return safe_divide(self.wins, self.losses)
+
+    @property
+    def level(self):
+        return get_levels_from_xp(self.experience)
+
+    @property
+    def threat_index(self):
+        return ((self.fkdr ** 2) * self.level) / 10
+
+
 def create_delta_embeds(title, yesterday: HypixelStats, today: HypixelStats, image=False) -> list[Embed]:
     all_embeds = []
     categories = [("Overall", (today, yesterday)), ("Solos", (today.solos, yesterday.solos)),
@@ -3,9 +3,12 @@ import datetime
 
 import discord
 import motor.motor_asyncio
+import pymongo
 from discord.ext import commands
 from pymongo.errors import BulkWriteError
 
+from src.helpers.buffer_helper import WriteBuffer, merge_operators
+from src.helpers.cache_helper import TTLCache
 from src.storage import config
 from src.storage.token import token
 
@@ -18,6 +21,161 @@ class MongoDB:
         else:
             self.client = motor.motor_asyncio.AsyncIOMotorClient(config.mongo_connection_uri)
         self.discord_db = self.client.discord
+        # Guild documents are read for every message (prefixes), so keep them around for a few minutes.
+        # Anything that writes a guild document should go through insert_guild/update_guild so this stays correct.
+        self.guild_cache = TTLCache(max_size=2048, ttl=300)
+        # Users, channels and members that are known to be stored already, so ingestion can skip checking for them.
+        # Keys are ("user", user_id), ("member", user_id, guild_id) and ("channel", channel_id); channels map to their
+        # nostore flag, everything else to True.
+        self.known_entities = TTLCache(max_size=100000, ttl=6 * 60 * 60)
+        # Live message, user, channel and member writes are batched up here rather than sent one at a time.
+        self.write_buffer = WriteBuffer(self.discord_db)
+        # Live messages are only counted once their write is known to have stored them for the first time, so one
+        # that backfilling stored first (or a retried write) isn't counted again.
+        self.write_buffer.on_upserted["messages"] = self.count_upserted_messages
+        # Held while message stats are rebuilt, and by anything that stores messages directly rather than buffering
+        # them, so the recount can't race with them.
+        self.stats_lock = asyncio.Lock()
+        # Guilds whose user_stats and guild_stats have been counted from their messages at least once. Until then,
+        # they only hold what has been stored since, so reads fall back to the messages collection.
+        self.stats_guilds = set()
+
+    async def close(self):
+        await self.write_buffer.close()
+
+    async def ensure_indexes(self):
+        await self.discord_db.user_stats.create_index("_id.guild_id")
+        await self.discord_db.members.create_index("_id.user_id")
+
+    async def add_message_stats(self, message_documents, deleted=False):
+        """Counts newly stored messages (or, with deleted=True, newly deleted ones) towards the user_stats and
+        guild_stats documents, which hold message counts and first/last message times for each member and guild.
+
+        These are $incs, which a retried write can apply twice, so rebuild_message_stats recounts them now and then.
+        """
+        for write in self.message_stats_writes(message_documents, deleted):
+            await self.write_buffer.update(*write)
+
+    @staticmethod
+    def message_stats_writes(message_documents, deleted=False):
+        """The buffered writes for add_message_stats, as (collection_name, document_id, update, upsert)."""
+        user_updates = {}
+        guild_updates = {}
+        for message_document in message_documents:
+            user_id, guild_id = message_document.get("user_id"), message_document.get("guild_id")
+            if deleted:
+                update = {"$inc": {"undeleted_count": -1}}
+            else:
+                created_at = message_document.get("created_at")
+                update = {"$inc": {"count": 1, "undeleted_count": 0 if message_document.get("deleted") else 1},
+                          "$min": {"first_message_at": created_at, "first_message_id": message_document.get("_id")},
+                          "$max": {"last_message_at": created_at}}
+            merge_operators(user_updates.setdefault((user_id, guild_id), {}), update)
+            merge_operators(guild_updates.setdefault(guild_id, {}), update)
+        # Deletions only adjust documents that already exist, rather than creating ones with negative counts.
+        writes = [("user_stats", {"user_id": user_id, "guild_id": guild_id}, update, not deleted)
+                  for (user_id, guild_id), update in user_updates.items()]
+        writes += [("guild_stats", guild_id, update, not deleted) for guild_id, update in guild_updates.items()]
+        return writes
+
+    def count_upserted_messages(self, upserted):
+        # Sent with the flush that stored the messages, so nothing can recount them in between. A message deleted
+        # before it was written has already been taken off by mark_messages_deleted, so it still counts as undeleted.
+        return self.message_stats_writes([{**update.get("$set", {}), "_id": message_id, "deleted": False}
+                                          for message_id, update in upserted])
+
+    async def load_stats_guilds(self):
+        self.stats_guilds.update(await self.discord_db.guild_stats.distinct("_id", {"rebuilt_at": {"$exists": True}}))
+
+    def has_message_stats(self, guild_id):
+        return guild_id in self.stats_guilds
+
+    async def get_user_stats(self, user_id, guild_id):
+        return await self.find_by_id(self.discord_db.user_stats, {"user_id": user_id, "guild_id": guild_id})
+
+    async def get_guild_stats(self, guild_id):
+        return await self.find_by_id(self.discord_db.guild_stats, guild_id)
+
+    async def rebuild_message_stats(self, guild_id):
+        """Recounts user_stats and guild_stats for a guild from the messages collection.
+
+        Buffered writes aren't sent and backfilling waits until it's done, so every message is either in the recount
+        or counted afterwards, never both."""
+        async with self.stats_lock, self.write_buffer.paused() as flushed:
+            if not flushed:
+                raise RuntimeError("Couldn't write buffered messages before recounting")
+            await self.recount_message_stats(guild_id)
+        self.stats_guilds.add(guild_id)
+
+    async def recount_message_stats(self, guild_id):
+        pipeline = [
+            {"$match": {"guild_id": guild_id}},
+            {"$group": {"_id": {"user_id": "$user_id", "guild_id": "$guild_id"},
+                        "count": {"$sum": 1},
+                        "undeleted_count": {"$sum": {"$cond": ["$deleted", 0, 1]}},
+                        "first_message_at": {"$min": "$created_at"},
+                        "first_message_id": {"$min": "$_id"},
+                        "last_message_at": {"$max": "$created_at"}}},
+            {"$merge": {"into": "user_stats", "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ]
+        await self.discord_db.messages.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+        pipeline = [
+            {"$match": {"_id.guild_id": guild_id}},
+            {"$group": {"_id": "$_id.guild_id",
+                        "count": {"$sum": "$count"},
+                        "undeleted_count": {"$sum": "$undeleted_count"},
+                        "first_message_at": {"$min": "$first_message_at"},
+                        "first_message_id": {"$min": "$first_message_id"},
+                        "last_message_at": {"$max": "$last_message_at"}}},
+            {"$merge": {"into": "guild_stats", "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ]
+        await self.discord_db.user_stats.aggregate(pipeline).to_list(length=None)
+        # Set separately, as a guild without any messages has nothing to $merge.
+        await self.discord_db.guild_stats.update_one({"_id": guild_id},
+                                                     {"$set": {"rebuilt_at": datetime.datetime.utcnow()}}, upsert=True)
+
+    async def count_messages(self, guild_id, user_id=None, undeleted=False):
+        if self.has_message_stats(guild_id):
+            if user_id is None:
+                stats = await self.get_guild_stats(guild_id)
+            else:
+                stats = await self.get_user_stats(user_id, guild_id)
+            return stats.get("undeleted_count" if undeleted else "count", 0)
+        query = {"guild_id": guild_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        if undeleted:
+            query["deleted"] = False
+        return await self.discord_db.messages.count_documents(query)
+
+    async def get_first_message(self, user_id, guild_id):
+        if self.has_message_stats(guild_id):
+            user_stats = await self.get_user_stats(user_id, guild_id)
+            if user_stats.get("first_message_id") is None:
+                return {}
+            return await self.find_by_id(self.discord_db.messages, user_stats.get("first_message_id"))
+        first_message = await self.discord_db.messages.find_one({"user_id": user_id, "guild_id": guild_id},
+                                                                sort=[("created_at", pymongo.ASCENDING)])
+        return first_message or {}
+
+    async def get_first_message_at(self, user_id, guild_id):
+        if self.has_message_stats(guild_id):
+            return (await self.get_user_stats(user_id, guild_id)).get("first_message_at")
+        return (await self.get_first_message(user_id, guild_id)).get("created_at")
+
+    async def get_first_message_times(self, guild_id):
+        """First message time of every member of a guild with any messages, by user id."""
+        if self.has_message_stats(guild_id):
+            query = self.discord_db.user_stats.find({"_id.guild_id": guild_id}, projection={"first_message_at": 1})
+            return {x.get("_id").get("user_id"): x.get("first_message_at") async for x in query}
+        pipeline = [{"$match": {"guild_id": guild_id}},
+                    {"$group": {"_id": "$user_id", "first_message_at": {"$min": "$created_at"}}}]
+        query = self.discord_db.messages.aggregate(pipeline, allowDiskUse=True)
+        return {x.get("_id"): x.get("first_message_at") async for x in query}
+
+    async def buffered_insert(self, collection_name, document):
+        fields = {key: value for key, value in document.items() if key != "_id"}
+        await self.write_buffer.set(collection_name, document["_id"], fields, upsert=True)
 
     @staticmethod
     async def force_insert(collection, document):
@@ -33,37 +191,97 @@ class MongoDB:
             return {}
         return result
 
+    async def get_guild_document(self, guild_id):
+        guild_document = self.guild_cache.get(guild_id)
+        if guild_document is None:
+            guild_document = await self.find_by_id(self.discord_db.guilds, guild_id)
+            self.guild_cache.set(guild_id, guild_document)
+        return guild_document
+
+    async def update_guild(self, guild_id, update):
+        await self.discord_db.guilds.update_one({"_id": guild_id}, update)
+        self.guild_cache.invalidate(guild_id)
+
     async def insert_guild(self, guild: discord.Guild):
         guild_document = {"_id": guild.id, "name": guild.name, "removed": False, "stats": True}
         await self.force_insert(self.discord_db.guilds, guild_document)
+        self.guild_cache.invalidate(guild.id)
         return guild_document
 
+    async def ensure_guild(self, guild: discord.Guild):
+        if not await self.get_guild_document(guild.id):
+            await self.insert_guild(guild)
+
+    async def load_known_channels(self):
+        async for channel_document in self.discord_db.channels.find(projection={"nostore": 1}):
+            self.known_entities.set(("channel", channel_document.get("_id")), channel_document.get("nostore", False))
+
+    async def get_channel_nostore(self, channel: discord.TextChannel):
+        """Whether messages from this channel shouldn't be stored. Stores the channel first if it isn't already."""
+        key = ("channel", channel.id)
+        nostore = self.known_entities.get(key)
+        if nostore is None:
+            channel_document = await self.discord_db.channels.find_one({"_id": channel.id}, projection={"nostore": 1})
+            if channel_document is None:
+                await self.insert_channel(channel)
+                nostore = False
+            else:
+                nostore = channel_document.get("nostore", False)
+            self.known_entities.set(key, nostore)
+        return nostore
+
+    # Channel writes go through the write buffer, so they land after (and merge with) a buffered insert_channel.
+    async def set_channel_nostore(self, channel_id):
+        await self.write_buffer.set("channels", channel_id, {"nostore": True})
+        self.known_entities.set(("channel", channel_id), True)
+
+    async def mark_channel_deleted(self, channel_id):
+        await self.write_buffer.set("channels", channel_id, {"deleted": True})
+
     async def insert_channel(self, channel: discord.TextChannel):
-        guild_result = await self.discord_db.guilds.find_one({"_id": channel.guild.id})
-        if guild_result is None:
-            await self.insert_guild(channel.guild)
+        await self.ensure_guild(channel.guild)
         channel_document = {"_id": channel.id, "name": channel.name, "guild_id": channel.guild.id, "deleted": False,
                             "excluded": False}
-        await self.force_insert(self.discord_db.channels, channel_document)
+        await self.buffered_insert("channels", channel_document)
 
     async def insert_user(self, user: discord.User):
         user_document = {"_id": user.id, "name": user.name, "discriminator": user.discriminator, "bot": user.bot,
                          "avatar_hash": user.avatar}
-        await self.force_insert(self.discord_db.users, user_document)
+        await self.buffered_insert("users", user_document)
+        self.known_entities.set(("user", user.id), True)
 
     async def insert_member(self, member: discord.Member):
         if isinstance(member, discord.User):
             return
-        user_result = await self.discord_db.users.find_one({"_id": member.id})
-        if user_result is None:
-            # noinspection PyTypeChecker
-            await self.insert_user(member)
-        guild_result = await self.discord_db.guilds.find_one({"_id": member.guild.id})
-        if guild_result is None:
-            await self.insert_guild(member.guild)
+        if self.known_entities.get(("user", member.id)) is None:
+            user_result = await self.discord_db.users.find_one({"_id": member.id}, projection={"_id": 1})
+            if user_result is None:
+                # noinspection PyTypeChecker
+                await self.insert_user(member)
+            else:
+                self.known_entities.set(("user", member.id), True)
+        await self.ensure_guild(member.guild)
         member_document = {"_id": {"user_id": member.id, "guild_id": member.guild.id},
                            "nick": member.nick, "joined_at": member.joined_at, "deleted": False}
-        await self.force_insert(self.discord_db.members, member_document)
+        await self.buffered_insert("members", member_document)
+        self.known_entities.set(("member", member.id, member.guild.id), True)
+
+    async def ensure_member(self, member: discord.Member):
+        key = ("member", member.id, member.guild.id)
+        if self.known_entities.get(key) is not None:
+            return
+        # Member ids are compound, and the key order has to match the stored documents for the lookup to hit.
+        member_result = await self.discord_db.members.find_one({"_id": {"user_id": member.id,
+                                                                        "guild_id": member.guild.id}},
+                                                               projection={"_id": 1})
+        if member_result is None:
+            await self.insert_member(member)
+        else:
+            self.known_entities.set(key, True)
+
+    async def remove_member(self, member: discord.Member):
+        await self.write_buffer.set("members", {"user_id": member.id, "guild_id": member.guild.id}, {"deleted": True})
+        self.known_entities.invalidate(("member", member.id, member.guild.id))
 
     @staticmethod
     def _make_message_document(message):
@@ -76,17 +294,35 @@ class MongoDB:
         return message_document
 
     async def insert_message(self, message: discord.Message):
-        channel_result = await self.discord_db.channels.find_one({"_id": message.channel.id})
-        if channel_result is None:
-            await self.insert_channel(message.channel)
-        else:
-            if channel_result.get("nostore", False):
-                return
-        member_result = await self.discord_db.members.find_one({"_id": message.author.id})
-        if member_result is None:
-            await self.insert_member(message.author)
+        if await self.get_channel_nostore(message.channel):
+            return
+        await self.ensure_member(message.author)
         message_document = self._make_message_document(message)
-        await self.force_insert(self.discord_db.messages, message_document)
+        await self.buffered_insert("messages", message_document)
+
+    async def mark_messages_deleted(self, message_ids):
+        # Only messages that weren't already deleted come off the undeleted counts. Anything still waiting in the
+        # write buffer is checked there, since the database doesn't have it yet.
+        message_documents = {}
+        unbuffered_ids = []
+        for message_id in message_ids:
+            pending_fields = self.write_buffer.get_pending("messages", message_id)
+            if pending_fields is not None and "user_id" in pending_fields:
+                message_documents[message_id] = {"_id": message_id, **pending_fields}
+            else:
+                unbuffered_ids.append(message_id)
+        if len(unbuffered_ids) != 0:
+            query = self.discord_db.messages.find({"_id": {"$in": unbuffered_ids}},
+                                                  projection={"user_id": 1, "guild_id": 1, "deleted": 1})
+            async for message_document in query:
+                message_documents.setdefault(message_document.get("_id"), message_document)
+        for message_id in message_ids:
+            pending_fields = self.write_buffer.get_pending("messages", message_id) or {}
+            if pending_fields.get("deleted", False):
+                message_documents.pop(message_id, None)
+            await self.write_buffer.set("messages", message_id, {"deleted": True})
+        await self.add_message_stats([x for x in message_documents.values() if not x.get("deleted", False)],
+                                     deleted=True)
 
     async def insert_channel_messages(self, list_of_messages):
         """Requires that all messages be from the same channel"""
@@ -114,10 +350,15 @@ class MongoDB:
             await self.discord_db.channels.insert_many(channel_documents, ordered=False)
         except BulkWriteError:
             pass
-        try:
-            await self.discord_db.messages.insert_many(message_documents, ordered=False)
-        except BulkWriteError:
-            pass
+        async with self.stats_lock:
+            try:
+                await self.discord_db.messages.insert_many(message_documents, ordered=False)
+                inserted = message_documents
+            except BulkWriteError as e:
+                # Messages that were already stored (e.g. from on_message) mustn't be counted twice.
+                failed = set(x.get("index") for x in e.details.get("writeErrors", []))
+                inserted = [x for index, x in enumerate(message_documents) if index not in failed]
+            await self.add_message_stats(inserted)
 
     async def message_edit(self, payload: discord.RawMessageUpdateEvent):
         is_bot = payload.data.get("author", {}).get("bot", False)
@@ -125,10 +366,16 @@ class MongoDB:
         if last_edited is None:
             return None
         timestamp = datetime.datetime.fromisoformat(last_edited)
-        message_document = await self.discord_db.messages.find_one({"_id": payload.message_id})
-        if message_document is None:
-            return
-        old_edits = sorted(message_document.get("edits", []), key=lambda x: x.get("timestamp"))
+        # The message (or an earlier edit) may still be waiting in the write buffer.
+        pending_fields = self.write_buffer.get_pending("messages", payload.message_id)
+        if pending_fields is not None and "edits" in pending_fields:
+            old_edits = list(pending_fields["edits"])
+        else:
+            message_document = await self.discord_db.messages.find_one({"_id": payload.message_id})
+            if message_document is None:
+                return
+            old_edits = message_document.get("edits", [])
+        old_edits = sorted(old_edits, key=lambda x: x.get("timestamp"))
         if len(old_edits) > 10 and is_bot:
             return
         edit_document = {"timestamp": timestamp, "content": payload.data.get("content", None),
@@ -138,7 +385,7 @@ class MongoDB:
             old_edits[-1] = edit_document
         else:
             old_edits.append(edit_document)
-        await self.discord_db.messages.update_one({"_id": payload.message_id}, {'$set': {"edits": old_edits}})
+        await self.write_buffer.set("messages", payload.message_id, {"edits": old_edits})
 
     @staticmethod
     async def find_by_column(collection, column, value):
@@ -0,0 +1,100 @@
+import asyncio
+import concurrent.futures
+import importlib
+import os
+import time
+from functools import partial
+
+
+def warm_up(module_names, initializers=()):
+    """Runs once in each worker as it starts, so the first real job doesn't pay for the imports (or for anything the
+    initializers load up front)."""
+    for module_name in module_names:
+        importlib.import_module(module_name)
+    for initializer in initializers:
+        initializer()
+
+
+def no_op():
+    return None
+
+
+class WorkerPool:
+    """A long-lived ProcessPoolExecutor shared by the whole bot.
+
+    The executor (and its workers) are only started on first use. At most max_workers jobs are handed to the executor
+    at once; anything else waits here, which is what queue_depth counts.
+    """
+
+    def __init__(self, loop, max_workers=None, warm_modules=(), initializers=()):
+        self.loop = loop
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.warm_modules = tuple(warm_modules)
+        self.initializers = tuple(initializers)
+        self.executor = None
+        self.semaphore = asyncio.Semaphore(self.max_workers)
+        self.queue_depth = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.timeouts = 0
+
+    def start(self):
+        if self.executor is not None:
+            return self.executor
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, initializer=warm_up,
+                                                               initargs=(self.warm_modules, self.initializers))
+        # Workers are spawned on demand, so submit one job per worker to get them all started and warmed up.
+        for _ in range(self.max_workers):
+            self.executor.submit(no_op)
+        return self.executor
+
+    async def run(self, function, *args, timeout=None, **kwargs):
+        """Runs function in a worker. With a timeout, gives up waiting after that many seconds (raising
+        asyncio.TimeoutError). A job that has already started carries on in its worker, and keeps its slot until it
+        finishes, so jobs that time out can't pile up past max_workers."""
+        executor = self.start()
+        queued_at = time.perf_counter()
+        self.queue_depth += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+        started_at = time.perf_counter()
+        self.total_wait += started_at - queued_at
+        self.running += 1
+        try:
+            future = self.loop.run_in_executor(executor, partial(function, *args, **kwargs))
+        except Exception:
+            self.job_done(started_at, None)
+            raise
+        future.add_done_callback(partial(self.job_done, started_at))
+        try:
+            # Shielded, so giving up on the job doesn't cancel the future that frees its slot.
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def job_done(self, started_at, _):
+        self.running -= 1
+        self.completed += 1
+        self.total_run += time.perf_counter() - started_at
+        self.semaphore.release()
+
+    @property
+    def average_wait(self):
+        return self.total_wait / self.completed if self.completed else 0.0
+
+    @property
+    def average_run(self):
+        return self.total_run / self.completed if self.completed else 0.0
+
+    async def shutdown(self):
+        """Lets running jobs finish, then stops the workers. The pool starts again if it's used afterwards."""
+        if self.executor is None:
+            return
+        executor = self.executor
+        self.executor = None
+        await self.loop.run_in_executor(None, partial(executor.shutdown, wait=True))
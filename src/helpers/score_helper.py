@@ -0,0 +1,263 @@
+import asyncio
+import bisect
+import datetime
+from array import array
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from src.helpers.sync_mongo_helper import guild_members_pipeline
+
+ACTIVITY_WINDOW = datetime.timedelta(days=7)
+ACTIVE_SECONDS = 60
+# Messages this close to the last flush are re-read from the messages collection on load, in case they were still
+# in flight when the rollup was written. Duplicates are dropped on the way in.
+FLUSH_MARGIN = datetime.timedelta(minutes=5)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_seconds(timestamp: datetime.datetime) -> float:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (timestamp - EPOCH).total_seconds()
+
+
+def from_seconds(seconds: float) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class UserActivity:
+    """Sorted message times (and their channels) for one member inside the scoring window.
+
+    The score is the same greedy "one point per 60 seconds of activity" count that get_guild_score does, kept
+    up to date as messages are appended and only recounted when the window slides or the excluded channels change.
+    """
+    __slots__ = ("times", "channels", "score", "first_active", "last_active", "stale")
+
+    def __init__(self):
+        self.times = array("d")
+        self.channels = array("q")
+        self.score = 0
+        self.first_active = None
+        self.last_active = None
+        self.stale = False
+
+    def _contains(self, index, seconds, channel_id):
+        while index < len(self.times) and self.times[index] == seconds:
+            if self.channels[index] == channel_id:
+                return True
+            index += 1
+        return False
+
+    def _count(self, seconds):
+        if self.last_active is None or seconds - self.last_active >= ACTIVE_SECONDS:
+            if self.first_active is None:
+                self.first_active = seconds
+            self.last_active = seconds
+            self.score += 1
+
+    def add(self, seconds, channel_id, excluded):
+        index = bisect.bisect_left(self.times, seconds)
+        if self._contains(index, seconds, channel_id):
+            return False
+        if index == len(self.times):
+            self.times.append(seconds)
+            self.channels.append(channel_id)
+            if not self.stale and channel_id not in excluded:
+                self._count(seconds)
+        else:
+            # Arrived out of order (backfill), so the greedy count has to be redone.
+            self.times.insert(index, seconds)
+            self.channels.insert(index, channel_id)
+            self.stale = True
+        return True
+
+    def prune(self, cutoff):
+        index = bisect.bisect_right(self.times, cutoff)
+        if index != 0:
+            del self.times[:index]
+            del self.channels[:index]
+            self.stale = True
+
+    def recount(self, excluded):
+        self.score = 0
+        self.first_active = None
+        self.last_active = None
+        self.stale = False
+        for seconds, channel_id in zip(self.times, self.channels):
+            if channel_id not in excluded:
+                self._count(seconds)
+
+    def get_score(self, cutoff, excluded):
+        self.prune(cutoff)
+        if self.stale:
+            self.recount(excluded)
+        return self.score
+
+
+class GuildActivity:
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.users: dict[int, UserActivity] = {}
+        self.members = set()
+        self.excluded = set()
+        self.nostore = set()
+        self.dirty = set()
+
+
+class ScoreEngine:
+    """Streaming replacement for get_guild_score/get_user_score.
+
+    Guilds are loaded lazily on their first read: from the activity rollup collection, then topped up from the
+    messages collection for anything newer than the last flush. After that, on_message keeps them current and reads
+    never touch the messages collection.
+    """
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+        self.collection = mongo.discord_db.activity
+        self.guilds: dict[int, GuildActivity] = {}
+        # Activity for guilds that haven't been loaded yet. The messages collection can't be relied on to have it by
+        # the time they are, since live messages sit in the write buffer for a while first.
+        self.held = defaultdict(list)
+        self.load_locks = defaultdict(asyncio.Lock)
+
+    @staticmethod
+    def get_cutoff():
+        # Message times are naive UTC, as is everything else here.
+        return to_seconds(datetime.datetime.utcnow() - ACTIVITY_WINDOW)
+
+    async def get_guild(self, guild_id) -> GuildActivity:
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            return guild
+        async with self.load_locks[guild_id]:
+            if guild_id in self.guilds:
+                return self.guilds[guild_id]
+            guild = await self.load_guild(guild_id)
+            for entry in self.held.pop(guild_id, []):
+                self._add(guild, *entry)
+            self.guilds[guild_id] = guild
+        return guild
+
+    async def load_guild(self, guild_id) -> GuildActivity:
+        guild = GuildActivity(guild_id)
+        discord_db = self.mongo.discord_db
+        guild.excluded = set(await discord_db.channels.distinct("_id", {"excluded": True, "guild_id": guild_id}))
+        guild.nostore = set(await discord_db.channels.distinct("_id", {"nostore": True, "guild_id": guild_id}))
+        aggregation = discord_db.members.aggregate(guild_members_pipeline(guild_id))
+        guild.members = set(x.get("_id").get("user_id") for x in await aggregation.to_list(length=None))
+        cutoff = datetime.datetime.utcnow() - ACTIVITY_WINDOW
+        catch_up_from = cutoff
+        async for document in self.collection.find({"_id.guild_id": guild_id}):
+            user_id = document.get("_id").get("user_id")
+            for created_at, channel_id in zip(document.get("times", []), document.get("channels", [])):
+                self._add(guild, user_id, channel_id, to_seconds(created_at))
+            catch_up_from = max(catch_up_from, document.get("flushed_at", cutoff) - FLUSH_MARGIN)
+        query = discord_db.messages.find({"created_at": {"$gt": catch_up_from}, "guild_id": guild_id},
+                                         projection={"user_id": 1, "channel_id": 1, "created_at": 1})
+        async for message in query:
+            self._add(guild, message.get("user_id"), message.get("channel_id"), to_seconds(message.get("created_at")))
+        return guild
+
+    def _add(self, guild: GuildActivity, user_id, channel_id, seconds):
+        if channel_id in guild.nostore or seconds <= self.get_cutoff():
+            return
+        activity = guild.users.get(user_id)
+        if activity is None:
+            activity = UserActivity()
+            guild.users[user_id] = activity
+        if activity.add(seconds, channel_id, guild.excluded):
+            guild.dirty.add(user_id)
+
+    def add_activity(self, guild_id, user_id, channel_id, created_at):
+        entry = (user_id, channel_id, to_seconds(created_at))
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            # Anything also found by the load is dropped as a duplicate.
+            self.held[guild_id].append(entry)
+        else:
+            self._add(guild, *entry)
+
+    def add_message(self, message):
+        self.add_activity(message.guild.id, message.author.id, message.channel.id, message.created_at)
+
+    def add_member(self, guild_id, user_id):
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            guild.members.add(user_id)
+
+    def remove_member(self, guild_id, user_id):
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            guild.members.discard(user_id)
+
+    def set_excluded(self, guild_id, channel_id, excluded):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            return
+        if excluded:
+            guild.excluded.add(channel_id)
+        else:
+            guild.excluded.discard(channel_id)
+        for activity in guild.users.values():
+            activity.stale = True
+
+    def set_nostore(self, guild_id, channel_id):
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            guild.nostore.add(channel_id)
+
+    async def get_guild_score(self, guild_id):
+        guild = await self.get_guild(guild_id)
+        cutoff = self.get_cutoff()
+        scores = []
+        for user_id in guild.members:
+            activity = guild.users.get(user_id)
+            if activity is None:
+                continue
+            score = activity.get_score(cutoff, guild.excluded)
+            if score > 0:
+                scores.append((user_id, score, activity.first_active))
+        # Ties are broken by who was active first, which is the order get_guild_score's stable sort leaves them in.
+        scores.sort(key=lambda x: (-x[1], x[2]))
+        return [(user_id, score) for user_id, score, _ in scores]
+
+    async def get_user_score(self, user_id, guild_id):
+        guild = await self.get_guild(guild_id)
+        activity = guild.users.get(user_id)
+        if activity is None:
+            return 0
+        return activity.get_score(self.get_cutoff(), guild.excluded)
+
+    async def flush(self):
+        now = datetime.datetime.utcnow()
+        cutoff = self.get_cutoff()
+        requests = []
+        flushed = []
+        # Held activity only matters while it's inside the window.
+        for guild_id, entries in list(self.held.items()):
+            entries = [entry for entry in entries if entry[2] > cutoff]
+            if len(entries) == 0:
+                del self.held[guild_id]
+            else:
+                self.held[guild_id] = entries
+        for guild in self.guilds.values():
+            for user_id in guild.dirty:
+                activity = guild.users[user_id]
+                activity.prune(cutoff)
+                requests.append(UpdateOne({"_id": {"user_id": user_id, "guild_id": guild.guild_id}},
+                                          {"$set": {"times": [from_seconds(x) for x in activity.times],
+                                                    "channels": list(activity.channels),
+                                                    "flushed_at": now}}, upsert=True))
+            flushed.append((guild, guild.dirty))
+            guild.dirty = set()
+        if len(requests) == 0:
+            return
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except Exception:
+            for guild, dirty in flushed:
+                guild.dirty.update(dirty)
+            raise
+        await self.collection.delete_many({"flushed_at": {"$lt": now - ACTIVITY_WINDOW - FLUSH_MARGIN}})
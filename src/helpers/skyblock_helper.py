@@ -0,0 +1,267 @@
+import asyncio
+import datetime
+
+from pymongo.errors import BulkWriteError
+
+from src.helpers.models.skyblock_models import Rarity
+
+BATCH_SIZE = 50
+SOLD_BATCH_SIZE = 5000
+# Only these auctions are counted in price_rollups.
+SOLD_BIN_AUCTIONS = {"bin": True, "sold": True, "count": 1}
+PRICES = {"minimum": {"$min": "$starting_bid"}, "maximum": {"$max": "$starting_bid"},
+          "total": {"$sum": "$starting_bid"}, "count": {"$sum": 1}}
+
+
+class PriceRollups:
+    """Minimum, average and maximum auction prices at each auction update, kept in their own collections so price
+    commands are indexed range reads rather than an $unwind of every auction.
+
+    price_rollups has a document per (item_name, tier, update) for sold, single item BIN auctions, and
+    price_rollups_all one per update for every auction. Both hold the update's timestamp and the minimum, maximum,
+    total and count of starting bids, so averages over several documents can be weighted properly.
+
+    refresh rolls up any updates newer than the newest one already rolled up, along with the last refresh_window
+    worth of updates again. A BIN auction can stay listed for up to 14 days before it's marked as sold, so the updates
+    of any auction sold since the last refresh are rolled up again too (just for its item). The auctions collection
+    belongs to whatever records auctions, so those already rolled up are kept track of in rolled_up_auctions (by _id)
+    instead.
+    """
+
+    def __init__(self, skyblock_db, refresh_window=datetime.timedelta(hours=48)):
+        self.skyblock_db = skyblock_db
+        self.refresh_window = refresh_window
+        self.indexed = False
+        self.last_refreshed = None
+        self.updates_rolled_up = 0
+        # The newest auction update rolled up, which changes whenever there are new prices.
+        self.latest_update_id = None
+        # Goes up whenever older updates' prices change, as they do when long-listed auctions sell.
+        self.revision = 0
+        self.sold_rolled_up = 0
+        # Refreshes (including rebuilds) take turns, so they don't roll up or record the same auctions at once.
+        self.refresh_lock = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        if self.indexed:
+            return
+        await self.skyblock_db.auctions.create_index("updates")
+        await self.skyblock_db.price_rollups.create_index([("item_name", 1), ("tier", 1), ("timestamp", 1)])
+        await self.skyblock_db.price_rollups_all.create_index("timestamp")
+        await self.skyblock_db.auction_updates.create_index("timestamp")
+        self.indexed = True
+
+    async def refresh(self, rebuild=False):
+        async with self.refresh_lock:
+            await self.ensure_indexes()
+            # Looked up first, so it can't be newer than anything rolled up below.
+            latest_update = await self.skyblock_db.auction_updates.find_one(sort=[("timestamp", -1)])
+            newest = await self.skyblock_db.price_rollups_all.find_one(sort=[("timestamp", -1)])
+            rebuild = rebuild or newest is None
+            if rebuild:
+                update_query = {}
+                # Everything sold so far is counted by rolling up every update below. They're only recorded as rolled
+                # up once that's done, so if it fails part way, the next refresh rolls them up as newly sold instead.
+                await self.skyblock_db.rolled_up_auctions_rebuild.drop()
+                pipeline = [{"$match": SOLD_BIN_AUCTIONS}, {"$project": {"_id": 1}},
+                            {"$merge": {"into": "rolled_up_auctions_rebuild"}}]
+                await self.skyblock_db.auctions.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+            else:
+                since = min(newest["timestamp"], datetime.datetime.utcnow() - self.refresh_window)
+                update_query = {"timestamp": {"$gte": since}}
+            update_ids = await self.skyblock_db.auction_updates.distinct("_id", update_query)
+            for start in range(0, len(update_ids), BATCH_SIZE):
+                await self.roll_up(update_ids[start:start + BATCH_SIZE])
+            self.updates_rolled_up += len(update_ids)
+            if rebuild:
+                pipeline = [{"$merge": {"into": "rolled_up_auctions", "whenMatched": "keepExisting"}}]
+                await self.skyblock_db.rolled_up_auctions_rebuild.aggregate(pipeline).to_list(length=None)
+                await self.skyblock_db.rolled_up_auctions_rebuild.drop()
+                self.revision += 1
+            await self.roll_up_newly_sold()
+            self.last_refreshed = datetime.datetime.utcnow()
+            if latest_update is not None:
+                self.latest_update_id = latest_update["_id"]
+
+    @property
+    def version(self):
+        """Changes whenever any rolled up prices do."""
+        return self.latest_update_id, self.revision
+
+    async def roll_up_newly_sold(self):
+        last_id = None
+        while True:
+            match = dict(SOLD_BIN_AUCTIONS)
+            if last_id is not None:
+                match["_id"] = {"$gt": last_id}
+            pipeline = [{"$match": match},
+                        {"$sort": {"_id": 1}},
+                        {"$project": {"updates": 1, "item_name": 1}},
+                        {"$lookup": {"from": "rolled_up_auctions", "localField": "_id", "foreignField": "_id",
+                                     "as": "rolled_up"}},
+                        {"$match": {"rolled_up": {"$size": 0}}},
+                        {"$limit": SOLD_BATCH_SIZE}]
+            auctions = await self.skyblock_db.auctions.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+            if len(auctions) == 0:
+                return
+            update_ids = list({update_id for auction in auctions for update_id in auction.get("updates", [])})
+            item_names = list({auction.get("item_name") for auction in auctions})
+            for start in range(0, len(update_ids), BATCH_SIZE):
+                await self.roll_up_sold(update_ids[start:start + BATCH_SIZE], item_names)
+            await self.record_rolled_up([auction["_id"] for auction in auctions])
+            last_id = auctions[-1]["_id"]
+            self.sold_rolled_up += len(auctions)
+            self.revision += 1
+
+    async def record_rolled_up(self, auction_ids):
+        try:
+            await self.skyblock_db.rolled_up_auctions.insert_many([{"_id": x} for x in auction_ids], ordered=False)
+        except BulkWriteError:
+            # Already recorded.
+            pass
+
+    @staticmethod
+    def with_timestamp():
+        return [{"$lookup": {"from": "auction_updates", "localField": "update", "foreignField": "_id",
+                             "as": "auction_update"}},
+                {"$set": {"timestamp": {"$arrayElemAt": ["$auction_update.timestamp", 0]}}},
+                {"$unset": "auction_update"}]
+
+    async def roll_up(self, update_ids):
+        await self.roll_up_sold(update_ids)
+        await self.roll_up_all(update_ids)
+
+    async def roll_up_sold(self, update_ids, item_names=None):
+        """Rolls up price_rollups for the given updates, only for item_names if given."""
+        match = {"updates": {"$in": update_ids}, **SOLD_BIN_AUCTIONS}
+        if item_names is not None:
+            match["item_name"] = {"$in": item_names}
+        pipeline = [{"$match": match},
+                    {"$unwind": "$updates"},
+                    {"$match": {"updates": {"$in": update_ids}}},
+                    {"$group": {"_id": {"item_name": "$item_name", "tier": "$tier", "update": "$updates"}, **PRICES}},
+                    {"$set": {"item_name": "$_id.item_name", "tier": "$_id.tier", "update": "$_id.update"}},
+                    *self.with_timestamp(),
+                    {"$merge": {"into": "price_rollups", "whenMatched": "replace", "whenNotMatched": "insert"}}]
+        await self.skyblock_db.auctions.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+    async def roll_up_all(self, update_ids):
+        pipeline = [{"$match": {"updates": {"$in": update_ids}}},
+                    {"$unwind": "$updates"},
+                    {"$match": {"updates": {"$in": update_ids}}},
+                    {"$group": {"_id": "$updates", **PRICES}},
+                    {"$set": {"update": "$_id"}},
+                    *self.with_timestamp(),
+                    {"$merge": {"into": "price_rollups_all", "whenMatched": "replace", "whenNotMatched": "insert"}}]
+        await self.skyblock_db.auctions.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+    @staticmethod
+    def item_match(names, rarity=Rarity.ALL):
+        return {"item_name": {"$in": names}, "tier": rarity.name if rarity != Rarity.ALL else {"$ne": None}}
+
+    async def price_history(self, names=None, rarity=Rarity.ALL):
+        """Lists of (timestamp, price) for the minimum, average and maximum prices at each update, oldest first, for
+        the named items (as sold BIN auctions), or for every auction if names is None."""
+        if names is None:
+            documents = await self.skyblock_db.price_rollups_all.find().sort("timestamp", 1).to_list(length=None)
+        else:
+            pipeline = [{"$match": self.item_match(names, rarity)},
+                        {"$group": {"_id": "$timestamp", "minimum": {"$min": "$minimum"},
+                                    "maximum": {"$max": "$maximum"}, "total": {"$sum": "$total"},
+                                    "count": {"$sum": "$count"}}},
+                        {"$set": {"timestamp": "$_id"}},
+                        {"$sort": {"timestamp": 1}}]
+            documents = await self.skyblock_db.price_rollups.aggregate(pipeline).to_list(length=None)
+        documents = [document for document in documents if document.get("timestamp") is not None]
+        minimum_prices = [(document["timestamp"], document["minimum"]) for document in documents]
+        average_prices = [(document["timestamp"], document["total"] / document["count"]) for document in documents]
+        maximum_prices = [(document["timestamp"], document["maximum"]) for document in documents]
+        return minimum_prices, average_prices, maximum_prices
+
+    async def sell_price(self, names, rarity=Rarity.ALL):
+        """The all time minimum, average and maximum price of the named items (as sold BIN auctions). Raises
+        IndexError if they've never sold."""
+        pipeline = [{"$match": self.item_match(names, rarity)},
+                    {"$group": {"_id": None, "minimum": {"$min": "$minimum"}, "maximum": {"$max": "$maximum"},
+                                "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}}]
+        data = (await self.skyblock_db.price_rollups.aggregate(pipeline).to_list(length=None))[0]
+        return data["minimum"], round(data["total"] / data["count"], 2), data["maximum"]
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ItemNameIndex:
+    """Every auctioned item name, indexed in memory by trigram so names can be looked up without asking Mongo.
+
+    matches finds names containing the query (best matches first), and suggestions finds names that share enough
+    trigrams with it, for typos.
+    """
+
+    def __init__(self, skyblock_db):
+        self.skyblock_db = skyblock_db
+        self.names = []
+        self.lowered = []
+        self.trigram_index = {}
+        self.loaded_at = None
+
+    async def refresh(self):
+        self.build(await self.skyblock_db.auctions.distinct("item_name"))
+
+    async def ensure_loaded(self):
+        if self.loaded_at is None:
+            await self.refresh()
+
+    def build(self, names):
+        names = sorted(name for name in names if isinstance(name, str))
+        trigram_index = {}
+        for index, name in enumerate(names):
+            for trigram in trigrams(name.lower()):
+                trigram_index.setdefault(trigram, []).append(index)
+        # Swapped in all at once, so lookups never see half an index.
+        self.names, self.lowered, self.trigram_index = names, [name.lower() for name in names], trigram_index
+        self.loaded_at = datetime.datetime.utcnow()
+
+    @staticmethod
+    def rank(query, lowered_name):
+        if lowered_name == query:
+            return 0
+        if lowered_name.startswith(query):
+            return 1
+        if any(word.startswith(query) for word in lowered_name.split()):
+            return 2
+        return 3
+
+    def matches(self, query):
+        """Names containing query (ignoring case): exact match first, then names starting with it, then names with a
+        word starting with it, then the rest, shortest first within each."""
+        query = query.lower().strip()
+        if len(query) == 0:
+            return []
+        # Padding is only added to the name's ends, so only the query's inner trigrams have to appear in the name.
+        query_trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+        if len(query_trigrams) == 0:
+            candidates = range(len(self.names))
+        else:
+            candidate_lists = sorted((self.trigram_index.get(trigram, []) for trigram in query_trigrams), key=len)
+            candidates = set(candidate_lists[0]).intersection(*candidate_lists[1:])
+        found = [index for index in candidates if query in self.lowered[index]]
+        found.sort(key=lambda index: (self.rank(query, self.lowered[index]), len(self.names[index]),
+                                      self.names[index]))
+        return [self.names[index] for index in found]
+
+    def suggestions(self, query, limit=10, threshold=0.3):
+        """Up to limit names most like query, by the share of trigrams they have in common."""
+        query_trigrams = trigrams(query.lower().strip())
+        shared = {}
+        for trigram in query_trigrams:
+            for index in self.trigram_index.get(trigram, []):
+                shared[index] = shared.get(index, 0) + 1
+        scored = []
+        for index, count in shared.items():
+            similarity = count / len(query_trigrams | trigrams(self.lowered[index]))
+            if similarity >= threshold:
+                scored.append((-similarity, self.names[index]))
+        return [name for _, name in sorted(scored)[:limit]]
@@ -2,20 +2,16 @@ import pymongo
 import datetime
 from src.storage import config
 
+SCORE_PROJECTION = {"user_id": 1, "channel_id": 1, "created_at": 1}
+
 
 def get_client():
     client = pymongo.MongoClient(config.mongo_connection_uri)
     return client
 
 
-def get_guild_score(guild_id):
-    client = get_client()
-    discord_db = client.discord
-    now = datetime.datetime.now()
-    last_week = now - datetime.timedelta(days=7)
-    last_valid = {}
-    scores = {}
-    guild_members_pipeline = [
+def guild_members_pipeline(guild_id):
+    return [
         {
             "$match": {
                 "_id.guild_id": guild_id,
@@ -39,12 +35,28 @@ def get_guild_score(guild_id):
             "$project": {"_id": "$_id"}
         }
     ]
+
+
+def get_guild_score(guild_id, discord_db=None):
+    if discord_db is None:
+        discord_db = get_client().discord
+    now = datetime.datetime.utcnow()
+    last_week = now - datetime.timedelta(days=7)
     excluded_channels = discord_db.channels.find({"excluded": True, "guild_id": guild_id}).distinct("_id")
-    aggregation = discord_db.members.aggregate(guild_members_pipeline)
+    aggregation = discord_db.members.aggregate(guild_members_pipeline(guild_id))
     member_list = set(x.get("_id").get("user_id") for x in aggregation)
-    query = discord_db.messages.find({"created_at": {"$gt": last_week}, "guild_id": guild_id})
+    query = discord_db.messages.find({"created_at": {"$gt": last_week}, "guild_id": guild_id},
+                                     projection=SCORE_PROJECTION)
     query.sort("created_at", pymongo.ASCENDING)
-    for message in query:
+    return count_scores(query, member_list, excluded_channels)
+
+
+def count_scores(messages, member_list, excluded_channels):
+    """Scores from messages sorted oldest first: a message scores if it's at least 60 seconds after the last one of
+    that member's that scored."""
+    last_valid = {}
+    scores = {}
+    for message in messages:
         user_id = message.get("user_id")
         timestamp = message.get("created_at")
         channel_id = message.get("channel_id")
@@ -61,15 +73,17 @@ def get_guild_score(guild_id):
     return list_of_tuples
 
 
-def get_user_score(user_id, guild_id):
-    client = get_client()
-    discord_db = client.discord
-    now = datetime.datetime.now()
+def get_user_score(user_id, guild_id, discord_db=None):
+    if discord_db is None:
+        discord_db = get_client().discord
+    now = datetime.datetime.utcnow()
     last_week = now - datetime.timedelta(days=7)
     score = 0
     last_message = datetime.datetime(2015, 1, 1)
     excluded_channels = discord_db.channels.find({"excluded": True, "guild_id": guild_id}).distinct("_id")
-    query = discord_db.messages.find({"created_at": {"$gt": last_week}, "guild_id": guild_id, "user_id": user_id})
+    query = discord_db.messages.find({"created_at": {"$gt": last_week}, "guild_id": guild_id, "user_id": user_id},
+                                     projection=SCORE_PROJECTION)
+    query.sort("created_at", pymongo.ASCENDING)
     for message in query:
         timestamp = message.get("created_at")
         channel_id = message.get("channel_id")
@@ -79,3 +93,111 @@ def get_user_score(user_id, guild_id):
             last_message = timestamp
             score += 1
     return score
+
+
+def score_pipeline(match):
+    """Groups matching messages by user and runs the 60-second active-time count on the server.
+
+    This is the same greedy count as count_scores (a message scores if it's at least 60 seconds after the last
+    message that scored), done with $reduce over each user's sorted message times. Calendar-minute buckets
+    ($dateTrunc) would be cheaper, but give different scores for activity straddling a minute boundary.
+    """
+    return [
+        {
+            "$match": match
+        },
+        {
+            "$project": {"_id": 0, "user_id": 1, "created_at": 1}
+        },
+        {
+            "$sort": {"created_at": pymongo.ASCENDING}
+        },
+        {
+            "$group": {
+                "_id": "$user_id",
+                "first": {"$first": "$created_at"},
+                "times": {"$push": "$created_at"}
+            }
+        },
+        {
+            "$project": {
+                "first": 1,
+                "score": {
+                    "$reduce": {
+                        "input": "$times",
+                        "initialValue": {"last": datetime.datetime(2015, 1, 1), "score": 0},
+                        "in": {
+                            "$cond": [
+                                {"$gte": [{"$subtract": ["$$this", "$$value.last"]}, 60 * 1000]},
+                                {"last": "$$this", "score": {"$add": ["$$value.score", 1]}},
+                                "$$value"
+                            ]
+                        }
+                    }
+                }
+            }
+        },
+        {
+            "$project": {"first": 1, "score": "$score.score"}
+        }
+    ]
+
+
+def get_guild_score_aggregated(guild_id, discord_db=None):
+    """Same result as get_guild_score, but only (user_id, score) pairs come back from the database."""
+    if discord_db is None:
+        discord_db = get_client().discord
+    last_week = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+    excluded_channels = discord_db.channels.find({"excluded": True, "guild_id": guild_id}).distinct("_id")
+    pipeline = score_pipeline({"created_at": {"$gt": last_week}, "guild_id": guild_id,
+                               "channel_id": {"$nin": excluded_channels}})
+    pipeline += [
+        {
+            # Uses the members index on _id.user_id (see MongoDB.ensure_indexes).
+            "$lookup": {
+                "from": "members",
+                "localField": "_id",
+                "foreignField": "_id.user_id",
+                "as": "member"
+            }
+        },
+        {
+            "$match": {
+                "member": {"$elemMatch": {"_id.guild_id": guild_id, "deleted": False}}
+            }
+        },
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "_id",
+                "foreignField": "_id",
+                "as": "user"
+            }
+        },
+        {
+            "$match": {
+                "user.bot": False
+            }
+        },
+        {
+            "$sort": {"score": pymongo.DESCENDING, "first": pymongo.ASCENDING}
+        },
+        {
+            "$project": {"_id": 1, "score": 1}
+        }
+    ]
+    aggregation = discord_db.messages.aggregate(pipeline, allowDiskUse=True)
+    return [(x.get("_id"), x.get("score")) for x in aggregation]
+
+
+def get_user_score_aggregated(user_id, guild_id, discord_db=None):
+    if discord_db is None:
+        discord_db = get_client().discord
+    last_week = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+    excluded_channels = discord_db.channels.find({"excluded": True, "guild_id": guild_id}).distinct("_id")
+    pipeline = score_pipeline({"created_at": {"$gt": last_week}, "guild_id": guild_id, "user_id": user_id,
+                               "channel_id": {"$nin": excluded_channels}})
+    results = list(discord_db.messages.aggregate(pipeline))
+    if len(results) == 0:
+        return 0
+    return results[0].get("score")
@@ -1,11 +1,19 @@
+import asyncio
+import hashlib
+import time
+
 import pydub
 
 from pydub import effects
 from gtts import gTTS
 from io import BytesIO
 
+from src.helpers.cache_helper import TTLCache
+from src.helpers.pool_helper import WorkerPool
+
 
 def get_speak_file(message_content, lang, speed, tld):
+    """Raw s16le PCM for discord.PCMAudio, as bytes so it can be cached and replayed."""
     pre_processed = BytesIO()
     post_processed = BytesIO()
     try:
@@ -16,6 +24,61 @@ def get_speak_file(message_content, lang, speed, tld):
         segment = effects.speedup(segment, 1.25, 150, 25)  # normally 1.25
         frames = int(95000 * 1 / speed)
         segment.set_frame_rate(frames).export(post_processed, format="s16le")
-        return post_processed
+        return post_processed.getvalue()
     except AssertionError:
-        return post_processed
+        return post_processed.getvalue()
+
+
+class SpeechSynthesizer:
+    """Synthesises speech in a long-lived pool of workers, with the PCM cached by (text, lang, tld, speed).
+
+    Audio is evicted least recently used first once max_bytes of it is cached, and asking for audio that's already
+    being synthesised waits for that synthesis rather than starting another.
+    """
+
+    def __init__(self, loop, max_workers=2, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=24 * 60 * 60,
+                 timeout=30):
+        self.loop = loop
+        self.pool = WorkerPool(loop, max_workers=max_workers, warm_modules=("src.helpers.tts_helper",))
+        self.cache = TTLCache(max_entries, ttl=ttl, max_bytes=max_bytes, sizeof=len)
+        self.timeout = timeout
+        self.pending = {}
+        self.syntheses = 0
+        self.shared = 0
+        self.total_synthesis = 0.0
+
+    @staticmethod
+    def make_key(text, lang, tld, speed):
+        return hashlib.sha1(repr((text, lang, tld, float(speed))).encode("utf-8")).hexdigest()
+
+    async def synthesize(self, text, lang, tld, speed):
+        key = self.make_key(text, lang, tld, speed)
+        audio = self.cache.get(key)
+        if audio is not None:
+            return audio
+        synthesis = self.pending.get(key)
+        if synthesis is None:
+            synthesis = self.loop.create_task(self.run_synthesis(key, text, lang, tld, speed))
+            self.pending[key] = synthesis
+            synthesis.add_done_callback(lambda _: self.pending.pop(key, None))
+        else:
+            self.shared += 1
+        # Shielded, so one listener giving up doesn't cancel the synthesis for everyone else waiting on it.
+        return await asyncio.shield(synthesis)
+
+    async def run_synthesis(self, key, text, lang, tld, speed):
+        started_at = time.perf_counter()
+        audio = await self.pool.run(get_speak_file, text, lang, speed, tld, timeout=self.timeout)
+        self.syntheses += 1
+        self.total_synthesis += time.perf_counter() - started_at
+        # Empty audio means gTTS had nothing to say, which isn't worth keeping.
+        if len(audio) > 0:
+            self.cache.set(key, audio)
+        return audio
+
+    @property
+    def average_synthesis(self):
+        return self.total_synthesis / self.syntheses if self.syntheses else 0.0
+
+    async def close(self):
+        await self.pool.shutdown()
@@ -97,3 +97,44 @@ purge_all = -1  # DO NOT CHANGE THIS FOR FEAR OF DEATH
 confirm_amount = 10
 
 data_path = os.path.join(os.getcwd(), "data.json")  # src/storage/data.json
+
+# Settings for back-dating statistics
+backfill_concurrency = 4  # Channels fetched at once, across every guild
+backfill_requests_per_second = 8  # Leaves the rest of the global rate limit for everything else
+backfill_checkpoint_seconds = 10
+message_stats_recount_hours = 24  # Every guild's message stats are recounted, in case retried writes counted twice
+
+# Settings for the member join order cache (used by oldest and OG checks)
+latest_joins_concurrency = 4
+latest_joins_max_age = 30 * 60  # Seconds before a reconnect rebuilds it
+
+# Settings for the Hypixel caches (entries are evicted least recently used first past either limit)
+hypixel_card_cache_size = 2048
+hypixel_card_cache_bytes = 64 * 1024 * 1024
+hypixel_head_cache_size = 4096
+hypixel_head_cache_bytes = 16 * 1024 * 1024
+hypixel_stats_cache_size = 2048
+hypixel_stats_cache_bytes = 32 * 1024 * 1024
+hypixel_uuid_cache_size = 10000
+hypixel_uuid_cache_seconds = 6 * 60 * 60
+hypixel_unknown_player_seconds = 10 * 60  # Usernames that don't exist yet might be taken soon
+# Send the website a card that's over 5 minutes old straight away and redraw it in the background, rather than waiting
+hypixel_image_stale_while_revalidate = True
+
+# Settings for how often tracked Hypixel players are polled (online or recently active players are polled every update)
+# Pairs of (offline for under this many seconds, poll every this many seconds)
+hypixel_poll_intervals = ((30 * 60, 90), (24 * 60 * 60, 5 * 60), (7 * 24 * 60 * 60, 15 * 60))
+hypixel_dormant_poll_interval = 60 * 60
+hypixel_tracker_rate_share = 0.75  # Of the API rate limit, the rest is left for commands and the website
+
+# Settings for the Skyblock price rollups
+skyblock_rollup_refresh_hours = 48  # Recent updates are rolled up again in full, older ones only for newly sold items
+skyblock_chart_cache_size = 256
+skyblock_chart_cache_bytes = 32 * 1024 * 1024
+
+# Settings for text to speech
+tts_workers = 2  # Synthesis processes, kept running between messages
+tts_cache_size = 1024
+tts_cache_bytes = 64 * 1024 * 1024  # Of raw PCM, which is about 190KB per second of speech
+tts_cache_seconds = 24 * 60 * 60
+tts_synthesis_timeout = 30
@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from src.helpers.buffer_helper import WriteBuffer
+
+
+class FakeCollection:
+    """Applies $set and $inc updates by _id, in memory."""
+
+    def __init__(self):
+        self.documents = {}
+
+    async def bulk_write(self, requests, ordered=True):
+        upserted_ids = {}
+        for index, request in enumerate(requests):
+            document_id = request._filter["_id"]
+            key = WriteBuffer.make_key(document_id)
+            if key not in self.documents:
+                if not request._upsert:
+                    continue
+                self.documents[key] = {}
+                upserted_ids[index] = document_id
+            document = self.documents[key]
+            document.update(request._doc.get("$set", {}))
+            for field, value in request._doc.get("$inc", {}).items():
+                document[field] = document.get(field, 0) + value
+        return SimpleNamespace(upserted_ids=upserted_ids)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, collection_name):
+        self[collection_name] = FakeCollection()
+        return self[collection_name]
+
+
+def count_upserted(upserted):
+    return [("counts", "messages", {"$inc": {"count": 1}}, True) for _ in upserted]
+
+
+def test_only_new_documents_are_counted():
+    async def run():
+        database = FakeDatabase()
+        buffer = WriteBuffer(database)
+        buffer.on_upserted["messages"] = count_upserted
+        await buffer.set("messages", 1, {"content": "a"}, upsert=True)
+        await buffer.set("messages", 2, {"content": "b"}, upsert=True)
+        assert await buffer.flush()
+        # Already stored, so written again but not counted again.
+        await buffer.set("messages", 1, {"content": "a"}, upsert=True)
+        await buffer.set("messages", 3, {"content": "c"}, upsert=True)
+        # The counts go out with the flush that stored the messages.
+        async with buffer.paused() as flushed:
+            assert flushed
+            assert database["counts"].documents["messages"]["count"] == 3
+        assert buffer.pending_count == 0
+        assert buffer.flushes == 2
+        await buffer.close()
+
+    asyncio.run(run())
+
+
+def test_paused_holds_off_flushes():
+    async def run():
+        database = FakeDatabase()
+        buffer = WriteBuffer(database)
+        async with buffer.paused():
+            await buffer.set("messages", 1, {"content": "a"}, upsert=True)
+            flush = asyncio.ensure_future(buffer.flush())
+            await asyncio.sleep(0)
+            assert not flush.done()
+            assert 1 not in database["messages"].documents
+        assert await flush
+        assert database["messages"].documents[1] == {"content": "a"}
+        await buffer.close()
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+# hypixel_helper imports the bot (and so all of its requirements).
+pytest.importorskip("src.helpers.hypixel_helper")
+
+from src.helpers.hypixel_helper import EASY_LEVELS_XP, XP_PER_PRESTIGE, get_level_from_xp, get_levels_from_xp
+from src.helpers.hypixel_stats import HypixelStats, HypixelStatsHistory
+
+# Either side of each easy level, the end of the easy levels and each prestige.
+BOUNDARIES = [0, 1, 499, 500, 1499, 1500, 3499, 3500, 6999, 7000, 7001, 11999, 12000, XP_PER_PRESTIGE - 1]
+for prestige in range(1, 12):
+    BOUNDARIES += [XP_PER_PRESTIGE * prestige + offset
+                   for offset in (-1, 0, 499, 500, 3500, EASY_LEVELS_XP - 1, EASY_LEVELS_XP)]
+
+
+def random_stats(generator, experience):
+    stats = {"experience": experience}
+    for mode in HypixelStatsHistory.game_modes:
+        stats[mode] = {field: generator.randrange(0, 500) for field in HypixelStatsHistory.fields}
+    return stats
+
+
+def test_levels_match_at_boundaries():
+    levels = get_levels_from_xp(BOUNDARIES)
+    for experience, level in zip(BOUNDARIES, levels):
+        assert level == get_level_from_xp(experience), experience
+
+
+def test_levels_match_at_random():
+    generator = random.Random(0)
+    experience = [generator.uniform(0, XP_PER_PRESTIGE * 12) for _ in range(5000)]
+    levels = get_levels_from_xp(experience)
+    for single, level in zip(experience, levels):
+        # Both round to 2 places, but numpy and round() can land either side of a halfway value.
+        assert abs(level - get_level_from_xp(single)) <= 0.01 + 1e-9, single
+
+
+def test_history_matches_stats():
+    generator = random.Random(1)
+    all_stats = [random_stats(generator, experience) for experience in BOUNDARIES]
+    # A player without any final deaths, and a document missing its stats.
+    for mode in HypixelStatsHistory.game_modes:
+        all_stats[0][mode]["deaths"] = 0
+    documents = [{"stats": stats} for stats in all_stats] + [{}]
+    history = HypixelStatsHistory.from_documents(documents)
+    assert len(history) == len(documents)
+    for index, document in enumerate(documents):
+        stats = HypixelStats.from_dict(document.get("stats"))
+        assert history.kills[index] == stats.kills
+        assert history.deaths[index] == stats.deaths
+        assert history.games_played[index] == stats.games_played
+        assert history.fkdr[index] == pytest.approx(stats.fkdr)
+        assert history.level[index] == stats.level
+        assert history.threat_index[index] == pytest.approx(stats.threat_index)
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import random
+from types import SimpleNamespace
+
+from src.helpers.score_helper import ACTIVITY_WINDOW, GuildActivity, ScoreEngine
+from src.helpers.sync_mongo_helper import count_scores
+
+GUILD_ID = 1
+MEMBERS = set(range(100, 120))
+EXCLUDED = {2}
+
+
+class PreloadedEngine(ScoreEngine):
+    """Loads guilds from memory rather than Mongo."""
+
+    def __init__(self, guild):
+        super().__init__(SimpleNamespace(discord_db=SimpleNamespace(activity=None)))
+        self.stored_guild = guild
+
+    async def load_guild(self, guild_id):
+        return self.stored_guild
+
+
+def make_guild():
+    guild = GuildActivity(GUILD_ID)
+    guild.members = set(MEMBERS)
+    guild.excluded = set(EXCLUDED)
+    return guild
+
+
+def make_messages(count, seed):
+    generator = random.Random(seed)
+    start = datetime.datetime.utcnow().replace(microsecond=0) - ACTIVITY_WINDOW + datetime.timedelta(hours=1)
+    users = sorted(MEMBERS) + [999]
+    messages = []
+    for _ in range(count):
+        user_index = generator.randrange(len(users))
+        # Whole minutes, so plenty land exactly 60 seconds apart, plus a second per user so no two users' messages
+        # share a time (the full scan orders those by arrival, which can't be reproduced here).
+        minutes = generator.choice((generator.randrange(0, 6 * 24 * 60), generator.randrange(0, 40)))
+        messages.append({"user_id": users[user_index], "channel_id": generator.randrange(4),
+                         "created_at": start + datetime.timedelta(seconds=minutes * 60 + user_index)})
+    return messages
+
+
+def full_scan(messages):
+    unique = {(x["user_id"], x["created_at"], x["channel_id"]): x for x in messages}
+    ordered = sorted(unique.values(), key=lambda x: (x["created_at"], x["user_id"]))
+    return count_scores(ordered, MEMBERS, EXCLUDED)
+
+
+def live_scores(engine, messages):
+    for message in messages:
+        engine.add_activity(GUILD_ID, message["user_id"], message["channel_id"], message["created_at"])
+    return asyncio.run(engine.get_guild_score(GUILD_ID))
+
+
+def test_live_scores_match_full_scan_in_order():
+    for seed in range(20):
+        messages = make_messages(2000, seed)
+        messages.sort(key=lambda x: x["created_at"])
+        engine = PreloadedEngine(make_guild())
+        engine.guilds[GUILD_ID] = engine.stored_guild
+        assert live_scores(engine, messages) == full_scan(messages)
+
+
+def test_live_scores_match_full_scan_out_of_order():
+    for seed in range(20):
+        messages = make_messages(2000, seed)
+        engine = PreloadedEngine(make_guild())
+        engine.guilds[GUILD_ID] = engine.stored_guild
+        # Duplicates, as backfill and the live listener can both see the same message.
+        assert live_scores(engine, messages + messages[:200]) == full_scan(messages)
+
+
+def test_activity_before_load_is_held():
+    messages = make_messages(500, 0)
+    engine = PreloadedEngine(make_guild())
+    assert live_scores(engine, messages) == full_scan(messages)
+    assert GUILD_ID not in engine.held
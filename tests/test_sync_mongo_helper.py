@@ -0,0 +1,68 @@
+import datetime
+import os
+import random
+import uuid
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+from src.helpers.sync_mongo_helper import get_guild_score, get_guild_score_aggregated, get_user_score, \
+    get_user_score_aggregated
+
+# The aggregation can only be checked against a real server, e.g. MONGO_TEST_URI=mongodb://localhost:27017
+MONGO_TEST_URI = os.environ.get("MONGO_TEST_URI")
+GUILD_ID = 1
+OTHER_GUILD_ID = 2
+EXCLUDED_CHANNEL = 12
+BOT_ID = 150
+LEFT_ID = 151
+
+
+@pytest.fixture(scope="module")
+def discord_db():
+    if MONGO_TEST_URI is None:
+        pytest.skip("MONGO_TEST_URI isn't set")
+    client = pymongo.MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=2000)
+    database_name = f"test_scores_{uuid.uuid4().hex[:8]}"
+    database = client[database_name]
+    fill(database)
+    yield database
+    client.drop_database(database_name)
+
+
+def fill(database):
+    generator = random.Random(0)
+    users = list(range(100, 120)) + [BOT_ID, LEFT_ID]
+    database.users.insert_many([{"_id": user_id, "bot": user_id == BOT_ID} for user_id in users])
+    members = [{"_id": {"user_id": user_id, "guild_id": GUILD_ID}, "deleted": user_id == LEFT_ID} for user_id in users]
+    # Members of another guild only, who mustn't be scored here.
+    members += [{"_id": {"user_id": user_id, "guild_id": OTHER_GUILD_ID}, "deleted": False} for user_id in (160, 161)]
+    database.members.insert_many(members)
+    database.members.create_index("_id.user_id")
+    database.channels.insert_many([{"_id": channel_id, "guild_id": GUILD_ID,
+                                    "excluded": channel_id == EXCLUDED_CHANNEL} for channel_id in range(10, 14)])
+    start = datetime.datetime.utcnow().replace(microsecond=0) - datetime.timedelta(days=8)
+    senders = users + [160, 161]
+    messages = []
+    for message_id in range(5000):
+        user_index = generator.randrange(len(senders))
+        # Whole minutes, so plenty land exactly 60 seconds apart, plus a second per user so no two users share a
+        # first message time (which the two paths would order differently). Some are outside the week.
+        minutes = generator.choice((generator.randrange(0, 8 * 24 * 60), 8 * 24 * 60 - generator.randrange(0, 60)))
+        messages.append({"_id": message_id, "user_id": senders[user_index], "guild_id": GUILD_ID,
+                         "channel_id": generator.randrange(10, 14),
+                         "created_at": start + datetime.timedelta(seconds=minutes * 60 + user_index)})
+    database.messages.insert_many(messages)
+
+
+def test_guild_scores_match(discord_db):
+    expected = get_guild_score(GUILD_ID, discord_db)
+    assert len(expected) > 0
+    assert get_guild_score_aggregated(GUILD_ID, discord_db) == expected
+
+
+def test_user_scores_match(discord_db):
+    for user_id in list(range(100, 120)) + [BOT_ID]:
+        assert get_user_score_aggregated(user_id, GUILD_ID, discord_db) == get_user_score(user_id, GUILD_ID,
+                                                                                          discord_db)